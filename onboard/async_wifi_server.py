@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Asyncio WiFi Server for PTZ Camera Control.
+This module serves the same TCP protocol as WifiServer (JSON and text
+commands, newline-delimited status broadcasts) from a single event loop
+thread instead of one thread per client, so hundreds of monitoring clients
+cost sockets rather than threads.
+"""
+
+import time
+import socket
+import asyncio
+import logging
+import threading
+from collections import deque
+
+from command_protocol import CommandStream, encode_status
+from wifi_server import WifiServer
+
+logger = logging.getLogger('async_wifi_server')
+
+# Transport buffer above which a client writer waits; keeps queued status
+# messages in the drop-oldest queue rather than in the transport
+WRITE_BUFFER_HIGH = 16384
+
+class AsyncClientWriter:
+    """Sends status messages to one client from its own task
+
+    The asyncio counterpart of ClientWriter: a small bounded queue that
+    drops the oldest messages when the client falls behind, and a backlog
+    limit past which the client is disconnected.
+    """
+
+    def __init__(self, writer, client_addr, stats, queue_size=8, backlog_limit=5.0):
+        """Initialize the client writer
+
+        Args:
+            writer: asyncio StreamWriter of the client connection
+            client_addr: Client address, for logging
+            stats: FanoutStats shared by all clients of the server
+            queue_size (int): Messages queued before the oldest is dropped
+            backlog_limit (float): Seconds a message may wait undelivered
+                before the client is disconnected
+        """
+        self.writer = writer
+        self.client_addr = client_addr
+        self.stats = stats
+        self.queue = deque(maxlen=queue_size)
+        self.backlog_limit = backlog_limit
+        self.behind_since = None  # Creation time of the oldest undelivered message
+        self.ready = asyncio.Event()
+        self.task = None
+        self.closed = False
+
+    def start(self):
+        """Start the writer task (call on the event loop)"""
+        self.writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+        self.task = asyncio.ensure_future(self._writer_loop())
+
+    def stop(self):
+        """Stop the writer task, abandoning queued messages"""
+        self.closed = True
+        self.ready.set()
+        # Keep the reference; the loop only holds tasks weakly
+        if self.task:
+            self.task.cancel()
+
+    async def wait_closed(self):
+        """Wait for the writer task to finish after stop()"""
+        if self.task:
+            await asyncio.wait([self.task])
+
+    def send(self, message, timestamp):
+        """Queue a message without blocking (call on the event loop)
+
+        Args:
+            message (bytes): Complete framed message
+            timestamp (float): perf_counter time the message was created
+        """
+        if self.closed:
+            return
+
+        if len(self.queue) == self.queue.maxlen:
+            self.stats.record_dropped()
+        self.queue.append((message, timestamp))
+        if self.behind_since is None:
+            self.behind_since = timestamp
+
+        lag = time.perf_counter() - self.behind_since
+        if lag > self.backlog_limit:
+            self._disconnect_slow(lag)
+            return
+
+        self.ready.set()
+
+    def _disconnect_slow(self, lag):
+        """Drop a client that has been behind for longer than the backlog limit"""
+        logger.warning(f"Client {self.client_addr} is {lag:.1f}s behind, disconnecting")
+        self.stats.record_slow_disconnect()
+        self.stop()
+        # The client handler sees the connection drop and cleans up
+        self.writer.transport.abort()
+
+    async def _writer_loop(self):
+        """Send queued messages until cancelled or the connection fails"""
+        # Also check the closed flag: wait_for() can swallow a cancellation
+        # that arrives just as the drain completes
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+
+                while self.queue and not self.closed:
+                    message, timestamp = self.queue.popleft()
+                    self.writer.write(message)
+                    try:
+                        await asyncio.wait_for(self.writer.drain(), self.backlog_limit)
+                    except asyncio.TimeoutError:
+                        self._disconnect_slow(time.perf_counter() - self.behind_since)
+                        return
+                    self.stats.record_sent(time.perf_counter() - timestamp)
+                    self.behind_since = self.queue[0][1] if self.queue else None
+        except asyncio.CancelledError:
+            pass
+        except (ConnectionError, OSError) as e:
+            logger.warning(f"Error sending status to {self.client_addr}: {e}")
+
+class AsyncWifiServer(WifiServer):
+    """WiFi server for PTZ camera control running on an asyncio event loop
+
+    Drop-in replacement for WifiServer: start(), stop() and send_status()
+    may be called from any thread. Commands are parsed and dispatched by the
+    same methods as the threaded server.
+    """
+
+    def __init__(self, camera_controller, video_streamer, port=8000, queue_size=8, backlog_limit=5.0,
+                 arbiter=None, broadcaster=None):
+        """Initialize the WiFi server
+
+        Args:
+            camera_controller: CameraController instance
+            video_streamer: VideoStreamer instance
+            port: TCP server port (default: 8000)
+            queue_size: Status messages queued per client before the oldest
+                is dropped
+            backlog_limit: Seconds a client may fall behind on status
+                messages before it is disconnected
+            arbiter: MotionArbiter giving each client its own motion
+                session, None to drive the camera controller directly
+            broadcaster: StatusBroadcaster that encodes status updates once
+                for the clients of every transport, None to send them to
+                this server's clients only
+        """
+        super().__init__(camera_controller, video_streamer, port, queue_size, backlog_limit, arbiter,
+                         broadcaster)
+        self.clients = {}  # StreamWriter -> AsyncClientWriter
+        self.loop = None
+        self.server = None
+        self.wakeup = None
+        self.ready = threading.Event()
+
+    def start(self):
+        """Start the WiFi server"""
+        if self.running:
+            logger.warning("WiFi server is already running")
+            return
+
+        self.running = True
+        self.ready.clear()
+
+        # Register for stream quality reports
+        self.video_streamer.set_status_report_callback(self._handle_quality_report)
+
+        # Start event loop thread
+        self.server_thread = threading.Thread(target=self._run_loop)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.ready.wait(timeout=5.0)
+
+        logger.info(f"WiFi server started on port {self.port} (asyncio)")
+        return True
+
+    def stop(self):
+        """Stop the WiFi server"""
+        if not self.running:
+            logger.warning("WiFi server is not running")
+            return
+
+        self.running = False
+        self._wake()
+
+        # Wait for the event loop to close every connection and exit
+        if self.server_thread:
+            self.server_thread.join(timeout=2.0)
+
+        logger.info("WiFi server stopped")
+
+    def send_status(self, status):
+        """Send a status update to all connected clients
+
+        Safe to call from any thread; the message is queued for every
+        client's writer task without blocking the caller.
+
+        Args:
+            status: Status data dictionary to send
+        """
+        if not self.running or not self.loop:
+            return
+
+        if self.broadcaster:
+            self.broadcaster.publish(status)
+            return
+
+        try:
+            message = encode_status(status)
+        except Exception as e:
+            logger.error(f"Error serializing status data: {e}")
+            return
+
+        self.send_encoded(message)
+
+    def send_encoded(self, message):
+        """Send an already encoded status message to all connected clients
+
+        Args:
+            message (bytes): Framed message from encode_status()
+        """
+        if not self.running or not self.loop:
+            return
+
+        try:
+            self.loop.call_soon_threadsafe(self._broadcast, message, time.perf_counter())
+        except RuntimeError:
+            # Event loop already closed
+            pass
+
+    def _broadcast(self, message, timestamp):
+        """Queue a message for every client (runs on the event loop)"""
+        for client_writer in list(self.clients.values()):
+            client_writer.send(message, timestamp)
+
+    def _handle_quality_report(self, quality_data):
+        """Handle quality report from video streamer"""
+        super()._handle_quality_report(quality_data)
+        if self.restart_scheduled:
+            self._wake()
+
+    def _wake(self):
+        """Wake the event loop to act on a stop or scheduled restart"""
+        if self.loop and self.wakeup:
+            try:
+                self.loop.call_soon_threadsafe(self.wakeup.set)
+            except RuntimeError:
+                pass
+
+    def _run_loop(self):
+        """Run the event loop until the server is stopped"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        try:
+            self.loop.run_until_complete(self._serve())
+        except Exception as e:
+            logger.error(f"Server error: {e}")
+        finally:
+            self.ready.set()
+            self.loop.close()
+            self.loop = None
+            logger.info("Server loop ended")
+
+    async def _serve(self):
+        """Listen for clients and handle scheduled restarts until stopped"""
+        self.wakeup = asyncio.Event()
+        try:
+            await self._listen()
+        finally:
+            self.ready.set()
+
+        try:
+            while self.running:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+
+                # Handle scheduled server restart if needed
+                if self.restart_scheduled and self.running:
+                    logger.info("Performing scheduled server restart")
+                    await self._restart_wifi_service_async()
+                    self.restart_scheduled = False
+        finally:
+            self._close_server()
+            for writer, client_writer in list(self.clients.items()):
+                client_writer.stop()
+                writer.close()
+            # Let the connection handlers and writer tasks finish
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            if tasks:
+                await asyncio.wait(tasks, timeout=1.0)
+
+    async def _listen(self):
+        """Open the listening socket"""
+        self.server = await asyncio.start_server(
+            self._handle_connection, '0.0.0.0', self.port,
+            reuse_address=True, backlog=128
+        )
+        self.server_socket = self.server.sockets[0]
+        logger.info(f"Server listening on 0.0.0.0:{self.port}")
+
+    def _close_server(self):
+        """Stop accepting new clients, keeping connected ones"""
+        if self.server:
+            self.server.close()
+            self.server = None
+            self.server_socket = None
+
+    async def _restart_wifi_service_async(self):
+        """Restart WiFi service after poor quality reports, without blocking clients"""
+        logger.info("Restarting WiFi service")
+
+        # In a real implementation, this would restart the actual WiFi service
+        # For now, we'll just simulate a restart by closing and reopening the server socket
+        self._close_server()
+        await asyncio.sleep(5)
+
+        try:
+            await self._listen()
+            logger.info(f"WiFi service restarted, listening on 0.0.0.0:{self.port}")
+        except Exception as e:
+            logger.error(f"Error restarting WiFi service: {e}")
+
+    async def _handle_connection(self, reader, writer):
+        """Handle communication with a connected client"""
+        client_addr = writer.get_extra_info('peername')
+        client_socket = writer.get_extra_info('socket')
+        if client_socket is not None:
+            # Status messages are small; don't hold them back for batching
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        client_writer = AsyncClientWriter(
+            writer, client_addr, self.fanout_stats,
+            queue_size=self.queue_size,
+            backlog_limit=self.backlog_limit
+        )
+        client_writer.start()
+        self.clients[writer] = client_writer
+        logger.info(f"New client connected: {client_addr}")
+        stream = CommandStream()
+        commands, session = self._open_commands(client_addr)
+
+        try:
+            while self.running:
+                data = await reader.read(4096)
+
+                if not data:
+                    # Client disconnected, a last command may lack its newline
+                    commands.apply_commands(stream.flush())
+                    logger.info(f"Client disconnected: {client_addr}")
+                    break
+
+                # A read can hold several commands or part of one
+                messages = stream.feed(data)
+                reply = stream.pop_reply()
+                if reply:
+                    client_writer.send(reply, time.perf_counter())
+                commands.apply_commands(messages)
+
+        except (ConnectionError, OSError) as e:
+            logger.info(f"Client connection lost: {client_addr} ({e})")
+        except Exception as e:
+            logger.error(f"Error handling client {client_addr}: {e}")
+        finally:
+            self.clients.pop(writer, None)
+            client_writer.stop()
+            if session:
+                session.close()
+            writer.close()
+            await client_writer.wait_closed()
+            logger.info(f"Client handler ended for {client_addr}")
+
+if __name__ == "__main__":
+    # Set up logging for standalone testing
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # Mock classes for testing
+    class MockCameraController:
+        def process_command(self, command):
+            print(f"Processing command: {command}")
+        def set_pan(self, speed):
+            print(f"Pan speed: {speed}")
+        def set_tilt(self, speed):
+            print(f"Tilt speed: {speed}")
+        def set_pan_tilt(self, pan_speed, tilt_speed):
+            print(f"Pan/tilt speed: {pan_speed}/{tilt_speed}")
+        def set_zoom(self, level):
+            print(f"Zoom level: {level}")
+        def set_camera_mode(self, mode):
+            print(f"Camera mode: {mode}")
+        def get_camera_mode(self):
+            return 0
+        def get_position(self):
+            return {"pan": 0.0, "tilt": 0.0, "zoom": 0, "timestamp": time.time()}
+
+    class MockVideoStreamer:
+        def set_status_report_callback(self, callback):
+            self.callback = callback
+        def get_stream_url(self):
+            return "rtsp://localhost:8554/stream"
+        def get_quality_report(self):
+            return {"quality": "good", "dropped_frames": 0}
+
+    # Test the WiFi server
+    server = AsyncWifiServer(MockCameraController(), MockVideoStreamer())
+    server.start()
+
+    try:
+        print(f"Server running on port {server.port}")
+        print("Press Ctrl+C to stop...")
+
+        # Keep running for testing
+        while True:
+            time.sleep(10)
+            server.send_status({"heartbeat": time.time()})
+
+    except KeyboardInterrupt:
+        print("Test interrupted")
+    finally:
+        server.stop()
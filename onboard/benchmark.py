@@ -0,0 +1,631 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the PTZ camera onboard server.
+
+Each subcommand measures one hot path in isolation so changes can be
+compared against the code they replace. None of them need camera hardware.
+
+Usage:
+  python benchmark.py <benchmark> [--iterations N] [--samples N] [--clients N] [--monitors N]
+
+Example:
+  python benchmark.py pelco --iterations 200000
+  python benchmark.py commands --clients 8
+"""
+
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import selectors
+import threading
+
+from pelco_d import build_frame
+from motion_arbiter import MotionArbiter
+from camera_controller import CameraController, LoopbackTransport
+from command_protocol import (
+    LineDecoder, CommandStream, encode_status, encode_binary_command, MSG_PAN_TILT
+)
+from command_registry import CommandRegistry
+from wifi_server import WifiServer
+from bt_server import BluetoothServer, MockBluetooth
+from async_wifi_server import AsyncWifiServer
+
+def _report(name, iterations, elapsed, baseline=None):
+    """Print a single benchmark result line"""
+    per_op_ns = elapsed / iterations * 1e9
+    line = f"  {name:<32} {per_op_ns:10.1f} ns/op {iterations / elapsed:14,.0f} ops/s"
+    if baseline:
+        line += f"  ({baseline / elapsed:.1f}x)"
+    print(line)
+
+def _report_latencies(name, latencies):
+    """Print percentile summary of latency samples in seconds"""
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    def percentile(p):
+        return latencies[min(count - 1, int(count * p))] * 1e6
+
+    print(f"  {name:<32} p50 {percentile(0.50):8.1f} us  p95 {percentile(0.95):8.1f} us"
+          f"  p99 {percentile(0.99):8.1f} us  max {latencies[-1] * 1e6:8.1f} us")
+
+class _CountingController:
+    """Camera controller stand-in that only counts the commands it receives"""
+
+    def __init__(self):
+        self.commands = 0
+        self.condition = threading.Condition()
+
+    def _count(self, *args):
+        with self.condition:
+            self.commands += 1
+            self.condition.notify_all()
+
+    process_command = set_pan = set_tilt = set_pan_tilt = set_zoom = set_camera_mode = _count
+
+    def get_camera_mode(self):
+        return 0
+
+    def get_position(self):
+        return {"pan": None, "tilt": None, "zoom": None, "timestamp": None}
+
+    def wait_for(self, count, timeout):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.commands >= count, timeout)
+
+class _StaticStreamer:
+    """Video streamer stand-in for servers that only need its status"""
+
+    def set_status_report_callback(self, callback):
+        pass
+
+    def get_stream_url(self):
+        return "rtsp://127.0.0.1:8554/rgb"
+
+    def get_quality_report(self):
+        return {"quality": "good"}
+
+class _NullSocket:
+    """Client socket stand-in that accepts and discards everything"""
+
+    def sendall(self, data):
+        pass
+
+def _legacy_send_status(status, sockets):
+    """Status broadcast as previously done by WifiServer.send_status"""
+    status_json = json.dumps(status)
+    for client_socket in sockets:
+        message = status_json.encode('utf-8') + b'\n'
+        client_socket.sendall(message)
+
+def _shared_send_status(status, sockets):
+    """Status broadcast with one shared encoded buffer"""
+    message = encode_status(status)
+    for client_socket in sockets:
+        client_socket.sendall(message)
+
+def _status_sample():
+    """A status report like WifiServer._send_status_report builds"""
+    return {"camera_mode": 0, "position": {"pan": 12.5, "tilt": -3.0, "zoom": 512, "timestamp": time.time()},
+            "stream_url": "rtsp://127.0.0.1:8554/rgb", "stream_quality": {"quality": "good"},
+            "connection_quality": "good", "timestamp": time.time()}
+
+def _legacy_process_line(controller, line):
+    """Command parsing and dispatch as previously done by WifiServer._process_line"""
+    if line.startswith(b'{'):
+        command = json.loads(line)
+        # CameraController.process_command
+        cmd_type = command.get('type', '').lower()
+        value = command.get('value', 0)
+        if cmd_type == 'pan':
+            controller.set_pan(value)
+        elif cmd_type == 'tilt':
+            controller.set_tilt(value)
+        elif cmd_type == 'zoom':
+            controller.set_zoom(value)
+        elif cmd_type == 'mode':
+            controller.set_camera_mode(value)
+        return
+
+    cmd_parts = line.decode('utf-8', errors='replace').split()
+    if not cmd_parts:
+        return
+    cmd_type = cmd_parts[0].lower()
+    if cmd_type == "pan":
+        if len(cmd_parts) > 1:
+            controller.set_pan(int(cmd_parts[1]))
+    elif cmd_type == "tilt":
+        if len(cmd_parts) > 1:
+            controller.set_tilt(int(cmd_parts[1]))
+    elif cmd_type == "zoom":
+        if len(cmd_parts) > 1:
+            controller.set_zoom(int(cmd_parts[1]))
+    elif cmd_type == "mode":
+        if len(cmd_parts) > 1:
+            controller.set_camera_mode(int(cmd_parts[1]))
+    elif cmd_type == "stop":
+        controller.set_pan(0)
+        controller.set_tilt(0)
+
+def _command_stream(count):
+    """Joystick-like mix of JSON and text commands, newline-delimited"""
+    commands = [b'{"type": "pan", "value": 50}\n', b'tilt -20\n',
+                b'{"type": "tilt", "value": 0}\n', b'pan 0\n']
+    return b''.join(commands[i % len(commands)] for i in range(count))
+
+def _start_server(server_class, controller, **kwargs):
+    """Start a WiFi server on an ephemeral port and return it with its address"""
+    server = server_class(controller, _StaticStreamer(), port=0, **kwargs)
+    server.start()
+    while server.server_socket is None:
+        time.sleep(0.01)
+    return server, ('127.0.0.1', server.server_socket.getsockname()[1])
+
+def _receive_until(sockets, marker, timeout, start):
+    """Read from every socket until each has received a line containing marker
+
+    Returns:
+        tuple: (seconds from start until the last socket got the marker, or
+            None on timeout; total lines received)
+    """
+    tails = {sock: b'' for sock in sockets}
+    lines = 0
+    with selectors.DefaultSelector() as selector:
+        for sock in sockets:
+            selector.register(sock, selectors.EVENT_READ)
+        deadline = start + timeout
+        while tails and time.perf_counter() < deadline:
+            for key, _ in selector.select(timeout=0.5):
+                sock = key.fileobj
+                data = tails[sock] + sock.recv(65536)
+                lines += data.count(b'\n', len(tails[sock]))
+                if marker in data:
+                    del tails[sock]
+                    selector.unregister(sock)
+                else:
+                    tails[sock] = data[-len(marker):]
+    if tails:
+        return None, lines
+    return time.perf_counter() - start, lines
+
+def _legacy_pelco_frame(address, command_1, command_2, data_1=0, data_2=0):
+    """Frame construction as previously done by PTZController._send_pelco_command"""
+    message = [0xFF, address, command_1, command_2, data_1, data_2]
+    checksum = sum(message[1:]) % 256
+    message.append(checksum)
+    return bytes(message)
+
+def _measure(function, calls, repeat):
+    """Best-of-N wall time for calling function(*args) for every args in calls"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for call_args in calls:
+            function(*call_args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_pelco(args):
+    """Compare Pelco-D frame construction strategies"""
+    addresses = list(range(1, args.addresses + 1))
+    # A joystick sweep: right/up at every speed for every address
+    sweep = [(address, 0x00, 0x0A, speed, speed)
+             for address in addresses for speed in range(64)]
+    calls = (sweep * (args.iterations // len(sweep) + 1))[:args.iterations]
+    iterations = len(calls)
+
+    print(f"Pelco-D frame encoding ({iterations:,} frames, {len(addresses)} addresses)")
+
+    baseline = _measure(_legacy_pelco_frame, calls, args.repeat)
+    _report("list + sum + bytes (legacy)", iterations, baseline)
+    _report("build_frame", iterations,
+            _measure(build_frame, calls, args.repeat), baseline)
+
+def bench_latency(args):
+    """End-to-end command latency from CameraController to a loopback device"""
+    transport = LoopbackTransport(baudrate=args.baudrate or None)
+    # Samples follow each other closely; don't let the control tick merge them
+    controller = CameraController(transport=transport, keepalive_interval=0, control_tick=0)
+    controller.start()
+
+    wire = f"{args.baudrate} baud" if args.baudrate else "no wire delay"
+    print(f"CameraController.set_pan -> Pelco-D frame written ({args.samples:,} samples, {wire})")
+
+    latencies = []
+    try:
+        for i in range(args.samples):
+            expected = transport.writes + 1
+            start = time.perf_counter()
+            # Alternate speeds so every call is a real change
+            controller.set_pan(50 if i % 2 else -50)
+            if not transport.wait_for_writes(expected, timeout=1.0):
+                print("  timed out waiting for frame")
+                break
+            latencies.append(transport.written[-1][0] - start)
+    finally:
+        controller.stop()
+
+    if latencies:
+        _report_latencies("set_pan to write", latencies)
+
+def bench_commands(args):
+    """Command decoding throughput, in isolation and through WifiServer"""
+    count = args.iterations
+    stream = _command_stream(count)
+    # Chunk the stream as TCP would, cutting commands at arbitrary points
+    chunks = [stream[i:i + 1448] for i in range(0, len(stream), 1448)]
+
+    print(f"Command decoding ({count:,} commands)")
+
+    def decode():
+        decoder = LineDecoder()
+        for chunk in chunks:
+            decoder.feed(chunk)
+        return decoder
+
+    if decode().lines_decoded != count:
+        print("  LineDecoder lost commands")
+    elapsed = _measure(decode, [()], args.repeat)
+    _report("LineDecoder.feed (1448 B reads)", count, elapsed)
+
+    controller = _CountingController()
+    server, address = _start_server(WifiServer, controller)
+    try:
+        per_client = max(1, count // args.clients)
+        payload = _command_stream(per_client)
+        clients = [socket.create_connection(address) for _ in range(args.clients)]
+        time.sleep(0.2)  # let the server pick up every connection
+
+        print(f"WifiServer over localhost ({args.clients} clients, {per_client:,} commands each)")
+
+        expected = controller.commands + per_client * len(clients)
+        start = time.perf_counter()
+        senders = [threading.Thread(target=client.sendall, args=(payload,)) for client in clients]
+        for sender in senders:
+            sender.start()
+        received = controller.wait_for(expected, timeout=60.0)
+        elapsed = time.perf_counter() - start
+        for sender in senders:
+            sender.join()
+
+        if not received:
+            print(f"  only {controller.commands:,} of {expected:,} commands arrived")
+        else:
+            _report("all clients", per_client * len(clients), elapsed)
+            print(f"  {'per client':<32} {per_client / elapsed:26,.0f} commands/s")
+
+        for client in clients:
+            client.close()
+        time.sleep(0.6)  # let the handlers see the disconnects before stopping
+    finally:
+        server.stop()
+
+def bench_binary(args):
+    """Parse and dispatch cost of JSON, text and binary joystick updates"""
+    ticks = max(1, args.iterations // 2)
+    speeds = [((i * 7) % 201 - 100, (i * 13) % 201 - 100) for i in range(ticks)]
+    streams = {
+        "JSON lines (pan + tilt)": b''.join(
+            b'{"type": "pan", "value": %d}\n{"type": "tilt", "value": %d}\n' % speed
+            for speed in speeds),
+        "text lines (pan + tilt)": b''.join(b'pan %d\ntilt %d\n' % speed for speed in speeds),
+        "binary frames (pan_tilt)": b'hello binary 1\n' + b''.join(
+            encode_binary_command(MSG_PAN_TILT, i, pan, tilt) for i, (pan, tilt) in enumerate(speeds)),
+    }
+
+    controller = _CountingController()
+    server = WifiServer(controller, _StaticStreamer(), port=0)
+
+    print(f"Joystick update parse + dispatch ({ticks:,} pan/tilt updates, 1448 B reads)")
+
+    baseline = None
+    for name, data in streams.items():
+        chunks = [data[i:i + 1448] for i in range(0, len(data), 1448)]
+
+        def run():
+            stream = CommandStream()
+            for chunk in chunks:
+                server.commands.apply_commands(stream.feed(chunk))
+
+        elapsed = _measure(run, [()], args.repeat)
+        baseline = baseline or elapsed
+        _report(name, ticks, elapsed, baseline)
+        print(f"  {'':<32} {len(data) / ticks:10.1f} bytes/update")
+
+def bench_registry(args):
+    """Parse + dispatch throughput of the command registry against the old if/elif chains"""
+    count = args.iterations
+    lines = [b'pan 50', b'tilt -20', b'zoom 40', b'stop', b'PAN -50', b'mode 0',
+             b'{"type": "pan", "value": 50}', b'{"type": "tilt", "value": -20}',
+             b'{"type": "zoom", "value": 40}', b'{"type": "mode", "value": 0}']
+    text = [line for line in lines if not line.startswith(b'{')]
+    json_lines = [line for line in lines if line.startswith(b'{')]
+    frames = CommandStream()
+    frames.feed(b'hello binary 1\n')
+    binary = frames.feed(b''.join(encode_binary_command(MSG_PAN_TILT, i, i % 100, -i % 100)
+                                  for i in range(100)))
+
+    controller = _CountingController()
+    registry = CommandRegistry(controller)
+    batch = 64
+
+    print(f"Command parse + dispatch ({count:,} commands, batches of {batch})")
+
+    for name, sample in (("text", text), ("JSON", json_lines), ("binary", binary)):
+        commands = (sample * (count // len(sample) + 1))[:count]
+        batches = [(commands[i:i + batch],) for i in range(0, count, batch)]
+
+        if name != "binary":
+            def legacy(messages):
+                for line in messages:
+                    _legacy_process_line(controller, line)
+            baseline = _measure(legacy, batches, args.repeat)
+            _report(f"{name}: if/elif chain (legacy)", count, baseline)
+        else:
+            baseline = None
+        _report(f"{name}: CommandRegistry", count,
+                _measure(registry.apply_commands, batches, args.repeat), baseline)
+
+    stats = registry.get_stats()
+    print(f"  {'pan latency histogram':<32} {stats['pan']['latency']}")
+
+def bench_motion(args):
+    """Stop latency and frames written while another client floods pan/tilt updates"""
+    stops = max(1, args.samples // 50)
+    stop_frame = build_frame(1, 0x00, 0x00, 0, 0)
+    wire = f"{args.baudrate} baud" if args.baudrate else "no wire delay"
+    print(f"Motion arbitration (one WiFi client flooding pan_tilt, another sending {stops} stops, {wire})")
+
+    for tick in (0, 0.02):
+        transport = LoopbackTransport(baudrate=args.baudrate or None, history=100000)
+        controller = CameraController(transport=transport, keepalive_interval=0, control_tick=tick)
+        arbiter = MotionArbiter(controller)
+        controller.start()
+        server, address = _start_server(WifiServer, controller, arbiter=arbiter)
+        flooding = threading.Event()
+        try:
+            flood = socket.create_connection(address)
+            stopper = socket.create_connection(address)
+            stopper.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            burst = b''.join(b'pan_tilt %d %d\n' % (40 + i % 50, -20) for i in range(100))
+
+            def send_flood():
+                while flooding.is_set():
+                    flood.sendall(burst)
+
+            flooding.set()
+            flooder = threading.Thread(target=send_flood, daemon=True)
+            start, start_writes = time.perf_counter(), transport.writes
+            flooder.start()
+
+            latencies = []
+            for _ in range(stops):
+                time.sleep(0.05)
+                sent = time.perf_counter()
+                stopper.sendall(b'stop\n')
+                deadline = sent + 1.0
+                while time.perf_counter() < deadline:
+                    stopped = [at for at, data in list(transport.written) if at > sent and data == stop_frame]
+                    if stopped:
+                        latencies.append(stopped[0] - sent)
+                        break
+                    time.sleep(0.0005)
+
+            flooding.clear()
+            flooder.join()
+            elapsed = time.perf_counter() - start
+            frames = transport.writes - start_writes
+            applied = server.commands.get_stats().get("pan_tilt", {}).get("count", 0)
+
+            print(f"  control tick {tick * 1000:.0f} ms: {applied:,} pan_tilt commands -> {frames:,} frames "
+                  f"({frames / elapsed:,.0f} frames/s), {len(latencies)} of {stops} stops reached the wire")
+            if latencies:
+                _report_latencies("stop to wire under flood", latencies)
+
+            flood.close()
+            stopper.close()
+            # The flood handler may still be working through buffered commands
+            deadline = time.perf_counter() + 10.0
+            while server.clients and time.perf_counter() < deadline:
+                time.sleep(0.05)
+        finally:
+            flooding.clear()
+            server.stop()
+            controller.stop()
+
+def bench_status(args):
+    """Compare per-client and shared status encoding for a broadcast"""
+    status = _status_sample()
+    iterations = max(1, args.iterations // 100)
+    print(f"Status broadcast encoding ({iterations:,} broadcasts, sockets discard data)")
+
+    for clients in (1, 10, 100):
+        sockets = [_NullSocket() for _ in range(clients)]
+        calls = [(status, sockets)] * iterations
+        baseline = _measure(_legacy_send_status, calls, args.repeat)
+        _report(f"{clients:3d} clients, encode per client", iterations, baseline)
+        _report(f"{clients:3d} clients, shared buffer", iterations,
+                _measure(_shared_send_status, calls, args.repeat), baseline)
+
+def bench_wifi_load(args):
+    """Compare the threaded and asyncio WiFi servers under many monitoring clients"""
+    print(f"WiFi server load ({args.monitors} monitoring clients, {args.broadcasts} status broadcasts, "
+          f"{args.samples:,} commands)")
+
+    status = _status_sample()
+
+    for name, server_class in (("threaded", WifiServer), ("asyncio", AsyncWifiServer)):
+        controller = _CountingController()
+        threads_before = threading.active_count()
+        server, address = _start_server(server_class, controller)
+        monitors = []
+        try:
+            start = time.perf_counter()
+            monitors = [socket.create_connection(address) for _ in range(args.monitors)]
+            # A client on bad WiFi: tiny receive buffer and never reads
+            stalled = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024)
+            stalled.connect(address)
+            monitors_connected = len(monitors) + 1
+            while len(server.clients) < monitors_connected and time.perf_counter() - start < 30:
+                time.sleep(0.01)
+            connect_time = time.perf_counter() - start
+            threads = threading.active_count() - threads_before
+
+            # Command latency while the monitors are connected
+            control = socket.create_connection(address)
+            control.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            time.sleep(0.1)
+            latencies = []
+            for i in range(args.samples):
+                expected = controller.commands + 1
+                sent = time.perf_counter()
+                control.sendall(b'pan 50\n' if i % 2 else b'pan -50\n')
+                if not controller.wait_for(expected, timeout=2.0):
+                    break
+                latencies.append(time.perf_counter() - sent)
+
+            # Status fan-out to every monitor. Clients that fall behind get
+            # the newest status, so wait for the last one rather than all
+            start = time.perf_counter()
+            for _ in range(args.broadcasts - 1):
+                server.send_status(status)
+            server.send_status(dict(status, final=True))
+            send_time = time.perf_counter() - start
+            fanout, delivered = _receive_until(monitors, b'"final":true', 60.0, start)
+
+            print(f"  {name}: {threads} server threads, all clients connected in {connect_time:.2f}s "
+                  f"(one stalled)")
+            if latencies:
+                _report_latencies("command latency", latencies)
+            print(f"  {'send_status caller time':<32} {send_time / args.broadcasts * 1e6:8.1f} us/broadcast")
+            if fanout is None:
+                print("  status fan-out timed out")
+            else:
+                print(f"  {'newest status at all clients':<32} {fanout * 1e3:8.1f} ms "
+                      f"({delivered / len(monitors):.0f} of {args.broadcasts} messages each)")
+            fanout_stats = server.get_fanout_stats()
+            latency = fanout_stats.get("latency_ms", {})
+            print(f"  {'server fan-out stats':<32} p50 {latency.get('p50', 0):.3f} ms  "
+                  f"p95 {latency.get('p95', 0):.3f} ms  dropped {fanout_stats['dropped']}  "
+                  f"slow disconnects {fanout_stats['slow_disconnects']}")
+
+            control.close()
+            stalled.close()
+        finally:
+            for monitor in monitors:
+                monitor.close()
+            time.sleep(0.6)  # let the handlers see the disconnects before stopping
+            server.stop()
+
+def bench_bluetooth(args):
+    """Command throughput and status fan-out of the Bluetooth server over simulated RFCOMM links"""
+    print(f"Bluetooth server ({args.clients} simulated RFCOMM clients, {args.samples:,} commands each, "
+          f"{args.broadcasts} status broadcasts)")
+
+    controller = _CountingController()
+    server = BluetoothServer(controller, max_clients=args.clients + 1)
+    server.start()
+    while server.port is None:
+        time.sleep(0.01)
+
+    clients = []
+    try:
+        for _ in range(args.clients + 1):
+            client = MockBluetooth.BluetoothSocket(MockBluetooth.RFCOMM)
+            client.connect(("00:00:00:00:00:00", server.port))
+            clients.append(client)
+        while len(server.clients) < len(clients):
+            time.sleep(0.01)
+        # The last client never reads its status messages
+        stalled, readers = clients[-1], clients[:-1]
+
+        # Every client streams commands in small writes that split lines
+        stream = _command_stream(args.samples)
+        expected = len(readers) * args.samples
+        start = time.perf_counter()
+        for offset in range(0, len(stream), 100):
+            for client in readers:
+                client.sendall(stream[offset:offset + 100])
+        if not controller.wait_for(expected, timeout=30.0):
+            print(f"  only {controller.commands:,} of {expected:,} commands applied")
+        _report("commands from all clients", expected, time.perf_counter() - start)
+
+        status = _status_sample()
+        start = time.perf_counter()
+        for _ in range(args.broadcasts - 1):
+            server.send_status(status)
+        server.send_status(dict(status, final=True))
+        send_time = time.perf_counter() - start
+        fanout, delivered = _receive_until([client.sock for client in readers], b'"final":true', 30.0, start)
+
+        print(f"  {'send_status caller time':<32} {send_time / args.broadcasts * 1e6:8.1f} us/broadcast")
+        if fanout is None:
+            print("  status fan-out timed out")
+        else:
+            print(f"  {'newest status at all clients':<32} {fanout * 1e3:8.1f} ms "
+                  f"({delivered / len(readers):.0f} of {args.broadcasts} messages each, one client stalled)")
+        fanout_stats = server.get_fanout_stats()
+        print(f"  {'server fan-out stats':<32} sent {fanout_stats['sent']}  dropped {fanout_stats['dropped']}  "
+              f"clients {fanout_stats['clients']}")
+        stalled.close()
+    finally:
+        for client in clients:
+            client.close()
+        time.sleep(0.6)  # let the handlers see the disconnects before stopping
+        server.stop()
+
+BENCHMARKS = {
+    "binary": bench_binary,
+    "bluetooth": bench_bluetooth,
+    "commands": bench_commands,
+    "pelco": bench_pelco,
+    "registry": bench_registry,
+    "status": bench_status,
+    "wifi-load": bench_wifi_load,
+    "latency": bench_latency,
+    "motion": bench_motion,
+}
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="PTZ camera server microbenchmarks")
+
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS) + ["all"],
+                        help="Benchmark to run")
+    parser.add_argument("--iterations", type=int, default=200000,
+                        help="Operations per measurement (default: 200000)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Measurements per benchmark, best is reported (default: 5)")
+    parser.add_argument("--addresses", type=int, default=16,
+                        help="Number of camera addresses (default: 16)")
+    parser.add_argument("--samples", type=int, default=1000,
+                        help="Samples for latency benchmarks (default: 1000)")
+    parser.add_argument("--clients", type=int, default=4,
+                        help="Concurrent clients for server benchmarks (default: 4)")
+    parser.add_argument("--monitors", type=int, default=200,
+                        help="Monitoring clients for load benchmarks (default: 200)")
+    parser.add_argument("--broadcasts", type=int, default=50,
+                        help="Status broadcasts for load benchmarks (default: 50)")
+    parser.add_argument("--baudrate", type=int, default=9600,
+                        help="Simulated serial baudrate, 0 for none (default: 9600)")
+
+    return parser.parse_args()
+
+def main():
+    """Main function"""
+    args = parse_arguments()
+    logging.basicConfig(level=logging.ERROR)
+
+    names = sorted(BENCHMARKS) if args.benchmark == "all" else [args.benchmark]
+    for name in names:
+        BENCHMARKS[name](args)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
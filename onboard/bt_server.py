@@ -2,168 +2,224 @@
 """
 Bluetooth Server for PTZ Camera Control.
 This module handles Bluetooth communication with the Android tablet app,
-receiving control commands and sending status updates.
+receiving control commands and sending status updates. Several RFCOMM
+clients can be connected at once; each has its own reader thread and its
+own status writer, so a slow link never holds up the others.
 """
 
 import os
 import time
 import logging
 import threading
-import json
 import socket
+from collections import deque
+
+from command_protocol import CommandStream, ClientWriter, FanoutStats, encode_status
+from command_registry import CommandRegistry
+from motion_arbiter import PRIORITY_BLUETOOTH
 
 logger = logging.getLogger('bt_server')
 
+class MockBluetooth:
+    """Simulated PyBluez RFCOMM stack for development and testing
+
+    Connections are pairs of connected local sockets, so clients and the
+    server exchange real bytes with real buffering and back-pressure.
+    Clients connect with BluetoothSocket(RFCOMM).connect((address, channel))
+    to the channel a listening socket was bound to.
+    """
+    RFCOMM = 1
+    PORT_ANY = 0
+    SERIAL_PORT_CLASS = "serial-port-class"
+    SERIAL_PORT_PROFILE = "serial-port-profile"
+
+    listeners = {}  # channel -> listening BluetoothSocket
+    next_channel = 1
+    lock = threading.Lock()
+
+    class BluetoothSocket:
+        """Mock bluetooth socket backed by one end of a socket pair"""
+
+        def __init__(self, protocol, sock=None, address="00:00:00:00:00:00"):
+            self.protocol = protocol
+            self.sock = sock
+            self.address = address
+            self.port = None
+            self.listening = False
+            self.pending = deque()
+            self.condition = threading.Condition()
+            self.timeout = None
+            self.closed = False
+
+        def bind(self, address):
+            """Bind to a channel, picking a free one for PORT_ANY"""
+            with MockBluetooth.lock:
+                channel = address[1]
+                if channel == MockBluetooth.PORT_ANY:
+                    channel = MockBluetooth.next_channel
+                    MockBluetooth.next_channel += 1
+                self.port = channel
+            logger.info(f"Mock Bluetooth socket bound to channel {self.port}")
+
+        def listen(self, backlog):
+            """Start accepting connections on the bound channel"""
+            with MockBluetooth.lock:
+                MockBluetooth.listeners[self.port] = self
+            self.listening = True
+            logger.info(f"Mock Bluetooth socket listening with backlog {backlog}")
+
+        def getsockname(self):
+            """Return the local address and channel"""
+            return (self.address, self.port)
+
+        def connect(self, address):
+            """Connect to a listening mock socket at (address, channel)"""
+            with MockBluetooth.lock:
+                listener = MockBluetooth.listeners.get(address[1])
+            if listener is None or listener.closed:
+                raise ConnectionRefusedError(f"No mock Bluetooth service on channel {address[1]}")
+
+            self.sock, server_end = socket.socketpair()
+            self.sock.settimeout(self.timeout)
+            client_address = "11:22:33:44:%02X:%02X" % (self.sock.fileno() >> 8 & 0xFF, self.sock.fileno() & 0xFF)
+            with listener.condition:
+                listener.pending.append((MockBluetooth.BluetoothSocket(self.protocol, server_end), client_address))
+                listener.condition.notify_all()
+
+        def settimeout(self, timeout):
+            """Set socket timeout"""
+            self.timeout = timeout
+            if self.sock:
+                self.sock.settimeout(timeout)
+
+        def accept(self):
+            """Wait for a client to connect"""
+            if not self.listening:
+                raise OSError("Socket is not listening")
+
+            with self.condition:
+                if not self.condition.wait_for(lambda: self.pending or self.closed, self.timeout):
+                    raise socket.timeout("timed out")
+                if self.closed:
+                    raise OSError("Socket is closed")
+                client_sock, client_address = self.pending.popleft()
+
+            logger.info(f"Mock Bluetooth connection accepted from {client_address}")
+            return client_sock, client_address
+
+        def fileno(self):
+            return self.sock.fileno()
+
+        def recv(self, bufsize):
+            return self.sock.recv(bufsize)
+
+        def send(self, data):
+            return self.sock.send(data)
+
+        def sendall(self, data):
+            return self.sock.sendall(data)
+
+        def shutdown(self, how):
+            self.sock.shutdown(how)
+
+        def close(self):
+            """Close the socket"""
+            if self.closed:
+                return
+            self.closed = True
+            if self.listening:
+                with MockBluetooth.lock:
+                    if MockBluetooth.listeners.get(self.port) is self:
+                        del MockBluetooth.listeners[self.port]
+                with self.condition:
+                    self.condition.notify_all()
+            if self.sock:
+                self.sock.close()
+
+    @staticmethod
+    def advertise_service(sock, name, service_id, service_classes, profiles):
+        """Simulate advertising a Bluetooth service"""
+        logger.info(f"Advertising mock Bluetooth service '{name}' with UUID {service_id}")
+
 # Try to import PyBluez
 try:
     import bluetooth
+    HAS_PYBLUEZ = True
 except ImportError:
     logger.warning("PyBluez not available. Using mock implementation for development/testing.")
-    # Mock implementation for development/testing
-    class MockBluetooth:
-        """Mock implementation of PyBluez for simulation"""
-        RFCOMM = 1
-        PORT_ANY = 0
-        SERIAL_PORT_CLASS = "serial-port-class"
-        SERIAL_PORT_PROFILE = "serial-port-profile"
-        
-        class BluetoothSocket:
-            """Mock bluetooth socket"""
-            def __init__(self, protocol):
-                logger.info(f"Creating mock Bluetooth socket with protocol {protocol}")
-                self.protocol = protocol
-                self.bound = False
-                self.listening = False
-                self.port = None
-                self.closed = False
-                self.timeout = None
-                self.mock_client_data = [
-                    b'{"type":"pan","value":50}\n',
-                    b'{"type":"tilt","value":-30}\n',
-                    b'{"type":"zoom","value":75}\n',
-                    b'{"type":"mode","value":1}\n'
-                ]
-                self.mock_data_index = 0
-                
-            def bind(self, address):
-                """Simulate binding to an address"""
-                logger.info(f"Mock Bluetooth socket bound to {address}")
-                self.bound = True
-                
-            def listen(self, backlog):
-                """Simulate listening for connections"""
-                logger.info(f"Mock Bluetooth socket listening with backlog {backlog}")
-                self.listening = True
-                
-            def getsockname(self):
-                """Return a fake socket name with port"""
-                return ("00:00:00:00:00:00", 1)
-                
-            def settimeout(self, timeout):
-                """Set socket timeout"""
-                self.timeout = timeout
-                
-            def accept(self):
-                """Simulate accepting a connection"""
-                if not self.listening:
-                    raise Exception("Socket is not listening")
-                    
-                # Simulate timeout
-                time.sleep(self.timeout if self.timeout else 1.0)
-                
-                # Create mock client socket
-                client_sock = MockBluetooth.BluetoothSocket(self.protocol)
-                client_addr = "11:22:33:44:55:66"
-                
-                logger.info(f"Mock Bluetooth connection accepted from {client_addr}")
-                return client_sock, client_addr
-                
-            def recv(self, bufsize):
-                """Simulate receiving data"""
-                if self.closed:
-                    return b''
-                    
-                # Simulate timeout or no data
-                time.sleep(0.5)
-                
-                # Return mock data occasionally
-                if self.mock_data_index < len(self.mock_client_data) and time.time() % 10 < 3:
-                    data = self.mock_client_data[self.mock_data_index]
-                    self.mock_data_index = (self.mock_data_index + 1) % len(self.mock_client_data)
-                    return data
-                    
-                return b''
-                
-            def send(self, data):
-                """Simulate sending data"""
-                if self.closed:
-                    raise Exception("Socket is closed")
-                    
-                logger.debug(f"Mock Bluetooth socket sending {len(data)} bytes")
-                return len(data)
-                
-            def close(self):
-                """Close the socket"""
-                logger.info("Mock Bluetooth socket closed")
-                self.closed = True
-        
-        def advertise_service(sock, name, service_id, service_classes, profiles):
-            """Simulate advertising a Bluetooth service"""
-            logger.info(f"Advertising mock Bluetooth service '{name}' with UUID {service_id}")
-    
-    # Use mock implementation
     bluetooth = MockBluetooth()
+    HAS_PYBLUEZ = False
 
 class BluetoothServer:
     """Bluetooth server for PTZ camera control"""
-    
-    def __init__(self, camera_controller, uuid="00001101-0000-1000-8000-00805F9B34FB"):
+
+    def __init__(self, camera_controller, uuid="00001101-0000-1000-8000-00805F9B34FB", arbiter=None,
+                 max_clients=4, queue_size=8, backlog_limit=5.0, broadcaster=None):
         """Initialize the Bluetooth server
-        
+
         Args:
             camera_controller: CameraController instance
             uuid: Service UUID (default: standard SPP UUID)
+            arbiter: MotionArbiter giving each client a motion session, None
+                to drive the camera controller directly
+            max_clients: Simultaneous RFCOMM clients; more are refused
+            queue_size: Status messages queued per client before the oldest
+                is dropped
+            backlog_limit: Seconds a client may fall behind on status
+                messages before it is disconnected
+            broadcaster: StatusBroadcaster that encodes status updates once
+                for the clients of every transport, None to send them to
+                this server's clients only
         """
         self.camera_controller = camera_controller
         self.uuid = uuid
         self.running = False
         self.server_thread = None
         self.server_socket = None
-        self.client_socket = None
-        self.client_address = None
-        self.client_handler_thread = None
-        
+        self.port = None
+        self.clients = {}  # client socket -> ClientWriter
+        self.max_clients = max_clients
+        self.queue_size = queue_size
+        self.backlog_limit = backlog_limit
+        self.fanout_stats = FanoutStats()
+        self.lock = threading.Lock()
+        self.arbiter = arbiter
+        self.broadcaster = broadcaster
+        self.commands = CommandRegistry(camera_controller)
+        self.commands.register("status", self._send_status_report)
+
     def start(self):
         """Start the Bluetooth server"""
         if self.running:
             logger.warning("Bluetooth server is already running")
             return
-            
+
         self.running = True
         self.server_thread = threading.Thread(target=self._server_loop)
         self.server_thread.daemon = True
         self.server_thread.start()
-        
+
         logger.info("Bluetooth server started")
         return True
-        
+
     def stop(self):
         """Stop the Bluetooth server"""
         if not self.running:
             logger.warning("Bluetooth server is not running")
             return
-            
+
         self.running = False
-        
-        # Close client connection
-        if self.client_socket:
-            try:
-                self.client_socket.close()
-            except:
-                pass
-            self.client_socket = None
-            self.client_address = None
-            
+
+        # Close all client connections
+        with self.lock:
+            for client_sock, writer in self.clients.items():
+                writer.stop()
+                try:
+                    client_sock.close()
+                except:
+                    pass
+            self.clients = {}
+
         # Close server socket
         if self.server_socket:
             try:
@@ -171,24 +227,24 @@ class BluetoothServer:
             except:
                 pass
             self.server_socket = None
-            
+
         # Wait for server thread to end
         if self.server_thread:
             self.server_thread.join(timeout=2.0)
-            
+
         logger.info("Bluetooth server stopped")
-        
+
     def _server_loop(self):
         """Main server loop that handles Bluetooth connections"""
         try:
             # Create server socket
             self.server_socket = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
             self.server_socket.bind(("", bluetooth.PORT_ANY))
-            self.server_socket.listen(1)  # Only one connection at a time
-            
+            self.server_socket.listen(self.max_clients)
+
             # Get the port number assigned to the socket
-            port = self.server_socket.getsockname()[1]
-            
+            self.port = self.server_socket.getsockname()[1]
+
             # Advertise the service
             bluetooth.advertise_service(
                 self.server_socket,
@@ -197,42 +253,49 @@ class BluetoothServer:
                 service_classes=[self.uuid, bluetooth.SERIAL_PORT_CLASS],
                 profiles=[bluetooth.SERIAL_PORT_PROFILE]
             )
-            
-            logger.info(f"Bluetooth server listening on RFCOMM channel {port}")
-            
+
+            logger.info(f"Bluetooth server listening on RFCOMM channel {self.port}")
+
+            # Set timeout to allow for periodic checks
+            self.server_socket.settimeout(1.0)
+
             while self.running:
-                # Wait for client connection
-                logger.info("Waiting for Bluetooth connection...")
-                
-                # Set timeout to allow for periodic checks
-                self.server_socket.settimeout(1.0)
-                
                 try:
                     client_sock, client_info = self.server_socket.accept()
+
+                    if len(self.clients) >= self.max_clients:
+                        logger.warning(f"Refusing Bluetooth connection from {client_info}, "
+                                       f"{self.max_clients} clients already connected")
+                        client_sock.close()
+                        continue
+
                     logger.info(f"Accepted Bluetooth connection from {client_info}")
-                    
-                    # Store client info
-                    self.client_socket = client_sock
-                    self.client_address = client_info
-                    
+
+                    writer = ClientWriter(
+                        client_sock, client_info, self.fanout_stats,
+                        queue_size=self.queue_size,
+                        backlog_limit=self.backlog_limit
+                    )
+                    writer.start()
+                    with self.lock:
+                        self.clients[client_sock] = writer
+
                     # Handle client in a separate thread
-                    self.client_handler_thread = threading.Thread(
+                    client_thread = threading.Thread(
                         target=self._handle_client,
                         args=(client_sock, client_info)
                     )
-                    self.client_handler_thread.daemon = True
-                    self.client_handler_thread.start()
-                    
+                    client_thread.daemon = True
+                    client_thread.start()
+
                 except socket.timeout:
                     # No new connections, continue
                     pass
                 except Exception as e:
                     if self.running:  # Only log if we're still supposed to be running
                         logger.error(f"Error accepting Bluetooth connection: {e}")
-                
-                # Sleep briefly to prevent CPU hogging
-                time.sleep(0.01)
-                
+                        time.sleep(0.1)
+
         except Exception as e:
             logger.error(f"Bluetooth server error: {e}")
         finally:
@@ -242,156 +305,150 @@ class BluetoothServer:
                     self.server_socket.close()
                 except:
                     pass
-                
+
             logger.info("Bluetooth server loop ended")
-        
+
     def _handle_client(self, client_sock, client_info):
         """Handle communication with a connected client"""
         logger.info(f"Bluetooth client handler started for {client_info}")
-        
+        stream = CommandStream()
+        commands, session = self.commands, None
+        if self.arbiter:
+            session = self.arbiter.open_session(f"bluetooth {client_info}", PRIORITY_BLUETOOTH)
+            commands = self.commands.bind(session)
+
         try:
             # Set small timeout to allow checking running state
             client_sock.settimeout(0.5)
-            
-            while self.running and self.client_socket == client_sock:
+
+            while self.running and client_sock in self.clients:
                 try:
                     # Receive data
                     data = client_sock.recv(1024)
-                    
+
                     if not data:
-                        # Client disconnected
+                        # Client disconnected, a last command may lack its newline
+                        commands.apply_commands(stream.flush())
                         logger.info(f"Bluetooth client disconnected: {client_info}")
                         break
-                        
-                    # Process received data
+
+                    # A read can hold several commands or part of one
                     try:
-                        # Split data by newlines to handle multiple commands
-                        commands = data.decode('utf-8').strip().split('\n')
-                        
-                        for cmd_str in commands:
-                            if cmd_str:
-                                # Try to parse as JSON
-                                try:
-                                    command = json.loads(cmd_str)
-                                    self._process_command(command)
-                                except json.JSONDecodeError:
-                                    # Not valid JSON, try as text command
-                                    self._process_text_command(cmd_str)
+                        messages = stream.feed(data)
+                        reply = stream.pop_reply()
+                        if reply:
+                            self._send_to_client(client_sock, reply)
+
+                        commands.apply_commands(messages)
                     except Exception as e:
                         logger.error(f"Error processing Bluetooth data: {e}")
-                    
+
                 except socket.timeout:
                     # No data available, continue
                     continue
+                except ConnectionResetError:
+                    logger.info(f"Bluetooth link to {client_info} was reset")
+                    break
                 except Exception as e:
-                    logger.error(f"Error receiving Bluetooth data: {e}")
+                    if self.running:
+                        logger.error(f"Error receiving Bluetooth data: {e}")
                     break
-                    
+
         except Exception as e:
             logger.error(f"Bluetooth client handler error: {e}")
         finally:
-            # Close the client socket
+            if session:
+                session.close()
+
+            # Remove client and stop its writer before closing the socket
+            with self.lock:
+                writer = self.clients.pop(client_sock, None)
+            if writer:
+                writer.stop()
+
             try:
                 client_sock.close()
             except:
                 pass
-                
-            # Clear client info if this is still the current client
-            if self.client_socket == client_sock:
-                self.client_socket = None
-                self.client_address = None
-                
+
             logger.info(f"Bluetooth client handler ended for {client_info}")
-    
-    def _process_command(self, command):
-        """Process a command received from the client"""
-        logger.debug(f"Received Bluetooth command: {command}")
-        
-        if not isinstance(command, dict):
-            logger.warning(f"Invalid command format: {command}")
-            return
-            
-        # Forward to camera controller
-        try:
-            self.camera_controller.process_command(command)
-        except Exception as e:
-            logger.error(f"Error processing Bluetooth command: {e}")
-    
-    def _process_text_command(self, command_str):
-        """Process a text command received from the client"""
-        logger.debug(f"Received Bluetooth text command: {command_str}")
-        
-        # Parse simple text commands (same as in WiFi server)
-        cmd_parts = command_str.split()
-        if not cmd_parts:
-            return
-            
-        cmd_type = cmd_parts[0].lower()
-        
-        try:
-            if cmd_type == "pan":
-                # pan <speed>
-                if len(cmd_parts) > 1:
-                    speed = int(cmd_parts[1])
-                    self.camera_controller.set_pan(speed)
-                    
-            elif cmd_type == "tilt":
-                # tilt <speed>
-                if len(cmd_parts) > 1:
-                    speed = int(cmd_parts[1])
-                    self.camera_controller.set_tilt(speed)
-                    
-            elif cmd_type == "zoom":
-                # zoom <level>
-                if len(cmd_parts) > 1:
-                    level = int(cmd_parts[1])
-                    self.camera_controller.set_zoom(level)
-                    
-            elif cmd_type == "mode":
-                # mode <0|1>
-                if len(cmd_parts) > 1:
-                    mode = int(cmd_parts[1])
-                    self.camera_controller.set_camera_mode(mode)
-                    
-            elif cmd_type == "stop":
-                # stop - stop all movement
-                self.camera_controller.set_pan(0)
-                self.camera_controller.set_tilt(0)
-                
-        except Exception as e:
-            logger.error(f"Error processing Bluetooth text command: {e}")
-    
+
+    def _send_to_client(self, client_sock, message):
+        """Queue an encoded message for a single client"""
+        with self.lock:
+            writer = self.clients.get(client_sock)
+        if writer:
+            writer.send(message, time.perf_counter())
+
+    def _send_status_report(self):
+        """Send a status report to the connected clients"""
+        if self.broadcaster:
+            # One report for the clients of every transport
+            self.broadcaster.publish()
+        else:
+            self.send_status(self.get_status())
+
+    def get_status(self):
+        """Get the status report for this server's clients"""
+        status = {
+            "camera_mode": self.camera_controller.get_camera_mode(),
+            "position": self.camera_controller.get_position(),
+            "commands": self.commands.get_stats(),
+            "status_fanout": self.get_fanout_stats(),
+            "timestamp": time.time()
+        }
+        if self.arbiter:
+            status["motion"] = self.arbiter.get_stats()
+        return status
+
+    def get_fanout_stats(self):
+        """Get status delivery statistics for the connected clients"""
+        stats = self.fanout_stats.get_stats()
+        stats["clients"] = len(self.clients)
+        return stats
+
     def send_status(self, status):
-        """Send a status update to the connected client
-        
+        """Send a status update to all connected clients
+
         Args:
             status: Status data dictionary to send
         """
-        if not self.running or not self.client_socket:
+        if not self.running:
             return
-            
-        # Convert to JSON
+
+        if self.broadcaster:
+            self.broadcaster.publish(status)
+            return
+
+        if not self.clients:
+            return
+
         try:
-            status_json = json.dumps(status)
+            message = encode_status(status)
         except Exception as e:
             logger.error(f"Error serializing status data: {e}")
             return
-            
-        # Send to client
-        try:
-            message = status_json.encode('utf-8') + b'\n'
-            self.client_socket.send(message)
-        except Exception as e:
-            logger.warning(f"Error sending status via Bluetooth: {e}")
-            
-            # Close the connection if there was an error
-            try:
-                self.client_socket.close()
-            except:
-                pass
-                
-            self.client_socket = None
-            self.client_address = None
+
+        self.send_encoded(message)
+
+    def send_encoded(self, message):
+        """Send an already encoded status message to all connected clients
+
+        The message is queued for each client's writer thread, so the caller
+        never waits on a Bluetooth link.
+
+        Args:
+            message (bytes): Framed message from encode_status()
+        """
+        if not self.running:
+            return
+
+        timestamp = time.perf_counter()
+        with self.lock:
+            writers = list(self.clients.values())
+
+        for writer in writers:
+            writer.send(message, timestamp)
 
 if __name__ == "__main__":
     # Set up logging for standalone testing
@@ -399,7 +456,7 @@ if __name__ == "__main__":
         level=logging.DEBUG,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
-    
+
     # Mock camera controller for testing
     class MockCameraController:
         def process_command(self, command):
@@ -408,28 +465,49 @@ if __name__ == "__main__":
             print(f"Pan speed: {speed}")
         def set_tilt(self, speed):
             print(f"Tilt speed: {speed}")
+        def set_pan_tilt(self, pan_speed, tilt_speed):
+            print(f"Pan/tilt speed: {pan_speed}/{tilt_speed}")
         def set_zoom(self, level):
             print(f"Zoom level: {level}")
         def set_camera_mode(self, mode):
             print(f"Camera mode: {mode}")
-    
+        def get_camera_mode(self):
+            return 0
+        def get_position(self):
+            return {"pan": 0.0, "tilt": 0.0, "zoom": 0, "timestamp": time.time()}
+
     # Test the Bluetooth server
     camera_controller = MockCameraController()
     server = BluetoothServer(camera_controller)
-    
+
     server.start()
-    
+
     try:
         print("Bluetooth server running")
         print("Press Ctrl+C to stop...")
-        
+
+        if not HAS_PYBLUEZ:
+            # Two simulated handsets, one sending a command split across writes
+            while server.port is None:
+                time.sleep(0.1)
+            handsets = []
+            for _ in range(2):
+                handset = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+                handset.connect(("00:00:00:00:00:00", server.port))
+                handsets.append(handset)
+            handsets[0].sendall(b'{"type":"pan","value":50}\ntilt -')
+            handsets[1].sendall(b'zoom 75\nstatus\n')
+            time.sleep(0.2)
+            handsets[0].sendall(b'30\n')
+            time.sleep(0.5)
+            print(f"Handset 1 received: {handsets[1].recv(4096)!r}")
+
         # Keep running for testing
         while True:
             time.sleep(5)
-            if server.client_socket:
-                server.send_status({"heartbeat": time.time()})
-            
+            server.send_status({"heartbeat": time.time()})
+
     except KeyboardInterrupt:
         print("Test interrupted")
     finally:
-        server.stop()
\ No newline at end of file
+        server.stop()
@@ -7,31 +7,352 @@ pan, tilt, zoom, and camera mode (RGB/IR) operations.
 
 import os
 import time
+import socket
 import logging
 import threading
 import subprocess
+from abc import ABC, abstractmethod
 from enum import Enum
+from collections import deque
+
+from pelco_bus import PelcoBus
+from zoom_controller import ZoomController
+from command_registry import CommandRegistry
 
 logger = logging.getLogger('camera_controller')
 
+# Try to import pyserial
+try:
+    import serial
+except ImportError:
+    logger.warning("pyserial not available. Serial Pelco-D transport disabled.")
+    serial = None
+
 class CameraMode(Enum):
     """Enum for camera modes"""
     RGB = 0
     IR = 1
 
+class PelcoTransport(ABC):
+    """Base class for links that carry Pelco-D frames to the camera
+
+    Transports are handed to PelcoBus as its port, so they provide the
+    subset of the pyserial interface the bus uses.
+    """
+
+    is_open = False
+
+    @abstractmethod
+    def open(self):
+        """Open the link"""
+
+    @abstractmethod
+    def close(self):
+        """Close the link"""
+
+    @abstractmethod
+    def write(self, data):
+        """Write bytes to the camera"""
+
+    def flush(self):
+        """Wait until written bytes have been sent"""
+
+    @abstractmethod
+    def read(self, size=1):
+        """Read up to size bytes, returning b'' if nothing arrives in time"""
+
+    @property
+    def in_waiting(self):
+        """Number of received bytes that can be read without blocking"""
+        return 0
+
+class SerialTransport(PelcoTransport):
+    """Pelco-D over a local serial port (e.g. CH341 USB-to-RS485 adapter)"""
+
+    def __init__(self, port='/dev/ttyUSB0', baudrate=9600, timeout=0.5):
+        """Initialize the serial transport
+
+        Args:
+            port: Serial port path
+            baudrate: Communication baudrate (2400, 4800, 9600, or 38400)
+            timeout: Read timeout in seconds
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.ser = None
+
+    @property
+    def is_open(self):
+        return self.ser is not None and self.ser.is_open
+
+    def open(self):
+        if serial is None:
+            raise RuntimeError("pyserial is required for the serial transport")
+
+        self.ser = serial.Serial(
+            port=self.port,
+            baudrate=self.baudrate,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            timeout=self.timeout
+        )
+        logger.info(f"Opened serial transport {self.port} at {self.baudrate} baud")
+
+    def close(self):
+        if self.ser:
+            self.ser.close()
+            self.ser = None
+
+    def write(self, data):
+        return self.ser.write(data)
+
+    def flush(self):
+        self.ser.flush()
+
+    def read(self, size=1):
+        return self.ser.read(size)
+
+    @property
+    def in_waiting(self):
+        return self.ser.in_waiting if self.ser else 0
+
+class TcpSerialTransport(PelcoTransport):
+    """Pelco-D through a TCP-to-serial bridge (ser2net, RS-485 device servers)"""
+
+    def __init__(self, host, port, timeout=0.5):
+        """Initialize the TCP transport
+
+        Args:
+            host: Bridge host name or IP address
+            port: Bridge TCP port
+            timeout: Connect and read timeout in seconds
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.sock is not None
+
+    def open(self):
+        with self.lock:
+            self._connect()
+
+    def close(self):
+        with self.lock:
+            self._disconnect()
+
+    def write(self, data):
+        # Reconnect lazily so a bridge reboot only costs the frames sent
+        # while it was down
+        with self.lock:
+            if self.sock is None:
+                self._connect()
+            sock = self.sock
+
+        try:
+            sock.sendall(data)
+        except OSError:
+            with self.lock:
+                if self.sock is sock:
+                    self._disconnect()
+            raise
+        return len(data)
+
+    def read(self, size=1):
+        sock = self.sock
+        if sock is None:
+            time.sleep(self.timeout)
+            return b''
+
+        try:
+            data = sock.recv(max(size, 64))
+        except socket.timeout:
+            return b''
+        except OSError:
+            return b''
+
+        if not data:
+            # Bridge closed the connection
+            with self.lock:
+                if self.sock is sock:
+                    self._disconnect()
+        return data
+
+    def _connect(self):
+        """Connect to the bridge (lock must be held)"""
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        logger.info(f"Connected to TCP serial bridge {self.host}:{self.port}")
+
+    def _disconnect(self):
+        """Close the bridge connection (lock must be held)"""
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+            logger.warning(f"Disconnected from TCP serial bridge {self.host}:{self.port}")
+
+class LoopbackTransport(PelcoTransport):
+    """In-memory transport for tests and benchmarks
+
+    Records every write with a timestamp. An optional responder emulates the
+    camera: it is called with each written chunk and may return reply bytes,
+    which become readable as if the camera had sent them.
+    """
+
+    def __init__(self, responder=None, baudrate=None, timeout=0.5, history=1024):
+        """Initialize the loopback transport
+
+        Args:
+            responder: Function called with written bytes, returning reply
+                bytes or None
+            baudrate: If set, writes take as long as they would on the wire
+            timeout: Read timeout in seconds
+            history: Number of writes to keep
+        """
+        self.responder = responder
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.written = deque(maxlen=history)  # (perf_counter timestamp, bytes)
+        self.writes = 0
+        self.rx_buffer = bytearray()
+        self.condition = threading.Condition()
+        self.is_open = False
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        with self.condition:
+            self.is_open = False
+            self.condition.notify_all()
+
+    def write(self, data):
+        data = bytes(data)
+        if self.baudrate:
+            # 8N1: ten bits on the wire per byte
+            time.sleep(len(data) * 10 / self.baudrate)
+
+        with self.condition:
+            self.written.append((time.perf_counter(), data))
+            self.writes += 1
+            self.condition.notify_all()
+
+        if self.responder:
+            reply = self.responder(data)
+            if reply:
+                self.inject(reply)
+        return len(data)
+
+    def read(self, size=1):
+        with self.condition:
+            if not self.rx_buffer:
+                self.condition.wait(self.timeout)
+            data = bytes(self.rx_buffer[:size])
+            del self.rx_buffer[:size]
+            return data
+
+    @property
+    def in_waiting(self):
+        return len(self.rx_buffer)
+
+    def inject(self, data):
+        """Make bytes readable as if the camera had sent them"""
+        with self.condition:
+            self.rx_buffer.extend(data)
+            self.condition.notify_all()
+
+    def wait_for_writes(self, count, timeout=None):
+        """Wait until at least count writes have been made
+
+        Returns:
+            bool: True if the count was reached before the timeout
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.writes >= count, timeout)
+
+def create_transport(spec, baudrate=9600):
+    """Create a Pelco-D transport from a specification string
+
+    Args:
+        spec: 'serial:/dev/ttyUSB0', 'tcp:host:port' or 'loopback'
+        baudrate: Baudrate for serial transports
+
+    Returns:
+        PelcoTransport: Unopened transport
+    """
+    kind, _, target = spec.partition(':')
+    if kind == 'serial':
+        return SerialTransport(target or '/dev/ttyUSB0', baudrate)
+    elif kind == 'tcp':
+        host, _, port = target.rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError(f"Invalid TCP transport '{spec}', expected tcp:host:port")
+        return TcpSerialTransport(host, int(port))
+    elif kind == 'loopback':
+        return LoopbackTransport()
+    raise ValueError(f"Unknown Pelco-D transport: {spec}")
+
 class CameraController:
     """Controls PTZ camera movements and mode switching"""
     
-    def __init__(self, rgb_device='/dev/video0', ir_device='/dev/video1'):
-        """Initialize the camera controller"""
+    def __init__(self, rgb_device='/dev/video0', ir_device='/dev/video1', keepalive_interval=1.0,
+                 transport=None, pelco_address=1, poll_interval=0, zoom_travel_time=5.0,
+                 absolute_zoom=False, control_tick=0.02):
+        """Initialize the camera controller
+
+        Args:
+            rgb_device: RGB camera device path
+            ir_device: IR/Thermal camera device path
+            keepalive_interval: Seconds between repeated movement commands
+                while the speed is unchanged, 0 disables the refresh
+            transport: PelcoTransport to the PTZ hardware, None to only
+                simulate movement
+            pelco_address: Pelco-D address of the camera (1-255)
+            poll_interval: Seconds between position queries, 0 disables
+            zoom_travel_time: Seconds the lens takes from wide to full zoom,
+                until measured with calibrate_zoom()
+            absolute_zoom: The camera supports the absolute zoom command
+            control_tick: Minimum seconds between movement frames; changes
+                within one tick are merged into a single frame, 0 sends
+                every change at once
+        """
         self.rgb_device = rgb_device
         self.ir_device = ir_device
         self.current_mode = CameraMode.RGB
+        self.mode_callback = None
         self.pan_speed = 0
         self.tilt_speed = 0
         self.zoom_level = 0
+        self.zoom_direction = 0
+        self.zoom = ZoomController(
+            self._drive_zoom,
+            travel_time=zoom_travel_time,
+            absolute=absolute_zoom
+        )
+        self.position = {"pan": None, "tilt": None, "zoom": None, "timestamp": None}
+        self.keepalive_interval = keepalive_interval
+        self.control_tick = control_tick
+        self.last_motion_sent = 0.0
+        self.motion_changed = False
+        self.stop_requested = False
+        self.condition = threading.Condition()
         self.running = False
         self.control_thread = None
+        self.transport = transport
+        self.pelco_address = pelco_address
+        self.poll_interval = poll_interval
+        self.bus = None
+        self.ptz = None
+        self.commands = CommandRegistry(self)
         self._check_cameras()
         
     def _check_cameras(self):
@@ -52,10 +373,14 @@ class CameraController:
             logger.warning("Camera controller is already running")
             return
             
+        if self.transport:
+            self._open_pelco()
+
         self.running = True
         self.control_thread = threading.Thread(target=self._control_loop)
         self.control_thread.daemon = True
         self.control_thread.start()
+        self.zoom.start()
         logger.info("Camera controller started")
         
     def stop(self):
@@ -64,9 +389,14 @@ class CameraController:
             logger.warning("Camera controller is not running")
             return
             
-        self.running = False
+        self.zoom.stop()
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
         if self.control_thread:
             self.control_thread.join(timeout=2.0)
+        if self.bus:
+            self._close_pelco()
         logger.info("Camera controller stopped")
         
     def set_pan(self, speed):
@@ -75,7 +405,7 @@ class CameraController:
         Args:
             speed (int): Speed value from -100 to 100, 0 is stopped
         """
-        self.pan_speed = max(-100, min(100, speed))
+        self._set_speeds(max(-100, min(100, speed)), None)
         logger.debug(f"Pan speed set to {self.pan_speed}")
         
     def set_tilt(self, speed):
@@ -84,9 +414,19 @@ class CameraController:
         Args:
             speed (int): Speed value from -100 to 100, 0 is stopped
         """
-        self.tilt_speed = max(-100, min(100, speed))
+        self._set_speeds(None, max(-100, min(100, speed)))
         logger.debug(f"Tilt speed set to {self.tilt_speed}")
         
+    def set_pan_tilt(self, pan_speed, tilt_speed):
+        """Set pan and tilt speed together, sent as a single movement
+        
+        Args:
+            pan_speed (int): Speed value from -100 to 100, 0 is stopped
+            tilt_speed (int): Speed value from -100 to 100, 0 is stopped
+        """
+        self._set_speeds(max(-100, min(100, pan_speed)), max(-100, min(100, tilt_speed)))
+        logger.debug(f"Pan/tilt speed set to {self.pan_speed}/{self.tilt_speed}")
+        
     def set_zoom(self, level):
         """Set zoom level
         
@@ -96,6 +436,20 @@ class CameraController:
         self.zoom_level = max(0, min(100, level))
         self._set_zoom(self.zoom_level)
         logger.debug(f"Zoom level set to {self.zoom_level}")
+
+    def calibrate_zoom(self):
+        """Measure the zoom range and travel time from position feedback
+
+        Runs the lens through its full travel, then returns it to the
+        current zoom level. Needs a connected camera that reports its zoom
+        position.
+
+        Returns:
+            float: Measured wide-to-full travel time, or None on failure
+        """
+        travel_time = self.zoom.calibrate()
+        self._set_zoom(self.zoom_level)
+        return travel_time
         
     def set_camera_mode(self, mode):
         """Set camera mode
@@ -117,6 +471,20 @@ class CameraController:
             self._activate_rgb_camera()
         else:
             self._activate_ir_camera()
+
+        if self.mode_callback:
+            try:
+                self.mode_callback(mode)
+            except Exception as e:
+                logger.error(f"Error in camera mode callback: {e}")
+
+    def set_mode_callback(self, callback):
+        """Set callback function for camera mode changes
+
+        Args:
+            callback: Function to call with the new CameraMode
+        """
+        self.mode_callback = callback
             
     def get_current_camera_device(self):
         """Get the current active camera device path"""
@@ -125,6 +493,28 @@ class CameraController:
     def get_camera_mode(self):
         """Get the current camera mode"""
         return self.current_mode.value
+
+    def get_position(self):
+        """Get the last pan/tilt/zoom position reported by the camera
+
+        Values are None until the hardware has reported them.
+        """
+        return self.position.copy()
+
+    def update_position(self, position, updated=None):
+        """Update the reported position from camera feedback
+
+        Args:
+            position (dict): Any of 'pan', 'tilt' (degrees), 'zoom' (raw
+                position) and 'timestamp'
+            updated (str): Key of the value the camera just reported, None
+                if every value in position is fresh
+        """
+        self.position = dict(self.position, **position)
+        # Pan and tilt replies carry the cached zoom position, which must
+        # not be mistaken for a new zoom reading
+        if updated in (None, "zoom") and position.get("zoom") is not None:
+            self.zoom.update_position(position["zoom"])
         
     def process_command(self, command):
         """Process a command from the client
@@ -132,81 +522,132 @@ class CameraController:
         Args:
             command (dict): Command dictionary with 'type' and 'value' keys
         """
-        cmd_type = command.get('type', '').lower()
-        value = command.get('value', 0)
-        
-        if cmd_type == 'pan':
-            self.set_pan(value)
-        elif cmd_type == 'tilt':
-            self.set_tilt(value)
-        elif cmd_type == 'zoom':
-            self.set_zoom(value)
-        elif cmd_type == 'mode':
-            self.set_camera_mode(value)
-        else:
-            logger.warning(f"Unknown command type: {cmd_type}")
+        self.commands.apply_commands([command])
             
+    def _set_speeds(self, pan_speed, tilt_speed, zoom_direction=None):
+        """Update pan/tilt speed or zoom direction and wake the control loop on a change"""
+        with self.condition:
+            if pan_speed is not None and pan_speed != self.pan_speed:
+                self.pan_speed = pan_speed
+                self.motion_changed = True
+            if tilt_speed is not None and tilt_speed != self.tilt_speed:
+                self.tilt_speed = tilt_speed
+                self.motion_changed = True
+            if zoom_direction is not None and zoom_direction != self.zoom_direction:
+                self.zoom_direction = zoom_direction
+                self.motion_changed = True
+            if self.motion_changed and self.pan_speed == 0 and self.tilt_speed == 0:
+                # Stops skip the control tick and are never merged away
+                self.stop_requested = True
+            if self.motion_changed:
+                self.condition.notify_all()
+
     def _control_loop(self):
-        """Main control loop for camera movement"""
+        """Main control loop for camera movement
+
+        Sleeps until the speed changes and sends the new movement right
+        away, or at the end of the current control tick if a frame was just
+        sent, so a burst of changes becomes one frame. A pan/tilt stop is
+        always sent at once, even if the stick moves again within the tick.
+        While moving at an unchanged speed the command is only repeated
+        every keepalive_interval; an idle camera costs nothing.
+        """
         logger.info("Control loop started")
         
-        while self.running:
-            # Send pan/tilt commands if there's any movement
-            if self.pan_speed != 0 or self.tilt_speed != 0:
-                self._move_camera(self.pan_speed, self.tilt_speed)
-                
-            time.sleep(0.05)  # 20Hz control rate
+        while True:
+            with self.condition:
+                moving = self.pan_speed != 0 or self.tilt_speed != 0 or self.zoom_direction != 0
+                timeout = None
+                if moving and self.keepalive_interval > 0:
+                    timeout = self.keepalive_interval
+
+                self.condition.wait_for(
+                    lambda: self.motion_changed or not self.running, timeout)
+                if not self.running:
+                    break
+
+                # Let the rest of a burst arrive before sending
+                tick_end = self.last_motion_sent + self.control_tick
+                if self.motion_changed and not self.stop_requested and tick_end > time.monotonic():
+                    self.condition.wait_for(lambda: self.stop_requested or not self.running,
+                                            tick_end - time.monotonic())
+                    if not self.running:
+                        break
+
+                pan_speed, tilt_speed = self.pan_speed, self.tilt_speed
+                zoom_direction = self.zoom_direction
+                self.motion_changed = False
+                if self.stop_requested:
+                    # Movement requested after the stop follows next tick
+                    self.motion_changed = pan_speed != 0 or tilt_speed != 0
+                    pan_speed = tilt_speed = 0
+                    self.stop_requested = False
+                self.last_motion_sent = time.monotonic()
+
+            # Send outside the lock so callers never wait on the hardware
+            self._move_camera(pan_speed, tilt_speed, zoom_direction)
             
         logger.info("Control loop ended")
         
-    def _move_camera(self, pan_speed, tilt_speed):
+    def _move_camera(self, pan_speed, tilt_speed, zoom_direction=0):
         """Send movement commands to the camera hardware"""
-        # Convert -100 to 100 scale to hardware-specific values
-        # This would call into pi_ptz.py functions to control movement
-        # For simulation, just log the commands
-        logger.debug(f"Move camera: pan={pan_speed}, tilt={tilt_speed}")
+        logger.debug(f"Move camera: pan={pan_speed}, tilt={tilt_speed}, zoom={zoom_direction}")
         
-        # Actual hardware interface would go here
-        # Example: call to external script or direct serial communication
+        if not self.ptz:
+            # No hardware transport configured, simulation only
+            return
+            
         try:
-            # Convert to 0-63 range for Pelco-D protocol
-            pelco_pan_speed = abs(int(pan_speed * 0.63))
-            pelco_tilt_speed = abs(int(tilt_speed * 0.63))
+            # Convert -100 to 100 scale to the signed 0-63 Pelco-D range
+            pelco_pan_speed = int(pan_speed * 0.63)
+            pelco_tilt_speed = int(tilt_speed * 0.63)
             
-            # Set direction commands
-            cmd_2 = 0
-            if pan_speed < 0:
-                cmd_2 |= 0x04  # Left
-            elif pan_speed > 0:
-                cmd_2 |= 0x02  # Right
-                
-            if tilt_speed < 0:
-                cmd_2 |= 0x08  # Up
-            elif tilt_speed > 0:
-                cmd_2 |= 0x10  # Down
-                
-            # This would send Pelco-D command to the camera
-            # Example: self._send_pelco_command(0x00, cmd_2, pelco_pan_speed, pelco_tilt_speed)
+            # Pan/tilt and zoom share one Pelco-D motion frame
+            self.ptz.move(pelco_pan_speed, pelco_tilt_speed, zoom_direction)
             
         except Exception as e:
             logger.error(f"Error moving camera: {e}")
         
     def _set_zoom(self, zoom_level):
-        """Set the zoom level on the camera"""
-        # Convert 0-100 scale to hardware-specific zoom command
-        # This would call into pi_ptz.py functions to control zoom
+        """Move the zoom to a level on the 0-100 scale"""
         logger.debug(f"Set zoom level: {zoom_level}")
         
-        # Example: If zoom level > 50, zoom in, else zoom out
         try:
-            # This would send Pelco-D zoom command to the camera
-            # Example: if zoom_level > self.current_zoom:
-            #    self._send_pelco_command(0x00, 0x20)  # Zoom in
-            # else:
-            #    self._send_pelco_command(0x00, 0x40)  # Zoom out
-            pass
+            self.zoom.set_target(zoom_level)
         except Exception as e:
             logger.error(f"Error setting zoom: {e}")
+
+    def _drive_zoom(self, direction):
+        """Zoom in (1), out (-1) or hold (0) alongside the current pan/tilt"""
+        self._set_speeds(None, None, direction)
+            
+    def _open_pelco(self):
+        """Open the Pelco-D link to the PTZ hardware"""
+        logger.info(f"Opening Pelco-D link to camera address {self.pelco_address}")
+        
+        if not self.transport.is_open:
+            self.transport.open()
+            
+        self.bus = PelcoBus(
+            self.transport,
+            addresses=[self.pelco_address],
+            poll_interval=self.poll_interval
+        )
+        self.bus.open()
+        self.ptz = self.bus.camera(self.pelco_address)
+        self.ptz.set_position_callback(self.update_position)
+        self.zoom.camera = self.ptz
+        
+    def _close_pelco(self):
+        """Stop the camera and close the Pelco-D link"""
+        try:
+            self.ptz.stop()
+            self.bus.close()
+        finally:
+            self.zoom.camera = None
+            self.ptz = None
+            self.bus = None
+            self.transport.close()
             
     def _activate_rgb_camera(self):
         """Activate the RGB camera"""
@@ -227,8 +668,9 @@ if __name__ == "__main__":
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     
-    # Test the camera controller
-    controller = CameraController()
+    # Test the camera controller against an in-memory Pelco-D device
+    transport = LoopbackTransport()
+    controller = CameraController(transport=transport)
     controller.start()
     
     try:
@@ -253,4 +695,6 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("Test interrupted")
     finally:
-        controller.stop()
\ No newline at end of file
+        controller.stop()
+        for timestamp, frame in transport.written:
+            print(f"Pelco-D frame sent: {frame.hex(' ')}")
\ No newline at end of file
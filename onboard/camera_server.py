@@ -14,10 +14,14 @@ import threading
 from time import sleep
 
 # Import our components
-from camera_controller import CameraController
+from camera_controller import CameraController, create_transport
 from video_streamer import VideoStreamer
 from wifi_server import WifiServer
+from async_wifi_server import AsyncWifiServer
 from bt_server import BluetoothServer
+from udp_control import UdpControlServer
+from command_protocol import StatusBroadcaster
+from motion_arbiter import MotionArbiter
 
 # Configure logging
 logging.basicConfig(
@@ -44,8 +48,31 @@ class CameraServer:
             "rgb_device": "/dev/video0",
             "ir_device": "/dev/video1",
             "wifi_port": 8000,
+            "wifi_server": "threaded",
+            "status_queue_size": 8,
+            "status_backlog_limit": 5.0,
+            "udp_port": None,
+            "udp_deadman": 0.5,
             "rtsp_port": 8554,
+            "stream_width": 640,
+            "stream_height": 480,
+            "stream_framerate": 30,
+            "stream_bitrate": 500,
+            "stream_encoder": "auto",
+            "stream_mode": "rtsp",
+            "instant_switch": False,
+            "adaptive_quality": True,
+            "control_keepalive": 1.0,
+            "control_tick": 0.02,
+            "pelco_transport": None,
+            "pelco_address": 1,
+            "pelco_baudrate": 9600,
+            "position_poll_interval": 0,
+            "zoom_travel_time": 5.0,
+            "absolute_zoom": False,
+            "calibrate_zoom": False,
             "use_bluetooth": True,
+            "bt_max_clients": 4,
             "use_local_viewer": False
         }
         
@@ -57,10 +84,14 @@ class CameraServer:
         
         # Create components
         self.camera_controller = None
+        self.motion_arbiter = None
         self.video_streamer = None
         self.wifi_server = None
+        self.udp_server = None
         self.bt_server = None
         self.local_viewer = None
+        # Status reports are encoded once for the clients of every transport
+        self.status_broadcaster = StatusBroadcaster(status_source=self.get_status)
         
         # Initialize components
         self._init_components()
@@ -68,35 +99,86 @@ class CameraServer:
     def _init_components(self):
         """Initialize all server components"""
         logger.info("Initializing camera controller")
+        transport = None
+        if self.config["pelco_transport"]:
+            transport = create_transport(
+                self.config["pelco_transport"],
+                baudrate=self.config["pelco_baudrate"]
+            )
+        else:
+            logger.warning("No Pelco-D transport configured, PTZ movement is simulated")
+            
         self.camera_controller = CameraController(
             rgb_device=self.config["rgb_device"],
-            ir_device=self.config["ir_device"]
+            ir_device=self.config["ir_device"],
+            keepalive_interval=self.config["control_keepalive"],
+            transport=transport,
+            pelco_address=self.config["pelco_address"],
+            poll_interval=self.config["position_poll_interval"],
+            zoom_travel_time=self.config["zoom_travel_time"],
+            absolute_zoom=self.config["absolute_zoom"],
+            control_tick=self.config["control_tick"]
         )
         
+        # Every control source gets a motion session through the arbiter
+        self.motion_arbiter = MotionArbiter(self.camera_controller)
+        
         logger.info("Initializing video streamer")
         self.video_streamer = VideoStreamer(
             camera_controller=self.camera_controller,
-            port=self.config["rtsp_port"]
+            port=self.config["rtsp_port"],
+            width=self.config["stream_width"],
+            height=self.config["stream_height"],
+            framerate=self.config["stream_framerate"],
+            bitrate=self.config["stream_bitrate"],
+            encoder=self.config["stream_encoder"],
+            mode=self.config["stream_mode"],
+            instant_switch=self.config["instant_switch"],
+            adaptive=self.config["adaptive_quality"]
         )
+        self.camera_controller.set_mode_callback(self.video_streamer.switch_camera)
         
         logger.info("Initializing WiFi server")
-        self.wifi_server = WifiServer(
+        wifi_server_class = AsyncWifiServer if self.config["wifi_server"] == "asyncio" else WifiServer
+        self.wifi_server = wifi_server_class(
             camera_controller=self.camera_controller,
             video_streamer=self.video_streamer,
-            port=self.config["wifi_port"]
+            port=self.config["wifi_port"],
+            queue_size=self.config["status_queue_size"],
+            backlog_limit=self.config["status_backlog_limit"],
+            arbiter=self.motion_arbiter,
+            broadcaster=self.status_broadcaster
         )
         
+        self.status_broadcaster.add_transport(self.wifi_server)
+        
+        if self.config["udp_port"]:
+            logger.info("Initializing UDP control server")
+            self.udp_server = UdpControlServer(
+                camera_controller=self.camera_controller,
+                port=self.config["udp_port"],
+                deadman_timeout=self.config["udp_deadman"],
+                arbiter=self.motion_arbiter
+            )
+        
         if self.config["use_bluetooth"]:
             logger.info("Initializing Bluetooth server")
             self.bt_server = BluetoothServer(
-                camera_controller=self.camera_controller
+                camera_controller=self.camera_controller,
+                arbiter=self.motion_arbiter,
+                max_clients=self.config["bt_max_clients"],
+                queue_size=self.config["status_queue_size"],
+                backlog_limit=self.config["status_backlog_limit"],
+                broadcaster=self.status_broadcaster
             )
+            self.status_broadcaster.add_transport(self.bt_server)
         
         if HAS_LOCAL_VIEWER and self.config["use_local_viewer"]:
             logger.info("Initializing local stream viewer")
             self.local_viewer = LocalStreamViewer(
                 camera_controller=self.camera_controller,
-                video_streamer=self.video_streamer
+                video_streamer=self.video_streamer,
+                arbiter=self.motion_arbiter
             )
         
     def start(self):
@@ -108,6 +190,11 @@ class CameraServer:
             logger.info("Starting camera controller")
             self.camera_controller.start()
             
+            if self.config["calibrate_zoom"]:
+                logger.info("Calibrating zoom")
+                if self.camera_controller.calibrate_zoom() is None:
+                    logger.warning(f"Zoom calibration failed, using {self.config['zoom_travel_time']}s travel time")
+            
             # Start video streamer
             logger.info("Starting video streamer")
             self.video_streamer.start()
@@ -116,6 +203,11 @@ class CameraServer:
             logger.info("Starting WiFi server")
             self.wifi_server.start()
             
+            # Start UDP control channel if enabled
+            if self.udp_server:
+                logger.info("Starting UDP control server")
+                self.udp_server.start()
+                
             # Start Bluetooth server if enabled
             if self.bt_server:
                 logger.info("Starting Bluetooth server")
@@ -153,6 +245,13 @@ class CameraServer:
             except Exception as e:
                 logger.error(f"Error stopping Bluetooth server: {e}")
                 
+        if self.udp_server:
+            try:
+                logger.info("Stopping UDP control server")
+                self.udp_server.stop()
+            except Exception as e:
+                logger.error(f"Error stopping UDP control server: {e}")
+                
         try:
             logger.info("Stopping WiFi server")
             self.wifi_server.stop()
@@ -173,6 +272,20 @@ class CameraServer:
             
         logger.info("All services stopped")
         
+    def get_status(self):
+        """Build the status report sent to the clients of every transport
+
+        The WiFi server's report, with the Bluetooth clients' command and
+        delivery statistics under "bluetooth" when it is enabled.
+        """
+        status = self.wifi_server.get_status()
+        if self.bt_server:
+            status["bluetooth"] = {
+                "commands": self.bt_server.commands.get_stats(),
+                "status_fanout": self.bt_server.get_fanout_stats()
+            }
+        return status
+        
     def run(self):
         """Run the server in the main thread"""
         if not self.start():
@@ -188,6 +301,8 @@ class CameraServer:
             logger.info("PTZ Camera Controller Server")
             logger.info("========================================")
             logger.info(f"WiFi control: {wifi_addr}")
+            if self.udp_server:
+                logger.info(f"UDP control: 0.0.0.0:{self.udp_server.port}")
             logger.info(f"Video stream: {rtsp_url}")
             logger.info(f"Bluetooth: {'enabled' if self.bt_server else 'disabled'}")
             logger.info(f"Local viewer: {'enabled' if self.local_viewer else 'disabled'}")
@@ -218,10 +333,63 @@ def parse_arguments():
                         help="IR/Thermal camera device (default: /dev/video1)")
     parser.add_argument("--wifi-port", dest="wifi_port", type=int, default=8000,
                         help="WiFi server port (default: 8000)")
+    parser.add_argument("--wifi-server", dest="wifi_server", choices=["threaded", "asyncio"],
+                        default="threaded",
+                        help="WiFi server implementation; asyncio scales to many clients (default: threaded)")
+    parser.add_argument("--status-queue", dest="status_queue_size", type=int, default=8,
+                        help="Status messages queued per client before the oldest is dropped (default: 8)")
+    parser.add_argument("--status-backlog", dest="status_backlog_limit", type=float, default=5.0,
+                        help="Seconds a client may fall behind before it is disconnected (default: 5.0)")
+    parser.add_argument("--udp-port", dest="udp_port", type=int, default=None,
+                        help="UDP port for low-latency joystick datagrams (default: disabled)")
+    parser.add_argument("--udp-deadman", dest="udp_deadman", type=float, default=0.5,
+                        help="Seconds without UDP control datagrams before motion stops (default: 0.5)")
     parser.add_argument("--rtsp-port", dest="rtsp_port", type=int, default=8554,
                         help="RTSP streaming port (default: 8554)")
+    parser.add_argument("--stream-width", dest="stream_width", type=int, default=640,
+                        help="Stream width (default: 640)")
+    parser.add_argument("--stream-height", dest="stream_height", type=int, default=480,
+                        help="Stream height (default: 480)")
+    parser.add_argument("--stream-fps", dest="stream_framerate", type=int, default=30,
+                        help="Stream frames per second (default: 30)")
+    parser.add_argument("--stream-bitrate", dest="stream_bitrate", type=int, default=500,
+                        help="Stream bitrate in kbit/s (default: 500)")
+    parser.add_argument("--encoder", dest="stream_encoder", default="auto",
+                        help="H.264 encoder: v4l2h264enc, nvv4l2h264enc, omxh264enc, x264enc or auto "
+                             "to probe for the best one installed (default: auto)")
+    parser.add_argument("--stream-mode", dest="stream_mode", choices=["rtsp", "udp"], default="rtsp",
+                        help="rtsp serves /rgb and /ir to any number of viewers, udp sends RTP from "
+                             "gst-launch to the RTSP port (default: rtsp, udp without GStreamer bindings)")
+    parser.add_argument("--instant-switch", dest="instant_switch", action="store_true",
+                        help="Capture both cameras into one encoder and serve /live, which switches "
+                             "camera inside the running stream, instead of /rgb and /ir")
+    parser.add_argument("--no-adaptive-quality", dest="adaptive_quality", action="store_false",
+                        help="Keep the configured stream size, frame rate and bitrate instead of lowering "
+                             "them while viewers report loss, delay or the encoder falls behind")
+    parser.add_argument("--control-keepalive", dest="control_keepalive", type=float, default=1.0,
+                        help="Seconds between repeated movement commands, 0 to disable (default: 1.0)")
+    parser.add_argument("--control-tick", dest="control_tick", type=float, default=0.02,
+                        help="Seconds over which movement changes are merged into one frame, 0 to send each "
+                             "change at once (default: 0.02)")
+    parser.add_argument("--pelco", dest="pelco_transport", default=None,
+                        help="Pelco-D link: serial:/dev/ttyUSB0, tcp:HOST:PORT or loopback "
+                             "(default: simulate movement)")
+    parser.add_argument("--pelco-address", dest="pelco_address", type=int, default=1,
+                        help="Pelco-D camera address (default: 1)")
+    parser.add_argument("--pelco-baudrate", dest="pelco_baudrate", type=int, default=9600,
+                        help="Pelco-D serial baudrate (default: 9600)")
+    parser.add_argument("--position-poll", dest="position_poll_interval", type=float, default=0,
+                        help="Seconds between pan/tilt/zoom position queries, 0 to disable (default: 0)")
+    parser.add_argument("--zoom-travel-time", dest="zoom_travel_time", type=float, default=5.0,
+                        help="Seconds the lens takes from wide to full zoom (default: 5.0)")
+    parser.add_argument("--absolute-zoom", dest="absolute_zoom", action="store_true",
+                        help="Camera supports the Pelco-D absolute zoom command")
+    parser.add_argument("--calibrate-zoom", dest="calibrate_zoom", action="store_true",
+                        help="Measure zoom range and travel time at startup (needs position replies)")
     parser.add_argument("--no-bluetooth", dest="use_bluetooth", action="store_false",
                         help="Disable Bluetooth server")
+    parser.add_argument("--bt-max-clients", dest="bt_max_clients", type=int, default=4,
+                        help="Simultaneous Bluetooth clients (default: 4)")
     parser.add_argument("--local-viewer", dest="use_local_viewer", action="store_true",
                         help="Enable local stream viewer for connected monitor")
     
@@ -237,8 +405,31 @@ def main():
         "rgb_device": args.rgb_device,
         "ir_device": args.ir_device,
         "wifi_port": args.wifi_port,
+        "wifi_server": args.wifi_server,
+        "status_queue_size": args.status_queue_size,
+        "status_backlog_limit": args.status_backlog_limit,
+        "udp_port": args.udp_port,
+        "udp_deadman": args.udp_deadman,
         "rtsp_port": args.rtsp_port,
+        "stream_width": args.stream_width,
+        "stream_height": args.stream_height,
+        "stream_framerate": args.stream_framerate,
+        "stream_bitrate": args.stream_bitrate,
+        "stream_encoder": args.stream_encoder,
+        "stream_mode": args.stream_mode,
+        "instant_switch": args.instant_switch,
+        "adaptive_quality": args.adaptive_quality,
+        "control_keepalive": args.control_keepalive,
+        "control_tick": args.control_tick,
+        "pelco_transport": args.pelco_transport,
+        "pelco_address": args.pelco_address,
+        "pelco_baudrate": args.pelco_baudrate,
+        "position_poll_interval": args.position_poll_interval,
+        "zoom_travel_time": args.zoom_travel_time,
+        "absolute_zoom": args.absolute_zoom,
+        "calibrate_zoom": args.calibrate_zoom,
         "use_bluetooth": args.use_bluetooth,
+        "bt_max_clients": args.bt_max_clients,
         "use_local_viewer": args.use_local_viewer
     }
     
@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+"""
+Command stream framing for the PTZ camera control protocol.
+Clients send one command per line, either JSON ({"type": "pan", "value": 50})
+or text (pan 50). TCP and RFCOMM deliver a byte stream, so a single read can
+hold several commands or only part of one. This module turns that stream back
+into complete lines, and frames the status messages sent the other way.
+ClientWriter delivers those messages to one socket client without letting a
+slow client hold up the others; the WiFi and Bluetooth servers share it.
+
+A client may instead negotiate fixed-size binary command frames by making
+its first line a hello, e.g. "hello binary 1" or
+{"type": "hello", "protocol": "binary", "version": 1}. The server answers
+with a hello status line naming the protocol and version it picked, and
+every later byte from that client is read as 8-byte frames:
+
+    magic (0xA5), message type, sequence (uint16 LE),
+    pan (int8), tilt (int8), zoom (uint8), mode (uint8)
+
+Status messages to the client stay newline-delimited JSON either way.
+"""
+
+import json
+import time
+import struct
+import socket
+import select
+import logging
+import threading
+from collections import deque, namedtuple
+
+logger = logging.getLogger('command_protocol')
+
+# Longest command line accepted; real commands are well under 100 bytes
+MAX_LINE_LENGTH = 4096
+
+_STATUS_ENCODER = json.JSONEncoder(separators=(',', ':'))
+
+# Binary command frames
+BINARY_MAGIC = 0xA5
+BINARY_VERSIONS = (1,)  # Supported versions, oldest first
+BINARY_FRAME_LENGTH = 8
+
+MSG_PAN = 0x01
+MSG_TILT = 0x02
+MSG_PAN_TILT = 0x03
+MSG_ZOOM = 0x04
+MSG_MODE = 0x05
+MSG_STOP = 0x06
+MSG_STATUS = 0x07
+
+_BINARY_FRAME = struct.Struct('<BBHbbBB')
+
+BinaryCommand = namedtuple('BinaryCommand', ['type', 'sequence', 'pan', 'tilt', 'zoom', 'mode'])
+
+def encode_status(status):
+    """Encode a status update once for every client and transport
+
+    Args:
+        status (dict): Status data
+
+    Returns:
+        bytes: Compact JSON followed by a newline, ready to write as is
+    """
+    return (_STATUS_ENCODER.encode(status) + '\n').encode('utf-8')
+
+class StatusBroadcaster:
+    """Publishes status updates to several transports with a single encode
+
+    Each transport (WiFi, Bluetooth, ...) only needs a send_encoded(message)
+    method; every one of them is handed the same immutable buffer.
+    """
+
+    def __init__(self, transports=(), status_source=None):
+        """Initialize the broadcaster
+
+        Args:
+            transports: Objects with a send_encoded(message) method
+            status_source: Function returning the current status report,
+                for publish() without a status
+        """
+        self.transports = list(transports)
+        self.status_source = status_source
+        self.published = 0
+
+    def add_transport(self, transport):
+        """Add a transport to publish to"""
+        self.transports.append(transport)
+
+    def publish(self, status=None):
+        """Encode a status update and send it on every transport
+
+        Args:
+            status (dict): Status data, None for a report from status_source
+
+        Returns:
+            bytes: The encoded message, or None if it could not be encoded
+        """
+        try:
+            if status is None:
+                status = self.status_source()
+            message = encode_status(status)
+        except Exception as e:
+            logger.error(f"Error serializing status data: {e}")
+            return None
+
+        for transport in self.transports:
+            try:
+                transport.send_encoded(message)
+            except Exception as e:
+                logger.error(f"Error publishing status to {type(transport).__name__}: {e}")
+        self.published += 1
+        return message
+
+class FanoutStats:
+    """Delivery statistics for status messages across all clients"""
+
+    def __init__(self, samples=1000):
+        """Initialize the statistics
+
+        Args:
+            samples (int): Number of recent delivery latencies to keep
+        """
+        self.latencies = deque(maxlen=samples)
+        self.sent = 0
+        self.dropped = 0
+        self.slow_disconnects = 0
+        self.lock = threading.Lock()
+
+    def record_sent(self, latency):
+        """Record a message delivered to one client after latency seconds"""
+        with self.lock:
+            self.sent += 1
+            self.latencies.append(latency)
+
+    def record_dropped(self):
+        """Record a queued message replaced by a newer one"""
+        with self.lock:
+            self.dropped += 1
+
+    def record_slow_disconnect(self):
+        """Record a client disconnected for falling too far behind"""
+        with self.lock:
+            self.slow_disconnects += 1
+
+    def get_stats(self):
+        """Get delivery counters and latency percentiles in milliseconds"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                "sent": self.sent,
+                "dropped": self.dropped,
+                "slow_disconnects": self.slow_disconnects
+            }
+
+        if latencies:
+            count = len(latencies)
+            stats["latency_ms"] = {
+                "p50": round(latencies[count // 2] * 1000, 3),
+                "p95": round(latencies[min(count - 1, int(count * 0.95))] * 1000, 3),
+                "max": round(latencies[-1] * 1000, 3)
+            }
+        return stats
+
+class ClientWriter:
+    """Sends status messages to one client from its own thread
+
+    Messages wait in a small bounded queue. When the client cannot keep up
+    the oldest queued messages are dropped, since only the newest status
+    matters. A client that stays behind for longer than the backlog limit
+    is disconnected.
+    """
+
+    def __init__(self, client_socket, client_addr, stats, queue_size=8, backlog_limit=5.0):
+        """Initialize the client writer
+
+        Args:
+            client_socket: Connected client socket
+            client_addr: Client address, for logging
+            stats: FanoutStats shared by all clients of the server
+            queue_size (int): Messages queued before the oldest is dropped
+            backlog_limit (float): Seconds a message may wait undelivered
+                before the client is disconnected
+        """
+        self.client_socket = client_socket
+        self.client_addr = client_addr
+        self.stats = stats
+        self.queue = deque(maxlen=queue_size)
+        self.backlog_limit = backlog_limit
+        self.behind_since = None  # Creation time of the oldest undelivered message
+        self.condition = threading.Condition()
+        self.running = False
+        self.writer_thread = None
+
+    def start(self):
+        """Start the writer thread"""
+        self.running = True
+        self.writer_thread = threading.Thread(target=self._writer_loop)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+
+    def stop(self):
+        """Stop the writer thread, abandoning queued messages"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def send(self, message, timestamp):
+        """Queue a message without blocking
+
+        Args:
+            message (bytes): Complete framed message
+            timestamp (float): perf_counter time the message was created
+        """
+        with self.condition:
+            if not self.running:
+                return
+
+            if len(self.queue) == self.queue.maxlen:
+                self.stats.record_dropped()
+            self.queue.append((message, timestamp))
+            if self.behind_since is None:
+                self.behind_since = timestamp
+
+            self._check_backlog()
+            self.condition.notify_all()
+
+    def _check_backlog(self):
+        """Disconnect the client if it has been behind for too long (lock held)"""
+        if self.behind_since is None or not self.running:
+            return
+        lag = time.perf_counter() - self.behind_since
+        if lag > self.backlog_limit:
+            logger.warning(f"Client {self.client_addr} is {lag:.1f}s behind, disconnecting")
+            self.stats.record_slow_disconnect()
+            self.running = False
+            self._disconnect()
+
+    def _disconnect(self):
+        """Shut the socket down so the client handler notices and cleans up"""
+        try:
+            self.client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _send_message(self, message):
+        """Send a whole message, waiting for the socket to accept it
+
+        Returns:
+            bool: True if the whole message was sent
+        """
+        view = memoryview(message)
+        while view:
+            _, writable, _ = select.select([], [self.client_socket], [], 0.5)
+            with self.condition:
+                self._check_backlog()
+                if not self.running:
+                    return False
+            if writable:
+                sent = self.client_socket.send(view)
+                view = view[sent:]
+        return True
+
+    def _writer_loop(self):
+        """Send queued messages until stopped"""
+        while True:
+            with self.condition:
+                while not self.queue and self.running:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                message, timestamp = self.queue.popleft()
+
+            try:
+                if not self._send_message(message):
+                    break
+            except Exception as e:
+                logger.warning(f"Error sending status to {self.client_addr}: {e}")
+                self._disconnect()
+                break
+
+            self.stats.record_sent(time.perf_counter() - timestamp)
+            with self.condition:
+                self.behind_since = self.queue[0][1] if self.queue else None
+
+class LineDecoder:
+    """Incremental newline-delimited decoder for one connection
+
+    Feed it whatever each recv() returned. Partial lines are kept until the
+    rest arrives, and lines longer than max_line_length are discarded up to
+    the next newline so a misbehaving client cannot grow the buffer forever.
+    """
+
+    def __init__(self, max_line_length=MAX_LINE_LENGTH):
+        """Initialize the decoder
+
+        Args:
+            max_line_length (int): Longest line accepted, in bytes
+        """
+        self.max_line_length = max_line_length
+        self.buffer = bytearray()
+        self.discarding = False
+        self.lines_decoded = 0
+        self.lines_dropped = 0
+
+    def feed(self, data):
+        """Feed received bytes into the decoder
+
+        Args:
+            data (bytes): Bytes read from the connection
+
+        Returns:
+            list: Complete lines as bytes, stripped of surrounding whitespace,
+                empty lines skipped
+        """
+        if self.discarding:
+            end = data.find(b'\n')
+            if end == -1:
+                return []
+            data = data[end + 1:]
+            self.discarding = False
+
+        if b'\n' not in data:
+            # Common case for a split command: nothing complete yet
+            self.buffer += data
+            self._check_overflow()
+            return []
+
+        if self.buffer:
+            self.buffer += data
+            data = bytes(self.buffer)
+            self.buffer.clear()
+
+        *lines, remainder = data.split(b'\n')
+        self.buffer += remainder
+        self._check_overflow()
+
+        complete = []
+        for line in lines:
+            if len(line) > self.max_line_length:
+                self.lines_dropped += 1
+                logger.warning(f"Dropped command line of {len(line)} bytes")
+                continue
+            line = line.strip()
+            if line:
+                complete.append(line)
+        self.lines_decoded += len(complete)
+        return complete
+
+    def flush(self):
+        """Return any unterminated line, e.g. when the connection closes
+
+        Returns:
+            list: The final line as bytes, or an empty list
+        """
+        line = bytes(self.buffer).strip()
+        self.buffer.clear()
+        if not line or self.discarding:
+            self.discarding = False
+            return []
+        self.lines_decoded += 1
+        return [line]
+
+    def _check_overflow(self):
+        """Drop a partial line that is already over the length limit"""
+        if len(self.buffer) > self.max_line_length:
+            self.lines_dropped += 1
+            logger.warning(f"Command line over {self.max_line_length} bytes, discarding to next newline")
+            self.buffer.clear()
+            self.discarding = True
+
+def encode_binary_command(msg_type, sequence, pan=0, tilt=0, zoom=0, mode=0):
+    """Build a binary command frame
+
+    Args:
+        msg_type (int): One of the MSG_* constants
+        sequence (int): Sequence number, wraps at 65536
+        pan (int): Pan speed, -100 to 100
+        tilt (int): Tilt speed, -100 to 100
+        zoom (int): Zoom level, 0 to 100
+        mode (int): Camera mode, 0 (RGB) or 1 (IR)
+
+    Returns:
+        bytes: 8-byte frame
+    """
+    return _BINARY_FRAME.pack(BINARY_MAGIC, msg_type, sequence & 0xFFFF, pan, tilt, zoom, mode)
+
+class BinaryFrameDecoder:
+    """Incremental decoder for binary command frames from one connection
+
+    Like LineDecoder, it accepts reads of any size. Bytes that do not start
+    with the magic byte are skipped until the next one.
+    """
+
+    def __init__(self):
+        """Initialize the decoder"""
+        self.buffer = bytearray()
+        self.frames_decoded = 0
+        self.bytes_discarded = 0
+
+    def feed(self, data):
+        """Feed received bytes into the decoder
+
+        Args:
+            data (bytes): Bytes read from the connection
+
+        Returns:
+            list: Complete BinaryCommand tuples
+        """
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        offset = 0
+        end = len(buffer) - BINARY_FRAME_LENGTH
+
+        while offset <= end:
+            if buffer[offset] != BINARY_MAGIC:
+                resync = buffer.find(BINARY_MAGIC, offset + 1)
+                if resync == -1:
+                    resync = len(buffer)
+                self.bytes_discarded += resync - offset
+                offset = resync
+                continue
+
+            _, *fields = _BINARY_FRAME.unpack_from(buffer, offset)
+            frames.append(BinaryCommand(*fields))
+            offset += BINARY_FRAME_LENGTH
+
+        del buffer[:offset]
+        self.frames_decoded += len(frames)
+        return frames
+
+def _parse_hello(line):
+    """Parse a protocol hello line
+
+    Returns:
+        tuple: (protocol, version) requested, or None if not a hello
+    """
+    if line.startswith(b'{'):
+        try:
+            message = json.loads(line)
+        except (ValueError, UnicodeDecodeError):
+            return None
+        if not isinstance(message, dict) or message.get('type') != 'hello':
+            return None
+        protocol, version = message.get('protocol', 'text'), message.get('version', 1)
+    else:
+        parts = line.split()
+        if not parts or parts[0].lower() != b'hello':
+            return None
+        protocol = parts[1].decode('ascii', errors='replace').lower() if len(parts) > 1 else 'text'
+        version = parts[2] if len(parts) > 2 else 1
+
+    try:
+        version = int(version)
+    except (TypeError, ValueError):
+        version = 0
+    return protocol, version
+
+class CommandStream:
+    """Decodes the commands of one connection, text or negotiated binary
+
+    The first line decides the protocol. If it is a hello asking for binary
+    frames in a supported version, the rest of the stream is decoded as
+    binary frames; otherwise the connection stays line-based and the first
+    line is processed as an ordinary command.
+    """
+
+    def __init__(self, max_line_length=MAX_LINE_LENGTH, allow_binary=True):
+        """Initialize the command stream
+
+        Args:
+            max_line_length (int): Longest text line accepted, in bytes
+            allow_binary (bool): Accept binary frame negotiation
+        """
+        self.lines = LineDecoder(max_line_length)
+        self.binary = None
+        self.negotiating = True
+        self.allow_binary = allow_binary
+        self.pending = bytearray()
+        self.protocol = 'text'
+        self.version = None
+        self.reply = None
+
+    def feed(self, data):
+        """Feed received bytes into the stream
+
+        Returns:
+            list: Text command lines (bytes) and BinaryCommand tuples
+        """
+        if self.binary:
+            return self.binary.feed(data)
+        if not self.negotiating:
+            return self.lines.feed(data)
+
+        self.pending += data
+        end = self.pending.find(b'\n')
+        if end == -1:
+            if len(self.pending) > self.lines.max_line_length:
+                return self._stop_negotiating()
+            return []
+
+        hello = _parse_hello(bytes(self.pending[:end]).strip())
+        if hello is None:
+            return self._stop_negotiating()
+
+        rest = bytes(self.pending[end + 1:])
+        self.pending.clear()
+        self.negotiating = False
+
+        protocol, requested = hello
+        versions = [version for version in BINARY_VERSIONS if version <= requested]
+        if protocol == 'binary' and self.allow_binary and versions:
+            self.protocol, self.version = 'binary', versions[-1]
+            self.binary = BinaryFrameDecoder()
+        self.reply = encode_status({"type": "hello", "protocol": self.protocol, "version": self.version})
+        logger.info(f"Client asked for {protocol} v{requested}, using {self.protocol}")
+
+        return self.binary.feed(rest) if self.binary else self.lines.feed(rest)
+
+    def pop_reply(self):
+        """Take the negotiation reply to send to the client, if any
+
+        Returns:
+            bytes: Encoded hello reply, or None
+        """
+        reply, self.reply = self.reply, None
+        return reply
+
+    def flush(self):
+        """Return any unterminated text line, e.g. when the connection closes"""
+        if self.binary:
+            return []
+        if self.negotiating:
+            self._stop_negotiating()
+        return self.lines.flush()
+
+    def _stop_negotiating(self):
+        """Treat the connection as line-based from its first byte"""
+        data = bytes(self.pending)
+        self.pending.clear()
+        self.negotiating = False
+        return self.lines.feed(data)
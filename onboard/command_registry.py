@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Command dispatch shared by every control transport.
+WiFi, Bluetooth, the local viewer and CameraController.process_command all
+hand their decoded commands to a CommandRegistry instead of running their
+own if/elif chains. Commands are looked up in a dispatch dict built once,
+their arguments go through a validator, and every dispatch is counted so
+each transport gets per-command statistics. Handler latency is sampled
+rather than measured on every dispatch, which would cost more than the
+dispatch itself.
+"""
+
+import json
+import logging
+import threading
+from time import perf_counter
+from bisect import bisect_left
+from operator import attrgetter
+
+from command_protocol import (
+    BinaryCommand, MSG_PAN, MSG_TILT, MSG_PAN_TILT, MSG_ZOOM, MSG_MODE, MSG_STOP, MSG_STATUS
+)
+
+logger = logging.getLogger('command_registry')
+
+# Upper bounds of the handler latency histogram buckets, in microseconds
+LATENCY_BUCKETS_US = (10, 50, 100, 500, 1000, 5000, 10000, 50000)
+_LATENCY_BUCKETS = tuple(bound / 1e6 for bound in LATENCY_BUCKETS_US)
+
+# One dispatch in this many of each command is timed, starting with the
+# first; a power of two so the choice is a bit test
+LATENCY_SAMPLE_EVERY = 16
+_SAMPLE_MASK = LATENCY_SAMPLE_EVERY - 1
+
+# Binary frame type -> (command name, fields passed as its value)
+_BINARY_COMMANDS = {
+    MSG_PAN: ("pan", attrgetter("pan")),
+    MSG_TILT: ("tilt", attrgetter("tilt")),
+    MSG_PAN_TILT: ("pan_tilt", attrgetter("pan", "tilt")),
+    MSG_ZOOM: ("zoom", attrgetter("zoom")),
+    MSG_MODE: ("mode", attrgetter("mode")),
+    MSG_STOP: ("stop", None),
+    MSG_STATUS: ("status", None),
+}
+
+def int_range(minimum, maximum):
+    """Build a validator for an integer argument clamped to a range
+
+    Args:
+        minimum (int): Lowest value accepted
+        maximum (int): Highest value accepted
+
+    Returns:
+        function: Validator converting text, bytes or numbers to int
+    """
+    def validate(value):
+        if value is None:
+            raise ValueError("missing value")
+        value = int(value)
+        if value < minimum:
+            return minimum
+        if value > maximum:
+            return maximum
+        return value
+    return validate
+
+def one_of(*choices):
+    """Build a validator for an integer argument from a fixed set"""
+    def validate(value):
+        if value is None:
+            raise ValueError("missing value")
+        value = int(value)
+        if value not in choices:
+            raise ValueError(f"{value} is not one of {choices}")
+        return value
+    return validate
+
+def pair(validator):
+    """Build a validator for two arguments that share a validator"""
+    def validate(value):
+        if value is None or len(value) != 2:
+            raise ValueError("expected two values")
+        return validator(value[0]), validator(value[1])
+    return validate
+
+class CommandStats:
+    """Dispatch counters and handler latency histogram for one command
+
+    The histogram holds one in LATENCY_SAMPLE_EVERY dispatches.
+    """
+
+    def __init__(self):
+        """Initialize the counters"""
+        self.count = 0
+        self.invalid = 0
+        self.errors = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_US) + 1)
+
+    def to_dict(self):
+        """Get the counters and non-empty histogram buckets"""
+        labels = [f"<={bound}us" for bound in LATENCY_BUCKETS_US] + [f">{LATENCY_BUCKETS_US[-1]}us"]
+        return {
+            "count": self.count,
+            "invalid": self.invalid,
+            "errors": self.errors,
+            "latency": {label: n for label, n in zip(labels, self.histogram) if n}
+        }
+
+class Command:
+    """A registered command: its handler, validator and statistics"""
+
+    __slots__ = ("name", "handler", "validator", "stats")
+
+    def __init__(self, name, handler, validator=None):
+        self.name = name
+        self.handler = handler
+        self.validator = validator
+        self.stats = CommandStats()
+
+class CommandRegistry:
+    """Dispatch table for the commands of one transport
+
+    Accepts every form the transports decode: text lines (b"pan 50"), JSON
+    lines or dicts ({"type": "pan", "value": 50}), binary command frames and
+    (name, value) tuples.
+    """
+
+    def __init__(self, camera_controller=None):
+        """Initialize the registry
+
+        Args:
+            camera_controller: CameraController whose pan, tilt, zoom, mode
+                and stop commands are registered, or None for an empty registry
+        """
+        self.commands = {}  # name -> Command
+        self.text_commands = {}  # name as bytes -> Command
+        self.camera_commands = set()
+        self.unknown = 0
+        self.parent = None
+        self.lock = threading.Lock()
+
+        if camera_controller is not None:
+            self.register_camera_commands(camera_controller)
+
+    def register(self, name, handler, validator=None):
+        """Register or replace a command
+
+        Args:
+            name (str): Lower-case command name
+            handler: Called with the validated value, or with no arguments
+                if there is no validator
+            validator: Function converting the raw value, raising ValueError
+                or TypeError if it is invalid
+        """
+        command = Command(name, handler, validator)
+        self.commands[name] = command
+        self.text_commands[name.encode('ascii')] = command
+
+    def register_camera_commands(self, camera_controller):
+        """Register the commands every transport forwards to the camera"""
+        speed = int_range(-100, 100)
+        self.register("pan", camera_controller.set_pan, speed)
+        self.register("tilt", camera_controller.set_tilt, speed)
+        self.register("pan_tilt", lambda speeds: camera_controller.set_pan_tilt(*speeds), pair(speed))
+        self.register("zoom", camera_controller.set_zoom, int_range(0, 100))
+        self.register("mode", camera_controller.set_camera_mode, one_of(0, 1))
+        self.register("stop", lambda: camera_controller.set_pan_tilt(0, 0))
+        self.camera_commands = {"pan", "tilt", "pan_tilt", "zoom", "mode", "stop"}
+
+    def bind(self, camera_controller):
+        """Copy the registry with its camera commands sent elsewhere
+
+        Used to route one connection's commands through its own motion
+        session. The copy shares this registry's statistics.
+
+        Args:
+            camera_controller: Object with the CameraController motion
+                methods, e.g. a MotionSession
+
+        Returns:
+            CommandRegistry: The bound copy
+        """
+        registry = CommandRegistry(camera_controller)
+        registry.parent = self
+        registry.lock = self.lock
+        for name, command in self.commands.items():
+            if name not in self.camera_commands:
+                registry.register(name, command.handler, command.validator)
+            registry.commands[name].stats = command.stats
+        return registry
+
+    def apply_commands(self, messages):
+        """Parse and dispatch a batch of commands in order
+
+        Args:
+            messages: Iterable of text or JSON lines (bytes or str), JSON
+                dicts, BinaryCommand frames or (name, value) tuples
+
+        Returns:
+            int: Number of commands whose handler ran without error
+        """
+        applied = 0
+        for message in messages:
+            if isinstance(message, bytes):
+                command, value = self._parse_line(message)
+            elif isinstance(message, BinaryCommand):
+                command, value = self._parse_binary(message)
+            elif isinstance(message, dict):
+                command, value = self._parse_json(message)
+            elif isinstance(message, str):
+                command, value = self._parse_line(message.encode('utf-8'))
+            else:
+                name, value = message
+                command = self.commands.get(name)
+                if command is None:
+                    self._unknown(name)
+            if command is None:
+                continue
+
+            validator = command.validator
+            if validator is not None:
+                try:
+                    value = validator(value)
+                except (ValueError, TypeError) as e:
+                    self._invalid(command, e)
+                    continue
+
+            # Counted without the lock to keep dispatch cheap; concurrent
+            # clients can at worst lose the odd increment
+            stats = command.stats
+            timed = not stats.count & _SAMPLE_MASK
+            stats.count += 1
+            if timed:
+                start = perf_counter()
+            try:
+                if validator is None:
+                    command.handler()
+                else:
+                    command.handler(value)
+                applied += 1
+            except Exception as e:
+                self._failed(command, e)
+            if timed:
+                stats.histogram[bisect_left(_LATENCY_BUCKETS, perf_counter() - start)] += 1
+        return applied
+
+    def get_stats(self):
+        """Get per-command statistics for every command used so far"""
+        with self.lock:
+            stats = {name: command.stats.to_dict()
+                     for name, command in self.commands.items()
+                     if command.stats.count or command.stats.invalid}
+            stats["unknown"] = self.unknown
+        return stats
+
+    def _invalid(self, command, error):
+        """Count and log a command whose value failed validation"""
+        with self.lock:
+            command.stats.invalid += 1
+        logger.warning(f"Invalid {command.name} command: {error}")
+
+    def _failed(self, command, error):
+        """Count and log a command whose handler raised"""
+        with self.lock:
+            command.stats.errors += 1
+        logger.error(f"Error processing {command.name} command: {error}")
+
+    def _parse_line(self, line):
+        """Split a text or JSON line into its command and raw value"""
+        if line.startswith(b'{'):
+            try:
+                message = json.loads(line)
+            except (ValueError, UnicodeDecodeError) as e:
+                logger.warning(f"Invalid JSON command: {e}")
+                return None, None
+            if not isinstance(message, dict):
+                logger.warning(f"Invalid command format: {message}")
+                return None, None
+            return self._parse_json(message)
+
+        parts = line.split()
+        if not parts:
+            return None, None
+        command = self.text_commands.get(parts[0]) or self.text_commands.get(parts[0].lower())
+        if command is None:
+            self._unknown(parts[0].decode('utf-8', errors='replace'))
+            return None, None
+
+        if len(parts) == 1:
+            return command, None
+        return command, parts[1] if len(parts) == 2 else parts[1:]
+
+    def _parse_json(self, message):
+        """Look up the command of a JSON message, its value defaulting to 0"""
+        name = message.get('type', '')
+        command = self.commands.get(name) if isinstance(name, str) else None
+        if command is None and isinstance(name, str):
+            command = self.commands.get(name.lower())
+        if command is None:
+            self._unknown(name)
+            return None, None
+        return command, message.get('value', 0)
+
+    def _parse_binary(self, frame):
+        """Look up the command of a binary frame and extract its fields"""
+        entry = _BINARY_COMMANDS.get(frame.type)
+        command = self.commands.get(entry[0]) if entry else None
+        if command is None:
+            self._unknown(f"binary type {frame.type}")
+            return None, None
+        fields = entry[1]
+        return command, fields(frame) if fields else None
+
+    def _unknown(self, name):
+        """Count and log a command that is not registered"""
+        registry = self.parent or self
+        with self.lock:
+            registry.unknown += 1
+        logger.warning(f"Unknown command type: {name}")
+
+if __name__ == "__main__":
+    # Set up logging for standalone testing
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    from command_protocol import encode_binary_command, BinaryFrameDecoder
+
+    # Mock camera controller for testing
+    class MockCameraController:
+        def set_pan(self, speed):
+            print(f"Pan speed: {speed}")
+        def set_tilt(self, speed):
+            print(f"Tilt speed: {speed}")
+        def set_pan_tilt(self, pan_speed, tilt_speed):
+            print(f"Pan/tilt speed: {pan_speed}/{tilt_speed}")
+        def set_zoom(self, level):
+            print(f"Zoom level: {level}")
+        def set_camera_mode(self, mode):
+            print(f"Camera mode: {mode}")
+
+    registry = CommandRegistry(MockCameraController())
+    registry.register("status", lambda: print("Status requested"))
+
+    frames = BinaryFrameDecoder().feed(encode_binary_command(MSG_PAN_TILT, 1, pan=30, tilt=-10))
+    applied = registry.apply_commands([
+        b'pan 50', b'TILT -20', b'{"type": "zoom", "value": 150}', b'pan_tilt 10 20',
+        {"type": "mode", "value": 1}, ("stop", None), b'status', frames[0],
+        b'mode 3', b'pan fast', b'dance 1'
+    ])
+    print(f"Applied {applied} commands")
+    print(json.dumps(registry.get_stats(), indent=2))
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Frame hub sharing one video capture between many consumers.
+A single capture thread decodes frames into a small ring of preallocated
+NumPy buffers. Display, recording, snapshot and analytics code read the
+latest or the next frame from the ring instead of opening and decoding the
+stream themselves. Readers hold a reference to the slot they read, and the
+capture thread only ever decodes into slots that nobody holds, so frames are
+handed out without copies.
+"""
+
+import time
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger('frame_hub')
+
+class Frame:
+    """A reference to one published frame
+
+    The image is a read-only view of a ring buffer, valid until release().
+    Use the frame as a context manager, or call release() when done.
+    Consumers that draw on the image must copy it first.
+    """
+
+    __slots__ = ("hub", "slot", "image", "sequence", "timestamp", "released")
+
+    def __init__(self, hub, slot):
+        self.hub = hub
+        self.slot = slot
+        self.image = slot.buffer.view()
+        self.image.flags.writeable = False
+        self.sequence = slot.sequence
+        self.timestamp = slot.timestamp
+        self.released = False
+
+    def release(self):
+        """Hand the buffer back to the hub"""
+        if not self.released:
+            self.released = True
+            self.hub._release(self.slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class FrameReader:
+    """A consumer that wants every frame, in order, and counts those it missed"""
+
+    def __init__(self, hub, name):
+        """Initialize the reader
+
+        Args:
+            hub: FrameHub to read from
+            name (str): Consumer name, for statistics
+        """
+        self.hub = hub
+        self.name = name
+        self.sequence = 0
+        self.frames = 0
+        self.missed = 0
+
+    def next(self, timeout=None):
+        """Wait for the next frame newer than the last one read
+
+        Args:
+            timeout (float): Seconds to wait, None to wait until stopped
+
+        Returns:
+            Frame: The newest frame, or None on timeout or when the hub stops
+        """
+        frame = self.hub.wait_frame(self.sequence, timeout)
+        if frame is None:
+            return None
+        if self.sequence and frame.sequence > self.sequence + 1:
+            self.missed += frame.sequence - self.sequence - 1
+        self.sequence = frame.sequence
+        self.frames += 1
+        return frame
+
+    def close(self):
+        """Stop counting this reader in the hub's statistics"""
+        self.hub._remove_reader(self)
+
+class _Slot:
+    """One ring buffer and the frame it holds"""
+
+    __slots__ = ("buffer", "sequence", "timestamp", "refs")
+
+    def __init__(self):
+        self.buffer = None
+        self.sequence = 0
+        self.timestamp = 0.0
+        self.refs = 0
+
+class FrameHub:
+    """Decodes a video source once and publishes frames to all readers"""
+
+    def __init__(self, open_capture, slots=4, reconnect_delay=1.0, name="camera"):
+        """Initialize the frame hub
+
+        Args:
+            open_capture: Function returning an opened cv2.VideoCapture (or
+                an object with the same read/grab/isOpened/get/release
+                methods); called again to reconnect after read failures
+            slots (int): Ring buffers; readers can hold slots - 1 frames at
+                once before the capture thread has to skip frames
+            reconnect_delay (float): Seconds to wait before reconnecting
+            name (str): Name of the source, for logging
+        """
+        if slots < 2:
+            raise ValueError("A frame hub needs at least two slots")
+
+        self.open_capture = open_capture
+        self.reconnect_delay = reconnect_delay
+        self.name = name
+        self.slots = [_Slot() for _ in range(slots)]
+        self.latest = None  # Slot holding the newest frame
+        self.sequence = 0
+        self.readers = set()
+        self.subscribers = []
+        self.capture = None
+        self.resolution = None
+        self.fps = 0
+        self.reopen_requested = False
+        self.running = False
+        self.capture_thread = None
+        self.stats = {
+            "frames": 0,
+            "skipped": 0,
+            "read_failures": 0,
+            "reconnects": 0,
+            "allocations": 0
+        }
+        self.condition = threading.Condition()
+
+    def start(self):
+        """Start the capture thread"""
+        if self.running:
+            logger.warning(f"Frame hub for {self.name} is already running")
+            return
+
+        self.running = True
+        self.capture_thread = threading.Thread(target=self._capture_loop)
+        self.capture_thread.daemon = True
+        self.capture_thread.start()
+
+        logger.info(f"Frame hub for {self.name} started")
+        return True
+
+    def stop(self):
+        """Stop the capture thread and wake every waiting reader"""
+        if not self.running:
+            return
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        if self.capture_thread:
+            self.capture_thread.join(timeout=2.0)
+
+        logger.info(f"Frame hub for {self.name} stopped")
+
+    def reopen(self, open_capture=None, name=None):
+        """Switch to another source, or reconnect to the current one
+
+        Args:
+            open_capture: New capture function, None to keep the current one
+            name (str): New source name, None to keep the current one
+        """
+        with self.condition:
+            if open_capture is not None:
+                self.open_capture = open_capture
+            if name is not None:
+                self.name = name
+            self.resolution = None
+            self.reopen_requested = True
+
+    def wait_for_source(self, timeout):
+        """Wait until the source is open and its properties are known
+
+        Returns:
+            bool: True if the source was opened within timeout seconds
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.resolution is not None or not self.running, timeout)
+            return self.resolution is not None
+
+    def latest_frame(self):
+        """Get the newest frame without waiting
+
+        Returns:
+            Frame: The newest frame, or None if none has been captured
+        """
+        with self.condition:
+            if self.latest is None:
+                return None
+            return self._acquire(self.latest)
+
+    def wait_frame(self, after_sequence=0, timeout=None):
+        """Wait for a frame newer than after_sequence
+
+        Args:
+            after_sequence (int): Sequence number of the last frame seen
+            timeout (float): Seconds to wait, None to wait until stopped
+
+        Returns:
+            Frame: The newest frame, or None on timeout or when stopped
+        """
+        with self.condition:
+            ready = self.condition.wait_for(
+                lambda: (self.latest is not None and self.latest.sequence > after_sequence) or not self.running,
+                timeout
+            )
+            if not ready or not self.running:
+                return None
+            return self._acquire(self.latest)
+
+    def reader(self, name):
+        """Register a consumer that reads every frame in order
+
+        Args:
+            name (str): Consumer name, for statistics
+
+        Returns:
+            FrameReader: The new reader
+        """
+        reader = FrameReader(self, name)
+        with self.condition:
+            self.readers.add(reader)
+        return reader
+
+    def subscribe(self, callback):
+        """Have every new frame pushed to a callback from the capture thread
+
+        For consumers such as encoders that must not miss frames while they
+        are busy. The callback owns the Frame it is given and must release
+        it; it must return quickly, e.g. after queueing the frame.
+
+        Args:
+            callback: Function called with each new Frame
+        """
+        with self.condition:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Stop pushing frames to a callback"""
+        with self.condition:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def get_stats(self):
+        """Get capture counters and per-reader delivery counters"""
+        with self.condition:
+            stats = dict(self.stats)
+            stats["held"] = sum(slot.refs for slot in self.slots)
+            stats["readers"] = {reader.name: {"frames": reader.frames, "missed": reader.missed}
+                                for reader in self.readers}
+        stats["resolution"] = self.resolution
+        stats["fps"] = self.fps
+        return stats
+
+    def _acquire(self, slot):
+        """Take a reference to a slot (lock held)"""
+        slot.refs += 1
+        return Frame(self, slot)
+
+    def _release(self, slot):
+        with self.condition:
+            slot.refs -= 1
+
+    def _remove_reader(self, reader):
+        with self.condition:
+            self.readers.discard(reader)
+
+    def _free_slot(self):
+        """Pick a slot nobody holds to decode the next frame into"""
+        with self.condition:
+            for slot in self.slots:
+                if slot is not self.latest and slot.refs == 0:
+                    return slot
+        return None
+
+    def _open(self):
+        """Open the source and read its properties"""
+        with self.condition:
+            open_capture = self.open_capture
+            self.reopen_requested = False
+
+        capture = open_capture()
+        if capture is None or not capture.isOpened():
+            logger.warning(f"Could not open {self.name}")
+            return None
+
+        resolution = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                      int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        with self.condition:
+            self.capture = capture
+            self.resolution = resolution
+            self.fps = capture.get(cv2.CAP_PROP_FPS)
+            self.condition.notify_all()
+
+        logger.info(f"Frame hub opened {self.name}: {resolution[0]}x{resolution[1]} at {self.fps} FPS")
+        return capture
+
+    def _close(self):
+        if self.capture is not None:
+            try:
+                self.capture.release()
+            except Exception:
+                pass
+            self.capture = None
+
+    def _preallocate(self, image):
+        """Allocate every slot to the shape of a newly sized frame (lock held)"""
+        for slot in self.slots:
+            if slot.buffer is None or slot.buffer.shape != image.shape or slot.buffer.dtype != image.dtype:
+                # Slots still held keep their old buffer until released
+                if slot.refs == 0:
+                    slot.buffer = np.empty_like(image)
+                    self.stats["allocations"] += 1
+
+    def _capture_loop(self):
+        """Decode frames into free slots and publish them"""
+        while self.running:
+            if self.capture is None or self.reopen_requested:
+                reconnecting = self.capture is not None
+                self._close()
+                if reconnecting:
+                    self.stats["reconnects"] += 1
+                if self._open() is None:
+                    time.sleep(self.reconnect_delay)
+                continue
+
+            slot = self._free_slot()
+            if slot is None:
+                # Every slot is held by a reader; drop this frame
+                ok = self.capture.grab()
+                with self.condition:
+                    self.stats["skipped"] += 1
+                if not ok:
+                    self._read_failed()
+                continue
+
+            try:
+                if slot.buffer is None:
+                    ok, image = self.capture.read()
+                else:
+                    ok, image = self.capture.read(slot.buffer)
+            except Exception as e:
+                logger.error(f"Error reading from {self.name}: {e}")
+                ok, image = False, None
+
+            if not ok or image is None:
+                self._read_failed()
+                continue
+
+            with self.condition:
+                if image is not slot.buffer:
+                    # First frame or a new frame size: the capture allocated
+                    slot.buffer = image
+                    self.stats["allocations"] += 1
+                    self._preallocate(image)
+                self.sequence += 1
+                slot.sequence = self.sequence
+                slot.timestamp = time.time()
+                self.latest = slot
+                self.stats["frames"] += 1
+                pushed = [(callback, self._acquire(slot)) for callback in self.subscribers]
+                self.condition.notify_all()
+
+            for callback, frame in pushed:
+                try:
+                    callback(frame)
+                except Exception as e:
+                    logger.error(f"Error pushing frame from {self.name}: {e}")
+                    frame.release()
+
+        self._close()
+        logger.info(f"Frame hub capture loop for {self.name} ended")
+
+    def _read_failed(self):
+        """Reconnect after a failed read"""
+        logger.warning(f"Failed to receive frame from {self.name}. Reconnecting...")
+        with self.condition:
+            self.stats["read_failures"] += 1
+            self.reopen_requested = True
+        time.sleep(self.reconnect_delay)
+
+if __name__ == "__main__":
+    # Set up logging for standalone testing
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # Capture stand-in producing numbered 1080p frames at 100 FPS
+    class MockCapture:
+        def __init__(self):
+            self.count = 0
+        def isOpened(self):
+            return True
+        def get(self, prop):
+            return {cv2.CAP_PROP_FRAME_WIDTH: 1920, cv2.CAP_PROP_FRAME_HEIGHT: 1080,
+                    cv2.CAP_PROP_FPS: 100.0}.get(prop, 0)
+        def grab(self):
+            time.sleep(0.01)
+            self.count += 1
+            return True
+        def read(self, image=None):
+            self.grab()
+            if image is None or image.shape != (1080, 1920, 3):
+                image = np.empty((1080, 1920, 3), np.uint8)
+            image[0, 0, 0] = self.count % 256
+            return True, image
+        def release(self):
+            pass
+
+    hub = FrameHub(MockCapture, slots=4, name="mock camera")
+    hub.start()
+    hub.wait_for_source(2.0)
+
+    def consume(name, work_time, results):
+        reader = hub.reader(name)
+        buffers = set()
+        end = time.time() + 2.0
+        while time.time() < end:
+            with reader.next(timeout=1.0) as frame:
+                buffers.add(frame.image.ctypes.data)
+                time.sleep(work_time)
+        results[name] = len(buffers)
+
+    # A fast display, a slow encoder and a snapshot taker share one decode
+    results = {}
+    threads = [threading.Thread(target=consume, args=("display", 0.002, results)),
+               threading.Thread(target=consume, args=("recorder", 0.03, results))]
+    for thread in threads:
+        thread.start()
+    time.sleep(1.0)
+    with hub.latest_frame() as snapshot:
+        print(f"Snapshot of frame {snapshot.sequence}: {snapshot.image.shape}, "
+              f"writeable={snapshot.image.flags.writeable}")
+    for thread in threads:
+        thread.join()
+
+    print(f"Distinct buffers seen per reader: {results}")
+    print(f"Stats: {hub.get_stats()}")
+    hub.stop()
@@ -13,23 +13,47 @@ import threading
 import socket
 import json
 
+import numpy as np
+
+from frame_hub import FrameHub
+from command_registry import CommandRegistry
+from motion_arbiter import PRIORITY_LOCAL
+
 # Configure logging
 logger = logging.getLogger('local_stream_viewer')
 
+# Fixed key bindings as (command, value)
+KEY_COMMANDS = {
+    ord('w'): ("tilt", -50),  # Tilt up
+    ord('s'): ("tilt", 50),   # Tilt down
+    ord('a'): ("pan", -50),   # Pan left
+    ord('d'): ("pan", 50),    # Pan right
+    ord(' '): ("stop", None)  # Stop movement
+}
+
 class LocalStreamViewer:
     """Local viewer for displaying camera streams on a connected monitor"""
     
-    def __init__(self, camera_controller, video_streamer, window_title="PTZ Camera Stream"):
+    def __init__(self, camera_controller, video_streamer, window_title="PTZ Camera Stream", arbiter=None,
+                 frame_hub=None):
         """Initialize the local stream viewer
         
         Args:
             camera_controller: CameraController instance
             video_streamer: VideoStreamer instance
             window_title: Title for the display window
+            arbiter: MotionArbiter to drive the camera through, None to
+                drive the camera controller directly
+            frame_hub: FrameHub to display frames from, shared with other
+                consumers; None to open the stream in a hub of our own
         """
         self.camera_controller = camera_controller
         self.video_streamer = video_streamer
         self.window_title = window_title
+        self.session = arbiter.open_session("local viewer", PRIORITY_LOCAL) if arbiter else None
+        self.commands = CommandRegistry(self.session or camera_controller)
+        self.owns_hub = frame_hub is None
+        self.frame_hub = frame_hub if frame_hub is not None else FrameHub(self._open_capture, name="local viewer stream")
         self.running = False
         self.viewer_thread = None
         
@@ -40,6 +64,8 @@ class LocalStreamViewer:
             return
             
         self.running = True
+        if self.owns_hub:
+            self.frame_hub.start()
         self.viewer_thread = threading.Thread(target=self._viewer_loop)
         self.viewer_thread.daemon = True
         self.viewer_thread.start()
@@ -58,42 +84,42 @@ class LocalStreamViewer:
         if self.viewer_thread:
             self.viewer_thread.join(timeout=2.0)
             
+        if self.owns_hub:
+            self.frame_hub.stop()
+            
         # Close any open windows
         cv2.destroyAllWindows()
         
         logger.info("Local stream viewer stopped")
         
-    def _viewer_loop(self):
-        """Main viewer loop that displays the camera stream"""
-        logger.info("Viewer loop started")
-        
-        # Try to get RTSP stream URL from the video streamer
+    def _open_capture(self):
+        """Open the RTSP stream, falling back to the camera device
+
+        Called by the frame hub, again on every reconnect, so a camera
+        mode change is picked up.
+        """
         stream_url = self.video_streamer.get_stream_url()
         logger.info(f"Opening stream URL: {stream_url}")
+        cap = cv2.VideoCapture(stream_url)
         
-        try:
-            # Alternative 1: Try to connect to the RTSP stream
-            cap = cv2.VideoCapture(stream_url)
+        # If RTSP connection fails, try connecting directly to the camera device
+        if not cap.isOpened():
+            logger.warning(f"Failed to open RTSP stream, trying direct camera access")
+            device_path = self.camera_controller.get_current_camera_device()
+            cap = cv2.VideoCapture(device_path)
             
-            # If RTSP connection fails, try connecting directly to the camera device
             if not cap.isOpened():
-                logger.warning(f"Failed to open RTSP stream, trying direct camera access")
-                device_path = self.camera_controller.get_current_camera_device()
-                
-                # Try to open the camera device directly
-                cap = cv2.VideoCapture(device_path)
+                logger.error(f"Failed to open camera device: {device_path}")
                 
-                if not cap.isOpened():
-                    logger.error(f"Failed to open camera device: {device_path}")
-                    return
-            
-            # Get video properties
-            frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            
-            logger.info(f"Stream properties: {frame_width}x{frame_height} at {fps} FPS")
-            
+        return cap
+        
+    def _viewer_loop(self):
+        """Main viewer loop that displays the camera stream"""
+        logger.info("Viewer loop started")
+        reader = self.frame_hub.reader("local viewer")
+        display_frame = None
+        
+        try:
             # Create window
             cv2.namedWindow(self.window_title, cv2.WINDOW_NORMAL)
             
@@ -102,27 +128,20 @@ class LocalStreamViewer:
             start_time = time.time()
             
             while self.running:
-                # Read a frame
-                ret, frame = cap.read()
+                # Wait for the next frame; the hub reconnects on failures
+                frame = reader.next(timeout=0.5)
                 
-                if not ret:
-                    logger.warning("Failed to read frame, attempting to reconnect...")
-                    cap.release()
-                    
-                    # Try to reconnect
-                    time.sleep(1)
-                    
-                    # Check if camera mode has changed
-                    device_path = self.camera_controller.get_current_camera_device()
-                    stream_url = self.video_streamer.get_stream_url()
-                    
-                    # Try RTSP first, then direct device
-                    cap = cv2.VideoCapture(stream_url)
-                    if not cap.isOpened():
-                        cap = cv2.VideoCapture(device_path)
-                        
+                if frame is None:
+                    cv2.waitKey(1)
                     continue
                 
+                # Hub buffers are shared with other consumers, so draw on
+                # our own reusable buffer
+                with frame:
+                    if display_frame is None or display_frame.shape != frame.image.shape:
+                        display_frame = np.empty_like(frame.image)
+                    np.copyto(display_frame, frame.image)
+                
                 # Calculate FPS
                 frames_count += 1
                 elapsed_time = time.time() - start_time
@@ -135,7 +154,7 @@ class LocalStreamViewer:
                 # Add camera mode indicator
                 camera_mode = "RGB" if self.camera_controller.get_camera_mode() == 0 else "IR/Thermal"
                 cv2.putText(
-                    frame, 
+                    display_frame, 
                     f"Mode: {camera_mode}", 
                     (10, 30), 
                     cv2.FONT_HERSHEY_SIMPLEX, 
@@ -145,7 +164,7 @@ class LocalStreamViewer:
                 )
                 
                 # Display the frame
-                cv2.imshow(self.window_title, frame)
+                cv2.imshow(self.window_title, display_frame)
                 
                 # Check for key press (ESC or q to quit)
                 key = cv2.waitKey(1) & 0xFF
@@ -157,35 +176,26 @@ class LocalStreamViewer:
                 elif key == ord('m'):
                     new_mode = 1 if self.camera_controller.get_camera_mode() == 0 else 0
                     logger.info(f"User requested to switch camera mode to {new_mode}")
-                    self.camera_controller.set_camera_mode(new_mode)
+                    self.commands.apply_commands([("mode", new_mode)])
                     
                 # Pan/tilt controls
-                elif key == ord('w'):  # Tilt up
-                    self.camera_controller.set_tilt(-50)
-                elif key == ord('s'):  # Tilt down
-                    self.camera_controller.set_tilt(50)
-                elif key == ord('a'):  # Pan left
-                    self.camera_controller.set_pan(-50)
-                elif key == ord('d'):  # Pan right
-                    self.camera_controller.set_pan(50)
-                elif key == ord(' '):  # Stop movement
-                    self.camera_controller.set_pan(0)
-                    self.camera_controller.set_tilt(0)
+                elif key in KEY_COMMANDS:
+                    self.commands.apply_commands([KEY_COMMANDS[key]])
                 
                 # Zoom controls
                 elif key == ord('+') or key == ord('='):  # Zoom in
                     current_zoom = self.camera_controller.zoom_level
-                    self.camera_controller.set_zoom(min(current_zoom + 10, 100))
+                    self.commands.apply_commands([("zoom", current_zoom + 10)])
                 elif key == ord('-'):  # Zoom out
                     current_zoom = self.camera_controller.zoom_level
-                    self.camera_controller.set_zoom(max(current_zoom - 10, 0))
+                    self.commands.apply_commands([("zoom", current_zoom - 10)])
                 
         except Exception as e:
             logger.error(f"Error in viewer loop: {e}")
         finally:
             # Clean up
+            reader.close()
             try:
-                cap.release()
                 cv2.destroyAllWindows()
             except:
                 pass
@@ -216,6 +226,8 @@ if __name__ == "__main__":
             print(f"Pan speed: {speed}")
         def set_tilt(self, speed):
             print(f"Tilt speed: {speed}")
+        def set_pan_tilt(self, pan_speed, tilt_speed):
+            print(f"Pan/tilt speed: {pan_speed}/{tilt_speed}")
         def set_zoom(self, level):
             self.zoom_level = level
             print(f"Zoom level: {level}")
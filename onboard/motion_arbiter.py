@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Pan/tilt arbitration between control sources.
+WiFi clients, the Bluetooth client, UDP joysticks and the local viewer
+keyboard can all drive the same camera. Each source opens a session with a
+priority and keeps its own stick state; only the current owner's state is
+sent to the camera. A source of equal or higher priority takes over with its
+next command (last writer wins), a lower one only once the owner is idle.
+A stop from any session is always honored, so a flood of commands from one
+client can never lock out another client's stop.
+"""
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger('motion_arbiter')
+
+# Session priorities, higher wins
+PRIORITY_REMOTE = 10     # WiFi and UDP clients
+PRIORITY_BLUETOOTH = 20  # Paired handset
+PRIORITY_LOCAL = 30      # Operator at the onboard monitor
+
+class MotionSession:
+    """One control source's view of the camera
+
+    Has the motion methods of CameraController, so transports and the
+    command registry can use it in place of the controller.
+    """
+
+    def __init__(self, arbiter, source, priority):
+        """Initialize the session
+
+        Args:
+            arbiter: MotionArbiter that owns the session
+            source (str): Name of the source, e.g. "wifi 192.168.4.2:50312"
+            priority (int): Session priority, higher wins
+        """
+        self.arbiter = arbiter
+        self.camera_controller = arbiter.camera_controller
+        self.source = source
+        self.priority = priority
+        self.pan_speed = 0
+        self.tilt_speed = 0
+        self.last_command = 0.0
+        self.closed = False
+
+    def set_pan(self, speed):
+        """Set this session's pan speed, -100 to 100"""
+        return self.arbiter.request(self, speed, None)
+
+    def set_tilt(self, speed):
+        """Set this session's tilt speed, -100 to 100"""
+        return self.arbiter.request(self, None, speed)
+
+    def set_pan_tilt(self, pan_speed, tilt_speed):
+        """Set this session's pan and tilt speed together"""
+        return self.arbiter.request(self, pan_speed, tilt_speed)
+
+    def set_zoom(self, level):
+        """Set the zoom level; zoom is not arbitrated"""
+        self.camera_controller.set_zoom(level)
+
+    def set_camera_mode(self, mode):
+        """Set the camera mode; the mode is not arbitrated"""
+        self.camera_controller.set_camera_mode(mode)
+
+    def release(self):
+        """Give up control, stopping the camera if this session drives it"""
+        self.arbiter.release(self)
+
+    def close(self):
+        """End the session, stopping the camera if this session drives it"""
+        self.arbiter.close_session(self)
+
+class MotionArbiter:
+    """Decides which session drives the camera's pan and tilt"""
+
+    def __init__(self, camera_controller, hold_time=1.0):
+        """Initialize the arbiter
+
+        Args:
+            camera_controller: CameraController to drive
+            hold_time (float): Seconds a moving owner keeps the camera after
+                its last command before lower-priority sessions may take over
+        """
+        self.camera_controller = camera_controller
+        self.hold_time = hold_time
+        self.owner = None
+        self.owner_since = None
+        self.stats = {
+            "accepted": 0,
+            "rejected": 0,
+            "foreign_stops": 0,
+            "handovers": 0
+        }
+        self.lock = threading.Lock()
+
+    def open_session(self, source, priority=PRIORITY_REMOTE):
+        """Open a session for a control source
+
+        Args:
+            source (str): Name of the source, for logs and status
+            priority (int): Session priority, higher wins
+
+        Returns:
+            MotionSession: The new session
+        """
+        logger.info(f"Motion session opened for {source} (priority {priority})")
+        return MotionSession(self, source, priority)
+
+    def close_session(self, session):
+        """Close a session, stopping the camera if it was the owner"""
+        with self.lock:
+            session.closed = True
+        self.release(session)
+
+    def release(self, session):
+        """Stop the camera and clear the owner if the session is the owner
+
+        Unlike a stop command, this never affects another session's motion.
+        """
+        with self.lock:
+            session.pan_speed = session.tilt_speed = 0
+            if self.owner is not session:
+                return
+            self.owner = None
+            self.owner_since = None
+            self.camera_controller.set_pan_tilt(0, 0)
+        logger.info(f"Motion owner {session.source} released the camera, stopped")
+
+    def request(self, session, pan_speed, tilt_speed):
+        """Apply a pan/tilt change from a session if it may drive the camera
+
+        Args:
+            session: MotionSession making the request
+            pan_speed (int): New pan speed, None to keep the session's own
+            tilt_speed (int): New tilt speed, None to keep the session's own
+
+        Returns:
+            bool: True if the camera follows the request
+        """
+        with self.lock:
+            if session.closed:
+                return False
+
+            now = time.monotonic()
+            if pan_speed is not None:
+                session.pan_speed = pan_speed
+            if tilt_speed is not None:
+                session.tilt_speed = tilt_speed
+            session.last_command = now
+            stopping = session.pan_speed == 0 and session.tilt_speed == 0
+
+            owner = self.owner
+            if owner is not None and owner is not session and not self._yields_to(owner, session, now):
+                if not stopping:
+                    self.stats["rejected"] += 1
+                    return False
+                # Anyone may stop the camera; the owner has to move the
+                # stick again to resume
+                self.stats["foreign_stops"] += 1
+                owner.pan_speed = owner.tilt_speed = 0
+                logger.info(f"Stop from {session.source} while {owner.source} owns the camera")
+                self.camera_controller.set_pan_tilt(0, 0)
+                return True
+
+            if owner is not session:
+                if owner is not None:
+                    self.stats["handovers"] += 1
+                    logger.info(f"Camera control passes from {owner.source} to {session.source}")
+                self.owner = session
+                self.owner_since = time.time()
+
+            self.stats["accepted"] += 1
+            self.camera_controller.set_pan_tilt(session.pan_speed, session.tilt_speed)
+            return True
+
+    def get_owner(self):
+        """Get the session driving the camera
+
+        Returns:
+            dict: Source, priority, stick state and since when (epoch
+                seconds), or None if no session has control
+        """
+        with self.lock:
+            owner = self.owner
+            if owner is None:
+                return None
+            return {
+                "source": owner.source,
+                "priority": owner.priority,
+                "pan": owner.pan_speed,
+                "tilt": owner.tilt_speed,
+                "since": self.owner_since
+            }
+
+    def get_stats(self):
+        """Get arbitration counters and the current owner"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats["owner"] = self.get_owner()
+        return stats
+
+    def _yields_to(self, owner, session, now):
+        """Whether the owner gives way to another session (lock held)"""
+        if session.priority >= owner.priority:
+            return True
+        idle = owner.pan_speed == 0 and owner.tilt_speed == 0
+        return idle or now - owner.last_command > self.hold_time
+
+if __name__ == "__main__":
+    # Set up logging for standalone testing
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    from camera_controller import CameraController, LoopbackTransport
+
+    transport = LoopbackTransport()
+    controller = CameraController(transport=transport, keepalive_interval=0, control_tick=0.02)
+    arbiter = MotionArbiter(controller)
+    controller.start()
+
+    try:
+        flood = arbiter.open_session("wifi 10.0.0.2", PRIORITY_REMOTE)
+        handset = arbiter.open_session("bluetooth", PRIORITY_BLUETOOTH)
+        keyboard = arbiter.open_session("local", PRIORITY_LOCAL)
+
+        # One client floods joystick updates; they merge into a few frames
+        start_writes = transport.writes
+        for i in range(2000):
+            flood.set_pan_tilt(40 + i % 20, 10)
+        time.sleep(0.1)
+        print(f"2000 flood commands -> {transport.writes - start_writes} Pelco-D frames, "
+              f"owner {arbiter.get_owner()['source']}")
+
+        # A lower-priority client cannot steer, but its stop gets through
+        other = arbiter.open_session("wifi 10.0.0.3", PRIORITY_REMOTE - 1)
+        print(f"Low-priority pan accepted: {other.set_pan(-80)}")
+        print(f"Low-priority stop accepted: {other.set_pan_tilt(0, 0)}, "
+              f"camera pan={controller.pan_speed} tilt={controller.tilt_speed}")
+
+        # Higher priority takes over at once, the flood is then rejected
+        handset.set_tilt(-30)
+        print(f"Flood after handset took over accepted: {flood.set_pan(90)}")
+        keyboard.set_pan(50)
+        print(f"Owner: {arbiter.get_owner()}")
+
+        keyboard.close()
+        print(f"After the owner closed: pan={controller.pan_speed} tilt={controller.tilt_speed}, "
+              f"stats {arbiter.get_stats()}")
+    finally:
+        controller.stop()
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Multi-camera Pelco-D bus manager.
+Several Pelco-D cameras are normally wired to one RS-485 pair with distinct
+addresses. This module owns the single serial port for that bus, schedules
+frames fairly between addresses and hands out per-address camera handles.
+Replies from the cameras are decoded on a reader thread, and positions can
+be polled in the background without delaying motion commands.
+"""
+
+import time
+import logging
+import threading
+
+from pelco_d import (
+    ResponseDecoder, build_frame, is_motion_command,
+    decode_pan_position, decode_tilt_position, decode_zoom_position,
+    CMD2_LEFT, CMD2_RIGHT, CMD2_UP, CMD2_DOWN, CMD2_ZOOM_IN, CMD2_ZOOM_OUT,
+    CMD2_GOTO_PRESET, CMD2_SET_PRESET, CMD2_SET_ZOOM_POSITION,
+    CMD2_QUERY_PAN, CMD2_QUERY_TILT, CMD2_QUERY_ZOOM,
+    CMD2_PAN_POSITION, CMD2_TILT_POSITION, CMD2_ZOOM_POSITION, MAX_SPEED, MAX_PRESET
+)
+from serial_writer import SerialWriter
+
+logger = logging.getLogger('pelco_bus')
+
+# Try to import pyserial
+try:
+    import serial
+except ImportError:
+    logger.warning("pyserial not available. Pelco-D bus can only use already-open ports.")
+    serial = None
+
+class PelcoBus:
+    """Shares one RS-485 serial port between many Pelco-D cameras"""
+
+    def __init__(self, port='/dev/ttyUSB0', baudrate=9600, addresses=(), max_queue=16,
+                 poll_interval=0):
+        """Initialize the bus manager
+
+        Args:
+            port: Serial port path, or an already-open port object with
+                write() and flush()
+            baudrate (int): Communication baudrate (2400, 4800, 9600, or 38400)
+            addresses: Camera addresses (1-255) expected on the bus
+            max_queue (int): Maximum frames waiting per camera
+            poll_interval (float): Seconds between position queries to each
+                camera, 0 disables polling
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.max_queue = max_queue
+        self.ser = None
+        self.owns_port = False
+        self.writer = None
+        self.cameras = {}
+        self.lock = threading.Lock()
+        self.poll_interval = poll_interval
+        self.decoder = ResponseDecoder()
+        self.stop_event = threading.Event()
+        self.reader_thread = None
+        self.poll_thread = None
+
+        for address in addresses:
+            self.camera(address)
+
+    @property
+    def is_open(self):
+        """Whether the bus is open and accepting frames"""
+        return self.writer is not None
+
+    def open(self):
+        """Open the serial port and start the writer thread"""
+        if self.is_open:
+            logger.warning("Pelco-D bus is already open")
+            return
+
+        if isinstance(self.port, str):
+            if serial is None:
+                raise RuntimeError("pyserial is required to open a serial port")
+
+            self.ser = serial.Serial(
+                port=self.port,
+                baudrate=self.baudrate,
+                bytesize=serial.EIGHTBITS,
+                parity=serial.PARITY_NONE,
+                stopbits=serial.STOPBITS_ONE,
+                timeout=1
+            )
+            self.owns_port = True
+        else:
+            self.ser = self.port
+            self.owns_port = False
+
+        self.writer = SerialWriter(self.ser, max_queue=self.max_queue)
+        self.writer.start()
+        self.stop_event.clear()
+
+        # Write-only ports simply never report positions
+        if hasattr(self.ser, "read"):
+            self.decoder.reset()
+            self.reader_thread = threading.Thread(target=self._reader_loop)
+            self.reader_thread.daemon = True
+            self.reader_thread.start()
+
+        if self.poll_interval > 0:
+            self.poll_thread = threading.Thread(target=self._poll_loop)
+            self.poll_thread.daemon = True
+            self.poll_thread.start()
+
+        logger.info(f"Pelco-D bus open on {self.port} at {self.baudrate} baud")
+
+    def close(self):
+        """Send any queued frames and close the serial port"""
+        if not self.is_open:
+            return
+
+        self.stop_event.set()
+        for thread in (self.poll_thread, self.reader_thread):
+            if thread:
+                thread.join(timeout=2.0)
+        self.poll_thread = None
+        self.reader_thread = None
+
+        self.writer.stop()
+        self.writer = None
+
+        if self.owns_port and self.ser and self.ser.is_open:
+            self.ser.close()
+        self.ser = None
+        logger.info("Pelco-D bus closed")
+
+    def camera(self, address):
+        """Get the handle for a camera address, registering it if needed
+
+        Args:
+            address (int): Camera address (1-255)
+
+        Returns:
+            PelcoCamera: Handle that sends commands to this address
+        """
+        with self.lock:
+            camera = self.cameras.get(address)
+            if camera is None:
+                if not 1 <= address <= 255:
+                    raise ValueError(f"Invalid Pelco-D address: {address}")
+                camera = self.cameras[address] = PelcoCamera(self, address)
+            return camera
+
+    def send(self, address, command_1, command_2, data_1=0, data_2=0):
+        """Queue a command for a camera on the bus
+
+        Motion commands coalesce per address and stop commands are sent
+        ahead of all other traffic.
+
+        Returns:
+            bool: True if the frame was queued
+        """
+        if not self.is_open:
+            logger.warning(f"Pelco-D bus is not open, command for {address} dropped")
+            return False
+
+        frame = build_frame(address, command_1, command_2, data_1, data_2)
+        motion = is_motion_command(command_1, command_2)
+        return self.writer.send(
+            frame,
+            channel=address,
+            coalesce=motion,
+            urgent=motion and command_2 == 0x00
+        )
+
+    def query(self, address, command_2):
+        """Queue a position query for a camera in the background
+
+        Queries are only sent when no commands are waiting, and the bus is
+        left quiet briefly afterwards for the camera to reply.
+
+        Returns:
+            bool: True if the query was queued
+        """
+        if not self.is_open:
+            return False
+
+        frame = build_frame(address, 0x00, command_2)
+        return self.writer.send(frame, channel=address, background=True, expect_reply=True)
+
+    def get_stats(self):
+        """Get bus statistics"""
+        stats = self.writer.get_stats() if self.writer else {}
+        stats["cameras"] = sorted(self.cameras)
+        stats["responses"] = self.decoder.frames_decoded
+        stats["checksum_errors"] = self.decoder.checksum_errors
+        return stats
+
+    def _reader_loop(self):
+        """Decode replies from the cameras until the bus is closed"""
+        logger.info("Pelco-D reader started")
+
+        while not self.stop_event.is_set():
+            try:
+                data = self.ser.read(getattr(self.ser, "in_waiting", 0) or 1)
+            except Exception as e:
+                logger.error(f"Error reading from Pelco-D bus: {e}")
+                self.stop_event.wait(1.0)
+                continue
+
+            if not data:
+                continue
+
+            for frame in self.decoder.feed(data):
+                camera = self.cameras.get(frame.address)
+                if camera and camera._handle_response(frame):
+                    self.writer.notify_reply()
+
+        logger.info("Pelco-D reader ended")
+
+    def _poll_loop(self):
+        """Periodically query the position of every polled camera"""
+        next_poll = time.monotonic()
+
+        while not self.stop_event.is_set():
+            for camera in list(self.cameras.values()):
+                if camera.poll_position:
+                    camera.query_position()
+
+            next_poll += self.poll_interval
+            delay = next_poll - time.monotonic()
+            if delay < 0:
+                # Fell behind, e.g. the bus is saturated; don't try to catch up
+                next_poll = time.monotonic()
+                delay = 0
+            self.stop_event.wait(delay)
+
+class PelcoCamera:
+    """Handle for a single camera address on a shared Pelco-D bus"""
+
+    def __init__(self, bus, address):
+        """Initialize the camera handle
+
+        Args:
+            bus: PelcoBus the camera is wired to
+            address (int): Camera address (1-255)
+        """
+        self.bus = bus
+        self.address = address
+        self.poll_position = True
+        self.position = {"pan": None, "tilt": None, "zoom": None, "timestamp": None}
+        self.position_callback = None
+        self.lock = threading.Lock()
+
+    def send_command(self, command_1, command_2, data_1=0, data_2=0):
+        """Send a raw Pelco-D command to this camera"""
+        return self.bus.send(self.address, command_1, command_2, data_1, data_2)
+
+    def stop(self):
+        """Stop all movement"""
+        return self.send_command(0x00, 0x00)
+
+    def move(self, pan_speed, tilt_speed, zoom=0):
+        """Pan and tilt at signed speeds, optionally zooming at the same time
+
+        A Pelco-D motion frame carries the whole pan/tilt/zoom state, so
+        zooming has to be sent together with the current pan and tilt.
+
+        Args:
+            pan_speed (int): -63 (left) to 63 (right), 0 is stopped
+            tilt_speed (int): -63 (up) to 63 (down), 0 is stopped
+            zoom (int): 1 to zoom in, -1 to zoom out, 0 to hold
+        """
+        command_2 = 0x00
+        if zoom > 0:
+            command_2 |= CMD2_ZOOM_IN
+        elif zoom < 0:
+            command_2 |= CMD2_ZOOM_OUT
+
+        if pan_speed < 0:
+            command_2 |= CMD2_LEFT
+        elif pan_speed > 0:
+            command_2 |= CMD2_RIGHT
+
+        if tilt_speed < 0:
+            command_2 |= CMD2_UP
+        elif tilt_speed > 0:
+            command_2 |= CMD2_DOWN
+
+        return self.send_command(
+            0x00, command_2,
+            min(abs(pan_speed), MAX_SPEED),
+            min(abs(tilt_speed), MAX_SPEED)
+        )
+
+    def zoom_in(self):
+        """Start zooming in"""
+        return self.send_command(0x00, CMD2_ZOOM_IN)
+
+    def zoom_out(self):
+        """Start zooming out"""
+        return self.send_command(0x00, CMD2_ZOOM_OUT)
+
+    def set_zoom_position(self, position):
+        """Move the zoom to an absolute raw position (0-65535)
+
+        Only cameras that implement the absolute zoom command act on this.
+        """
+        if not 0 <= position <= 0xFFFF:
+            return False
+        return self.send_command(0x00, CMD2_SET_ZOOM_POSITION, position >> 8, position & 0xFF)
+
+    def goto_preset(self, preset_num):
+        """Go to preset position (1-255)"""
+        if not 1 <= preset_num <= MAX_PRESET:
+            return False
+        return self.send_command(0x00, CMD2_GOTO_PRESET, preset_num)
+
+    def set_preset(self, preset_num):
+        """Set preset position (1-255)"""
+        if not 1 <= preset_num <= MAX_PRESET:
+            return False
+        return self.send_command(0x00, CMD2_SET_PRESET, preset_num)
+
+    def query_position(self):
+        """Request pan, tilt and zoom positions from the camera
+
+        Replies arrive asynchronously; read them with get_position() or
+        set_position_callback().
+        """
+        queued = self.bus.query(self.address, CMD2_QUERY_PAN)
+        queued = self.bus.query(self.address, CMD2_QUERY_TILT) and queued
+        return self.bus.query(self.address, CMD2_QUERY_ZOOM) and queued
+
+    def get_position(self):
+        """Get the last reported position
+
+        Returns:
+            dict: pan and tilt in degrees, zoom as the raw 16-bit position,
+                each None until the camera has reported it
+        """
+        with self.lock:
+            return self.position.copy()
+
+    def set_position_callback(self, callback):
+        """Set callback function for position updates
+
+        Args:
+            callback: Function to call with the position dictionary and the
+                key of the value the reply updated ('pan', 'tilt' or 'zoom');
+                the other values are the last ones reported
+        """
+        self.position_callback = callback
+
+    def _handle_response(self, frame):
+        """Update the position from a decoded reply
+
+        Returns:
+            bool: True if the frame was a position reply
+        """
+        if frame.command_2 == CMD2_PAN_POSITION:
+            key, value = "pan", decode_pan_position(frame.data_1, frame.data_2)
+        elif frame.command_2 == CMD2_TILT_POSITION:
+            key, value = "tilt", decode_tilt_position(frame.data_1, frame.data_2)
+        elif frame.command_2 == CMD2_ZOOM_POSITION:
+            key, value = "zoom", decode_zoom_position(frame.data_1, frame.data_2)
+        else:
+            # Local echo of our own frames or a reply we don't track
+            return False
+
+        with self.lock:
+            self.position[key] = value
+            self.position["timestamp"] = time.time()
+            position = self.position.copy()
+
+        if self.position_callback:
+            try:
+                self.position_callback(position, key)
+            except Exception as e:
+                logger.error(f"Error in position callback: {e}")
+
+        return True
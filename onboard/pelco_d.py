@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Pelco-D protocol helpers for PTZ cameras.
+This module contains the frame layout, command constants and checksum logic
+shared by the serial writer, the PTZ controller and the camera controller.
+"""
+
+import struct
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger('pelco_d')
+
+# Frame layout: sync, address, command 1, command 2, data 1, data 2, checksum
+FRAME_LENGTH = 7
+SYNC_BYTE = 0xFF
+
+# Command 2 direction/zoom bits (standard commands)
+CMD2_RIGHT = 0x02
+CMD2_LEFT = 0x04
+CMD2_UP = 0x08
+CMD2_DOWN = 0x10
+CMD2_ZOOM_IN = 0x20
+CMD2_ZOOM_OUT = 0x40
+
+# Extended commands (command 2 with bit 0 set)
+CMD2_SET_PRESET = 0x03
+CMD2_CLEAR_PRESET = 0x05
+CMD2_GOTO_PRESET = 0x07
+CMD2_SET_ZOOM_POSITION = 0x4F  # Absolute zoom, not supported by every camera
+
+# Position queries and the extended responses the camera sends back
+CMD2_QUERY_PAN = 0x51
+CMD2_QUERY_TILT = 0x53
+CMD2_QUERY_ZOOM = 0x55
+CMD2_PAN_POSITION = 0x59
+CMD2_TILT_POSITION = 0x5B
+CMD2_ZOOM_POSITION = 0x5D
+
+MAX_SPEED = 0x3F
+MAX_PRESET = 0xFF
+
+_FRAME = struct.Struct('7B')
+
+PelcoFrame = namedtuple('PelcoFrame', ['address', 'command_1', 'command_2', 'data_1', 'data_2'])
+
+
+def build_frame(address, command_1, command_2, data_1=0, data_2=0):
+    """Build a Pelco-D frame as bytes"""
+    checksum = (address + command_1 + command_2 + data_1 + data_2) & 0xFF
+    return _FRAME.pack(SYNC_BYTE, address, command_1, command_2, data_1, data_2, checksum)
+
+
+def is_motion_command(command_1, command_2):
+    """Check whether a command only sets the pan/tilt/zoom motion state
+
+    Standard commands (bit 0 of command 2 clear) fully describe the current
+    motion, so a newer one for the same address supersedes an older one.
+    Extended commands such as presets must always be delivered.
+    """
+    return command_1 == 0x00 and not command_2 & 0x01
+
+
+class ResponseDecoder:
+    """Incremental decoder for Pelco-D frames received from cameras
+
+    Bytes can be fed in arbitrary chunks as they arrive from the serial port.
+    The decoder waits for a sync byte, collects a full frame and checks its
+    checksum. On a checksum mismatch it resyncs on the next 0xFF inside the
+    rejected frame instead of discarding all of it.
+    """
+
+    def __init__(self):
+        """Initialize the decoder"""
+        self.buffer = bytearray(FRAME_LENGTH)
+        self.length = 0
+        self.frames_decoded = 0
+        self.checksum_errors = 0
+        self.bytes_discarded = 0
+
+    def reset(self):
+        """Discard any partially received frame"""
+        self.length = 0
+
+    def feed(self, data):
+        """Feed received bytes into the decoder
+
+        Args:
+            data (bytes): Bytes read from the serial port
+
+        Returns:
+            list: Complete, checksum-valid PelcoFrame tuples
+        """
+        frames = []
+        buffer = self.buffer
+
+        for byte in data:
+            if self.length == 0:
+                if byte != SYNC_BYTE:
+                    self.bytes_discarded += 1
+                    continue
+
+            buffer[self.length] = byte
+            self.length += 1
+            if self.length < FRAME_LENGTH:
+                continue
+
+            address, command_1, command_2, data_1, data_2, checksum = buffer[1:]
+            if (address + command_1 + command_2 + data_1 + data_2) & 0xFF == checksum:
+                frames.append(PelcoFrame(address, command_1, command_2, data_1, data_2))
+                self.frames_decoded += 1
+                self.length = 0
+                continue
+
+            # Bad frame: restart from the next sync byte inside it, if any
+            self.checksum_errors += 1
+            resync = buffer.find(SYNC_BYTE, 1)
+            if resync == -1:
+                self.bytes_discarded += FRAME_LENGTH
+                self.length = 0
+            else:
+                self.bytes_discarded += resync
+                self.length = FRAME_LENGTH - resync
+                buffer[:self.length] = buffer[resync:]
+
+        return frames
+
+
+def decode_pan_position(data_1, data_2):
+    """Convert a pan position response to degrees (0-360)"""
+    return ((data_1 << 8) | data_2) / 100.0
+
+
+def decode_tilt_position(data_1, data_2):
+    """Convert a tilt position response to degrees, negative above horizon"""
+    hundredths = (data_1 << 8) | data_2
+    if hundredths > 18000:
+        hundredths -= 36000
+    return hundredths / 100.0
+
+
+def decode_zoom_position(data_1, data_2):
+    """Convert a zoom position response to the raw 16-bit zoom position"""
+    return (data_1 << 8) | data_2
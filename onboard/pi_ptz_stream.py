@@ -6,22 +6,21 @@ while simultaneously streaming and recording video.
 """
 
 import serial
-import time
-import argparse
-import sys
-import os
 import curses
 import cv2
 import threading
 import datetime
-import queue
 import numpy as np
 from pathlib import Path
 
+from pelco_bus import PelcoBus
+from frame_hub import FrameHub
+from recorder import RecordingWriter, PassthroughRecorder, RecordingIndex, RetentionManager, segment_opener
+
 class PTZController:
     """Pelco-D PTZ camera controller using RS485 via CH341 USB adapter"""
 
-    def __init__(self, port='/dev/ttyUSB0', baudrate=9600, address=0x01):
+    def __init__(self, port='/dev/ttyUSB0', baudrate=9600, address=0x01, bus=None):
         """
         Initialize the PTZ controller
 
@@ -29,33 +28,29 @@ class PTZController:
             port (str): Serial port path for the CH341 adapter
             baudrate (int): Communication baudrate (2400, 4800, 9600, or 38400)
             address (int): Camera address (1-255)
+            bus (PelcoBus): Shared RS-485 bus to use instead of opening the
+                port directly, for several cameras on one adapter
         """
         self.port = port
         self.baudrate = baudrate
         self.address = address
-        self.ser = None
+        self.owns_bus = bus is None
+        self.bus = bus if bus is not None else PelcoBus(port, baudrate)
+        self.camera = self.bus.camera(address)
         self.connect()
 
     def connect(self):
         """Establish a serial connection to the PTZ camera"""
+        if self.bus.is_open:
+            return
+
         try:
-            self.ser = serial.Serial(
-                port=self.port,
-                baudrate=self.baudrate,
-                bytesize=serial.EIGHTBITS,
-                parity=serial.PARITY_NONE,
-                stopbits=serial.STOPBITS_ONE,
-                timeout=1
-            )
+            self.bus.open()
             print(f"Connected to {self.port} at {self.baudrate} baud")
         except serial.SerialException as e:
             print(f"Error connecting to {self.port}: {e}")
             raise
 
-    def _calculate_checksum(self, data):
-        """Calculate Pelco-D checksum (sum of bytes mod 256)"""
-        return sum(data) % 256
-
     def _send_pelco_command(self, command_1, command_2, data_1=0, data_2=0):
         """
         Send Pelco-D formatted command
@@ -66,22 +61,9 @@ class PTZController:
             data_1 (int): Data byte 1 (pan speed, 0-63)
             data_2 (int): Data byte 2 (tilt speed, 0-63)
         """
-        message = [
-            0xFF,       # Start byte
-            self.address,
-            command_1,
-            command_2,
-            data_1,     # Pan speed (00-3F)
-            data_2      # Tilt speed (00-3F)
-        ]
-        checksum = self._calculate_checksum(message[1:])  # Exclude start byte
-        message.append(checksum)
-
-        try:
-            self.ser.write(bytes(message))
-            time.sleep(0.1)  # Adjust based on device response
-        except serial.SerialException as e:
-            print(f"Communication error: {e}")
+        # Frames are written by the bus thread so callers never block
+        if not self.camera.send_command(command_1, command_2, data_1, data_2):
+            print("Communication error: serial write queue full")
 
     # Basic movement commands
     def stop(self):
@@ -257,17 +239,29 @@ class PTZController:
             self.goto_preset(220)
             return "Disabling power cycle memory"
 
+    # Position feedback
+    def query_position(self):
+        """Request the current pan/tilt/zoom position from the camera"""
+        self.camera.query_position()
+        return "Querying position"
+
+    def get_position(self):
+        """Get the last position reported by the camera"""
+        return self.camera.get_position()
+
     def close(self):
         """Close the serial connection"""
-        if self.ser and self.ser.is_open:
-            self.ser.close()
+        if self.owns_bus and self.bus.is_open:
+            self.bus.close()
             return "Connection closed"
 
 
 class CameraStream:
     """Class to handle camera streaming and recording"""
 
-    def __init__(self, ip="192.168.1.108", username="admin", password="abcd1234", port=554):
+    def __init__(self, ip="192.168.1.108", username="admin", password="abcd1234", port=554,
+                 recording_mode="auto", ffmpeg="ffmpeg", segment_time=300, max_recording_bytes=None,
+                 max_recording_age=None, min_free_bytes=0):
         """
         Initialize the camera stream
 
@@ -276,6 +270,19 @@ class CameraStream:
             username (str): Camera login username
             password (str): Camera login password
             port (int): RTSP port
+            recording_mode (str): "passthrough" to copy the camera's H.264
+                stream into the file with ffmpeg, "encode" to re-encode
+                decoded frames with OpenCV, "auto" for passthrough when
+                ffmpeg is installed
+            ffmpeg (str): ffmpeg executable for passthrough recording
+            segment_time (float): Seconds per recording file, None for one
+                file per recording
+            max_recording_bytes (int): Size of all recordings before the
+                oldest segments are deleted, None for no limit
+            max_recording_age (float): Seconds recordings are kept, None
+                for no limit
+            min_free_bytes (int): Free disk space kept by deleting the
+                oldest segments, 0 to never delete for free space
         """
         self.ip = ip
         self.username = username
@@ -289,20 +296,31 @@ class CameraStream:
         }
 
         self.stream_url = None
-        self.cap = None
+        self.hub = None  # Single capture shared by display, recording and snapshots
         self.recording = False
         self.paused = False
         self.displaying = False
         self.stream_thread = None
-        self.recording_thread = None
-        self.out = None
-        self.frame_queue = queue.Queue(maxsize=30)  # Buffer for frames
-        self.current_frame = None
+        self.recorder = None
+        self.recording_queue_size = 8  # Frames the encoder may fall behind before dropping
+        self.last_recording_stats = None
+        self.ffmpeg = ffmpeg
+        if recording_mode == "auto":
+            recording_mode = "passthrough" if PassthroughRecorder.available(ffmpeg) else "encode"
+        self.recording_mode = recording_mode
         self.resolution = None
         self.fps = 0
         self.stream_type = "main"
         self.recordings_dir = Path("./recordings")
         self.recordings_dir.mkdir(exist_ok=True)
+        self.segment_time = segment_time
+        self.recording_index = RecordingIndex(self.recordings_dir)
+        self.retention = RetentionManager(
+            self.recording_index,
+            max_bytes=max_recording_bytes,
+            max_age=max_recording_age,
+            min_free_bytes=min_free_bytes
+        )
         self.playback_file = None
         self.playback_cap = None
 
@@ -311,22 +329,22 @@ class CameraStream:
         self.stream_type = stream_type
         self.stream_url = self.rtsp_templates[stream_type]
 
-        # Release previous capture if any
-        if self.cap and self.cap.isOpened():
-            self.cap.release()
-
-        # Connect to camera
-        self.cap = cv2.VideoCapture(self.stream_url)
+        # One capture thread decodes the stream for every consumer; switching
+        # streams only swaps its source
+        open_capture = lambda url=self.stream_url: cv2.VideoCapture(url)
+        if self.hub is None:
+            # Queued recording frames hold hub slots, so size the ring for them
+            self.hub = FrameHub(open_capture, slots=self.recording_queue_size + 4, name=f"{stream_type} stream")
+            self.hub.start()
+        else:
+            self.hub.reopen(open_capture, name=f"{stream_type} stream")
 
-        if not self.cap.isOpened():
+        if not self.hub.wait_for_source(10.0):
             return f"Error connecting to {self.stream_url}"
 
         # Get stream properties
-        self.resolution = (
-            int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
-            int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        )
-        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.resolution = self.hub.resolution
+        self.fps = self.hub.fps
 
         return f"Connected to {self.stream_type} stream: {self.resolution[0]}x{self.resolution[1]} at {self.fps} FPS"
 
@@ -338,17 +356,18 @@ class CameraStream:
         if stream_type == self.stream_type:
             return f"Already using {stream_type} stream"
 
-        # Stop current operations
-        self.stop_stream()
-
-        # Connect to new stream
-        result = self.connect(stream_type)
-
-        # Resume operations if needed
-        if self.displaying:
-            self.start_stream()
+        # A recording's files are tied to the stream's URL, frame size and
+        # rate, so it is stopped and restarted on the new stream rather
+        # than writing frames of another size into the open segment
+        recording = self.recording
+        if recording:
+            self.stop_recording()
 
-        return result
+        # The display keeps reading from the hub while it reconnects
+        status = self.connect(stream_type)
+        if recording and self.hub.resolution is not None:
+            self.start_recording()
+        return status
 
     def start_stream(self):
         """Start streaming thread"""
@@ -379,30 +398,47 @@ class CameraStream:
         if self.recording:
             return "Already recording"
 
-        if not self.cap or not self.cap.isOpened():
+        if not self.hub or not self.resolution:
             return "Cannot record: No active stream"
 
-        # Create a filename with timestamp
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = self.recordings_dir / f"recording_{timestamp}_{self.stream_type}.mp4"
-
-        # Create video writer
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        self.out = cv2.VideoWriter(
-            str(filename),
-            fourcc,
-            self.fps,
-            self.resolution
+        # Finished segments are indexed, then old ones are deleted if the
+        # disk budget is exceeded
+        stream_type = self.stream_type
+        def segment_finished(path, start, end):
+            self.recording_index.add(path, stream_type, start, end)
+            self.retention.enforce()
+        self.retention.enforce()
+
+        if self.recording_mode == "passthrough":
+            # Copy the camera's H.264 as is: no decode or encode on the Pi,
+            # and independent of the display
+            if self.segment_time:
+                filename = self.recordings_dir / f"recording_%Y%m%d_%H%M%S_{stream_type}.mp4"
+            else:
+                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+                filename = self.recordings_dir / f"recording_{timestamp}_{stream_type}.mp4"
+            recorder = PassthroughRecorder(self.stream_url, filename, ffmpeg=self.ffmpeg,
+                                           segment_time=self.segment_time, on_segment=segment_finished)
+            if not recorder.start():
+                return f"Error starting passthrough recording to {self.recordings_dir}"
+            self.recorder = recorder
+            self.recording = True
+            return f"Started passthrough recording to {self.recordings_dir}"
+
+        # The capture thread queues every frame for the encoder thread, so
+        # encoding never slows capture or display
+        self.recorder = RecordingWriter(
+            segment_opener(self.recordings_dir, stream_type, self.fps, self.resolution),
+            queue_size=self.recording_queue_size,
+            name=f"{stream_type} recording",
+            segment_time=self.segment_time,
+            on_segment=segment_finished
         )
-
+        self.recorder.start()
+        self.hub.subscribe(self.recorder.submit)
         self.recording = True
 
-        # Start recording thread if not streaming
-        if not self.displaying:
-            self.recording_thread = threading.Thread(target=self._recording_worker, daemon=True)
-            self.recording_thread.start()
-
-        return f"Started recording to {filename}"
+        return f"Started recording to {self.recordings_dir}"
 
     def stop_recording(self):
         """Stop video recording"""
@@ -411,22 +447,33 @@ class CameraStream:
 
         self.recording = False
 
-        if self.recording_thread:
-            self.recording_thread.join(timeout=1.0)
+        if self.hub and isinstance(self.recorder, RecordingWriter):
+            self.hub.unsubscribe(self.recorder.submit)
+        self.recorder.stop()
+        self.last_recording_stats = self.recorder.get_stats()
+        self.recorder = None
 
-        if self.out:
-            self.out.release()
-            self.out = None
+        stats = self.last_recording_stats
+        if "seconds" in stats:
+            return f"Recording stopped: {stats['seconds']:.0f}s, {stats['bytes'] / 1e6:.1f} MB"
+        return f"Recording stopped: {stats['written']} frames written, {stats['dropped']} dropped"
 
-        return "Recording stopped"
+    def get_recording_stats(self):
+        """Get frame counters of the current or last recording"""
+        if self.recorder:
+            return self.recorder.get_stats()
+        return self.last_recording_stats
 
     def list_recordings(self):
         """List all available recordings"""
-        recordings = list(self.recordings_dir.glob("*.mp4"))
+        recordings = self.recording_index.entries()
         if not recordings:
             return "No recordings found"
 
-        recordings_list = "\n".join([f"{i+1}. {rec.name}" for i, rec in enumerate(recordings)])
+        recordings_list = "\n".join([
+            f"{i+1}. {rec['file']} ({rec['end'] - rec['start']:.0f}s, {rec['size'] / 1e6:.1f} MB)"
+            for i, rec in enumerate(recordings)
+        ])
         return f"Available recordings:\n{recordings_list}"
 
     def start_playback(self, filename):
@@ -435,17 +482,10 @@ class CameraStream:
         self.stop_stream()
         self.stop_recording()
 
-        # Check if file exists
-        playback_path = self.recordings_dir / filename
-        if not playback_path.exists():
-            # Try with raw filename
-            recordings = list(self.recordings_dir.glob("*.mp4"))
-            matches = [rec for rec in recordings if filename in rec.name]
-
-            if not matches:
-                return f"Recording '{filename}' not found"
-
-            playback_path = matches[0]
+        # Look the file up in the recording index
+        playback_path = self.recording_index.find(filename)
+        if playback_path is None:
+            return f"Recording '{filename}' not found"
 
         self.playback_file = str(playback_path)
         self.playback_cap = cv2.VideoCapture(self.playback_file)
@@ -474,7 +514,8 @@ class CameraStream:
 
     def take_snapshot(self):
         """Take a snapshot of the current frame"""
-        if not self.current_frame is not None:
+        frame = self.hub.latest_frame() if self.hub else None
+        if frame is None:
             return "No frame available for snapshot"
 
         # Create a filename with timestamp
@@ -482,39 +523,37 @@ class CameraStream:
         filename = self.recordings_dir / f"snapshot_{timestamp}.jpg"
 
         # Save snapshot
-        cv2.imwrite(str(filename), self.current_frame)
+        with frame:
+            cv2.imwrite(str(filename), frame.image)
         return f"Snapshot saved to {filename}"
 
     def _stream_worker(self):
         """Worker thread for streaming"""
+        reader = self.hub.reader("display")
+        display_frame = None
         try:
             while self.displaying:
-                if not self.cap or not self.cap.isOpened():
-                    time.sleep(0.5)
-                    continue
-
                 if not self.paused:
-                    ret, frame = self.cap.read()
-
-                    if not ret:
-                        print("Failed to receive frame. Reconnecting...")
-                        self.cap.release()
-                        time.sleep(1)
-                        self.cap = cv2.VideoCapture(self.stream_url)
+                    frame = reader.next(timeout=0.5)
+                    if frame is None:
+                        cv2.waitKey(1)
                         continue
 
-                    # Store current frame
-                    self.current_frame = frame
-
-                    # Put frame in queue for recording thread
-                    if self.recording and not self.frame_queue.full():
-                        self.frame_queue.put(frame, block=False)
+                    # The hub's buffers are shared, so draw on our own
+                    # reusable buffer
+                    with frame:
+                        if display_frame is None or display_frame.shape != frame.image.shape:
+                            display_frame = np.empty_like(frame.image)
+                        np.copyto(display_frame, frame.image)
 
                     # Add status text to display frame
-                    display_frame = frame.copy()
                     status_text = f"{self.stream_type.upper()} {self.resolution[0]}x{self.resolution[1]}"
-                    if self.recording:
+                    recorder = self.recorder
+                    if self.recording and recorder:
                         status_text += " | RECORDING"
+                        dropped = recorder.stats["dropped"]
+                        if dropped:
+                            status_text += f" ({dropped} dropped)"
                         # Add red circle indicator
                         cv2.circle(display_frame, (20, 20), 10, (0, 0, 255), -1)
 
@@ -533,35 +572,9 @@ class CameraStream:
         except Exception as e:
             print(f"Streaming error: {e}")
         finally:
+            reader.close()
             cv2.destroyAllWindows()
 
-    def _recording_worker(self):
-        """Worker thread for recording without display"""
-        try:
-            while self.recording:
-                if not self.cap or not self.cap.isOpened():
-                    time.sleep(0.5)
-                    continue
-
-                ret, frame = self.cap.read()
-
-                if not ret:
-                    print("Failed to receive frame for recording. Reconnecting...")
-                    self.cap.release()
-                    time.sleep(1)
-                    self.cap = cv2.VideoCapture(self.stream_url)
-                    continue
-
-                # Store current frame
-                self.current_frame = frame
-
-                # Write frame to video file
-                if self.out:
-                    self.out.write(frame)
-
-        except Exception as e:
-            print(f"Recording error: {e}")
-
     def _playback_worker(self):
         """Worker thread for playback"""
         try:
@@ -601,8 +614,9 @@ class CameraStream:
         self.stop_recording()
         self.stop_stream()
 
-        if self.cap and self.cap.isOpened():
-            self.cap.release()
+        if self.hub:
+            self.hub.stop()
+            self.hub = None
 
         return "Camera stream closed"
 
@@ -612,14 +626,15 @@ class PTZCameraSystem:
 
     def __init__(self, ptz_port='/dev/ttyUSB0', ptz_baudrate=9600, ptz_address=1,
                  camera_ip="192.168.1.108", camera_username="admin",
-                 camera_password="abcd1234", camera_port=554):
+                 camera_password="abcd1234", camera_port=554, recording_mode="auto"):
         """Initialize the combined system"""
         self.ptz = PTZController(port=ptz_port, baudrate=ptz_baudrate, address=ptz_address)
         self.camera = CameraStream(
             ip=camera_ip,
             username=camera_username,
             password=camera_password,
-            port=camera_port
+            port=camera_port,
+            recording_mode=recording_mode
         )
         self.status_message = "System initialized"
         self.running = False
@@ -675,7 +690,6 @@ class PTZCameraSystem:
 
             screen.refresh()
 
-            scanning = False
             speed = 0x20  # Default speed (medium)
 
             # Start camera stream
@@ -785,10 +799,8 @@ class PTZCameraSystem:
                         self.status_message = self.ptz.set_scan_right_limit()
                     elif scan_key == ord('s') or scan_key == ord('S'):
                         self.status_message = self.ptz.start_scan()
-                        scanning = True
                     elif scan_key == ord('x') or scan_key == ord('X'):
                         self.status_message = self.ptz.stop_scan()
-                        scanning = False
                     screen.refresh()
 
                 # Day/night mode
@@ -868,7 +880,7 @@ class PTZCameraSystem:
                                     idx = int(choice) - 1
                                     if 0 <= idx < len(lines) - 1:  # -1 for the header line
                                         # Extract filename from the list
-                                        filename = lines[idx + 1].split('. ')[1]
+                                        filename = lines[idx + 1].split('. ', 1)[1].split()[0]
                                         self.status_message = self.camera.start_playback(filename)
                                     else:
                                         self.status_message = "Invalid selection"
@@ -899,4 +911,16 @@ class PTZCameraSystem:
                     screen.addstr(20, 0, "  c: Take snapshot")
                     screen.addstr(21, 0, "  v: View recordings")
                     screen.addstr(22, 0, "  z: Pause/resume stream")
-                    screen.addstr(24, 0, "  q: Quit")
\ No newline at end of file
+                    screen.addstr(24, 0, "  q: Quit")
+                    screen.refresh()
+
+        except Exception as e:
+            self.status_message = f"Error: {e}"
+        finally:
+            # Restore the terminal
+            curses.nocbreak()
+            screen.keypad(False)
+            curses.echo()
+            curses.endwin()
+            self.stop()
+            print(self.status_message)
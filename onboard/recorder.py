@@ -0,0 +1,743 @@
+#!/usr/bin/env python3
+"""
+Video recording for the PTZ camera streams.
+RecordingWriter encodes decoded frames: the capture thread pushes them into
+a small bounded queue and a dedicated writer thread encodes them, so a slow
+encoder never holds up capture or the live display. When the encoder falls
+behind, the oldest queued frames are dropped and counted.
+
+PassthroughRecorder skips decoding and encoding altogether. It has ffmpeg
+copy the camera's compressed H.264 stream into the file, which costs next
+to no CPU, keeps the camera's quality and does not depend on the display.
+
+Both can split a recording into fixed-length segments. Finished segments go
+into a RecordingIndex, and a RetentionManager deletes the oldest ones once
+a byte, age or free-space budget is exceeded, so recording can run for
+weeks without filling the SD card.
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import datetime
+import threading
+import subprocess
+from pathlib import Path
+from collections import deque
+
+logger = logging.getLogger('recorder')
+
+# Index of finished segments, kept in the recordings directory
+INDEX_FILE = "index.json"
+
+# Names the recorders give their files, used when rebuilding the index
+RECORDING_NAME = re.compile(r"recording_(\d{8}_\d{6})_([a-z]+)(?:_\d+)?\.(?:mp4|mkv)$")
+
+class RecordingIndex:
+    """On-disk index of finished recording segments
+
+    Keeps the start and end time, size and stream type of every segment in
+    one small JSON file, so listing and playback never rescan the directory.
+    """
+
+    def __init__(self, directory):
+        """Initialize the index, loading it or rebuilding it from the directory
+
+        Args:
+            directory: Recordings directory
+        """
+        self.directory = Path(directory)
+        self.path = self.directory / INDEX_FILE
+        self.segments = []  # Entry dicts, oldest first
+        self.lock = threading.Lock()
+        self._load()
+
+    def add(self, path, stream_type, start, end):
+        """Add a finished segment
+
+        Args:
+            path: Segment file
+            stream_type (str): Stream the segment was recorded from
+            start (float): Epoch seconds of the first frame
+            end (float): Epoch seconds of the last frame
+
+        Returns:
+            dict: The new entry
+        """
+        path = Path(path)
+        try:
+            size = path.stat().st_size
+        except OSError as e:
+            logger.warning(f"Not indexing missing segment {path}: {e}")
+            return None
+
+        entry = {
+            "file": path.name,
+            "stream_type": stream_type,
+            "start": round(start, 3),
+            "end": round(end, 3),
+            "size": size
+        }
+        with self.lock:
+            self.segments.append(entry)
+            self.segments.sort(key=lambda segment: segment["start"])
+            self._save()
+        return entry
+
+    def remove(self, entries):
+        """Drop entries from the index"""
+        names = {entry["file"] for entry in entries}
+        with self.lock:
+            self.segments = [segment for segment in self.segments if segment["file"] not in names]
+            self._save()
+
+    def entries(self, stream_type=None):
+        """Get the indexed segments, oldest first
+
+        Args:
+            stream_type (str): Only segments of this stream, None for all
+        """
+        with self.lock:
+            return [dict(segment) for segment in self.segments
+                    if stream_type is None or segment["stream_type"] == stream_type]
+
+    def find(self, name):
+        """Find a segment by file name, or by part of it
+
+        Returns:
+            Path: The segment file, or None if no segment matches
+        """
+        with self.lock:
+            for segment in self.segments:
+                if segment["file"] == name:
+                    return self.directory / segment["file"]
+            for segment in self.segments:
+                if name in segment["file"]:
+                    return self.directory / segment["file"]
+        return None
+
+    def total_bytes(self):
+        """Get the size of all indexed segments"""
+        with self.lock:
+            return sum(segment["size"] for segment in self.segments)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                self.segments = json.load(f)["segments"]
+            return
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Recording index {self.path} is unreadable, rebuilding it: {e}")
+
+        self._rebuild()
+
+    def _rebuild(self):
+        """Index the recordings already in the directory, once"""
+        segments = []
+        for path in self.directory.iterdir():
+            match = RECORDING_NAME.match(path.name)
+            if not match:
+                continue
+            stat = path.stat()
+            start = time.mktime(time.strptime(match.group(1), "%Y%m%d_%H%M%S"))
+            segments.append({
+                "file": path.name,
+                "stream_type": match.group(2),
+                "start": start,
+                "end": max(start, stat.st_mtime),
+                "size": stat.st_size
+            })
+        segments.sort(key=lambda segment: segment["start"])
+
+        with self.lock:
+            self.segments = segments
+            self._save()
+        logger.info(f"Rebuilt recording index with {len(segments)} segments")
+
+    def _save(self):
+        """Write the index atomically (lock held)"""
+        temp_path = self.path.with_suffix(".tmp")
+        with open(temp_path, "w") as f:
+            json.dump({"segments": self.segments}, f, indent=1)
+        os.replace(temp_path, self.path)
+
+class RetentionManager:
+    """Deletes the oldest indexed segments when over a disk budget"""
+
+    def __init__(self, index, max_bytes=None, max_age=None, min_free_bytes=0):
+        """Initialize the retention manager
+
+        Args:
+            index: RecordingIndex of the segments to manage
+            max_bytes (int): Total size of all segments, None for no limit
+            max_age (float): Seconds a segment is kept, None for no limit
+            min_free_bytes (int): Free space to keep on the recordings disk,
+                0 to never delete for free space
+        """
+        self.index = index
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.min_free_bytes = min_free_bytes
+        self.stats = {"deleted": 0, "deleted_bytes": 0}
+
+    def enforce(self):
+        """Delete the oldest segments until every budget is met
+
+        Only finished, indexed segments are deleted, never the segment
+        being recorded.
+
+        Returns:
+            int: Number of segments deleted
+        """
+        segments = self.index.entries()
+        total = sum(segment["size"] for segment in segments)
+        free = shutil.disk_usage(self.index.directory).free if self.min_free_bytes else 0
+        now = time.time()
+        if segments and free < self.min_free_bytes:
+            logger.warning(f"Only {free} bytes free on {self.index.directory}, below {self.min_free_bytes}; "
+                           f"deleting the oldest recordings")
+
+        expired = []
+        for segment in segments:
+            over_size = self.max_bytes is not None and total > self.max_bytes
+            too_old = self.max_age is not None and now - segment["end"] > self.max_age
+            low_space = free < self.min_free_bytes
+            if not (over_size or too_old or low_space):
+                break
+
+            try:
+                (self.index.directory / segment["file"]).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Error deleting recording {segment['file']}: {e}")
+                continue
+            total -= segment["size"]
+            free += segment["size"]
+            expired.append(segment)
+
+        if expired:
+            self.index.remove(expired)
+            self.stats["deleted"] += len(expired)
+            self.stats["deleted_bytes"] += sum(segment["size"] for segment in expired)
+            logger.info(f"Deleted {len(expired)} old recording segments, {total} bytes left")
+        return len(expired)
+
+class RecordingWriter:
+    """Encodes queued frames to video files from its own thread"""
+
+    def __init__(self, open_writer, queue_size=8, name="recording", segment_time=None, on_segment=None):
+        """Initialize the recording writer
+
+        Args:
+            open_writer: Function called with a segment's start time (epoch
+                seconds) that returns an opened cv2.VideoWriter (or an
+                object with write and release methods) and its file path
+            queue_size (int): Frames queued before the oldest is dropped
+            name (str): Recording name, for logging
+            segment_time (float): Seconds per file, None for a single file
+            on_segment: Called with (path, start, end) for each finished file
+        """
+        self.open_writer = open_writer
+        self.name = name
+        self.segment_time = segment_time
+        self.on_segment = on_segment
+        self.writer = None
+        self.segment_path = None
+        self.segment_start = None
+        self.segment_end = None
+        self.queue = deque()
+        self.queue_size = queue_size
+        self.running = False
+        self.writer_thread = None
+        self.stats = {
+            "written": 0,
+            "dropped": 0,
+            "errors": 0,
+            "segments": 0,
+            "encode_time": 0.0,
+            "max_encode_time": 0.0
+        }
+        self.condition = threading.Condition()
+
+    def start(self):
+        """Start the writer thread"""
+        self.running = True
+        self.writer_thread = threading.Thread(target=self._writer_loop)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+        logger.info(f"Recording writer for {self.name} started")
+
+    def stop(self, timeout=5.0):
+        """Stop accepting frames, encode the queued ones and close the file
+
+        Args:
+            timeout (float): Seconds to wait for the queue to drain
+        """
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify_all()
+
+        if self.writer_thread:
+            self.writer_thread.join(timeout=timeout)
+
+        # Anything left over after a timeout is abandoned
+        with self.condition:
+            while self.queue:
+                self.queue.popleft().release()
+                self.stats["dropped"] += 1
+
+        stats = self.get_stats()
+        logger.info(f"Recording writer for {self.name} stopped: {stats['written']} frames written, "
+                    f"{stats['dropped']} dropped")
+
+    def submit(self, frame):
+        """Queue a frame without blocking
+
+        Takes ownership of the frame and releases it once encoded or
+        dropped. Suitable as a FrameHub.subscribe() callback.
+
+        Args:
+            frame: Frame from a FrameHub
+        """
+        with self.condition:
+            if not self.running:
+                frame.release()
+                return
+
+            if len(self.queue) >= self.queue_size:
+                self.queue.popleft().release()
+                self.stats["dropped"] += 1
+            self.queue.append(frame)
+            self.condition.notify()
+
+    def get_stats(self):
+        """Get frame counters and encode times in milliseconds"""
+        with self.condition:
+            stats = dict(self.stats)
+            stats["queued"] = len(self.queue)
+        encode_time = stats.pop("encode_time")
+        stats["avg_encode_ms"] = encode_time / stats["written"] * 1000 if stats["written"] else 0.0
+        stats["max_encode_ms"] = stats.pop("max_encode_time") * 1000
+        return stats
+
+    def _writer_loop(self):
+        """Encode queued frames until stopped and drained"""
+        try:
+            while True:
+                with self.condition:
+                    while not self.queue and self.running:
+                        self.condition.wait()
+                    if not self.queue:
+                        break
+                    frame = self.queue.popleft()
+
+                start = time.perf_counter()
+                try:
+                    with frame:
+                        if self.writer is None or (self.segment_time and
+                                                   frame.timestamp - self.segment_start >= self.segment_time):
+                            self._next_segment(frame.timestamp)
+                        self.writer.write(frame.image)
+                        self.segment_end = frame.timestamp
+                except Exception as e:
+                    logger.error(f"Error encoding frame for {self.name}: {e}")
+                    with self.condition:
+                        self.stats["errors"] += 1
+                    continue
+                elapsed = time.perf_counter() - start
+
+                with self.condition:
+                    self.stats["written"] += 1
+                    self.stats["encode_time"] += elapsed
+                    self.stats["max_encode_time"] = max(self.stats["max_encode_time"], elapsed)
+        finally:
+            self._finish_segment()
+
+    def _next_segment(self, start):
+        """Close the current file and open the next one"""
+        self._finish_segment()
+        self.writer, self.segment_path = self.open_writer(start)
+        self.segment_start = self.segment_end = start
+
+    def _finish_segment(self):
+        """Close the current file and report it"""
+        if self.writer is None:
+            return
+        writer, self.writer = self.writer, None
+        try:
+            writer.release()
+        except Exception as e:
+            logger.error(f"Error closing {self.segment_path}: {e}")
+            return
+
+        with self.condition:
+            self.stats["segments"] += 1
+        if self.on_segment:
+            try:
+                self.on_segment(self.segment_path, self.segment_start, self.segment_end)
+            except Exception as e:
+                logger.error(f"Error handling finished segment {self.segment_path}: {e}")
+
+class PassthroughRecorder:
+    """Remuxes a camera's compressed stream into files with ffmpeg -c copy"""
+
+    def __init__(self, source_url, path, ffmpeg="ffmpeg", restart_delay=2.0, segment_time=None, on_segment=None):
+        """Initialize the passthrough recorder
+
+        Args:
+            source_url (str): Camera stream, e.g. an rtsp:// URL
+            path: Output file; .mp4 is written fragmented so it stays
+                playable if recording is cut off, .mkv is robust as is.
+                With segments this is a strftime pattern for the file names
+            ffmpeg (str): ffmpeg executable
+            restart_delay (float): Seconds before restarting ffmpeg when it
+                exits on its own, e.g. after the camera dropped the stream
+            segment_time (float): Seconds per file, None for a single file;
+                segments start on the next keyframe
+            on_segment: Called with (path, start, end) for each finished file
+        """
+        self.source_url = source_url
+        self.path = Path(path)
+        self.ffmpeg = ffmpeg
+        self.restart_delay = restart_delay
+        self.segment_time = segment_time
+        self.on_segment = on_segment
+        self.segment_list = self.path.parent / ".segments.csv"
+        self.segment_list_offset = 0
+        self.running = False
+        self.process = None
+        self.process_path = None
+        self.process_start = None
+        self.monitor_thread = None
+        self.files = []
+        self.errors = deque(maxlen=20)  # Last lines ffmpeg logged
+        self.stats = {
+            "seconds": 0.0,
+            "dropped": 0,
+            "bytes": 0,
+            "restarts": 0
+        }
+        self.base_counters = dict(self.stats)  # Totals of the files before the current one
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def available(ffmpeg="ffmpeg"):
+        """Whether the ffmpeg executable can be found"""
+        return shutil.which(ffmpeg) is not None
+
+    def build_command(self, path):
+        """Build the ffmpeg command recording to path"""
+        cmd = [self.ffmpeg, "-hide_banner", "-loglevel", "error", "-nostats"]
+        if self.source_url.startswith("rtsp://"):
+            # Interleaved over TCP, so a lost packet cannot corrupt the copy
+            cmd += ["-rtsp_transport", "tcp"]
+        cmd += ["-i", self.source_url, "-map", "0:v", "-c", "copy"]
+        movflags = "+frag_keyframe+empty_moov+default_base_moof"
+        if self.segment_time:
+            cmd += ["-f", "segment", "-segment_time", str(self.segment_time), "-reset_timestamps", "1",
+                    "-strftime", "1", "-segment_list", str(self.segment_list), "-segment_list_type", "csv"]
+            if path.suffix == ".mp4":
+                cmd += ["-segment_format", "mp4", "-segment_format_options", f"movflags={movflags}"]
+        elif path.suffix == ".mp4":
+            cmd += ["-movflags", movflags]
+        cmd += ["-progress", "pipe:1", "-y", str(path)]
+        return cmd
+
+    def start(self):
+        """Start ffmpeg
+
+        Returns:
+            bool: True if ffmpeg started and is still running
+        """
+        if self.running:
+            logger.warning(f"Passthrough recording to {self.path} is already running")
+            return True
+
+        self.running = True
+        if not self._start_process(self.path):
+            self.running = False
+            return False
+
+        self.monitor_thread = threading.Thread(target=self._monitor_process)
+        self.monitor_thread.daemon = True
+        self.monitor_thread.start()
+        return True
+
+    def stop(self, timeout=5.0):
+        """Stop ffmpeg, letting it finish the file"""
+        if not self.running:
+            return
+
+        self.running = False
+        self._stop_process(timeout)
+        if self.monitor_thread:
+            self.monitor_thread.join(timeout=timeout)
+
+        stats = self.get_stats()
+        logger.info(f"Passthrough recording to {self.path} stopped: {stats['seconds']:.1f}s, "
+                    f"{stats['bytes']} bytes")
+
+    def get_stats(self):
+        """Get the recorded duration and byte counters reported by ffmpeg"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats["files"] = [str(path) for path in self.files]
+        if self.errors:
+            stats["last_error"] = self.errors[-1]
+        return stats
+
+    def _start_process(self, path):
+        """Start an ffmpeg process recording to path"""
+        logger.info(f"Starting passthrough recording of {self.source_url} to {path}")
+        self.segment_list_offset = 0
+        try:
+            self.process = subprocess.Popen(
+                self.build_command(path),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+        except OSError as e:
+            logger.error(f"Error starting ffmpeg: {e}")
+            return False
+
+        # Wait briefly to catch a bad URL or a missing stream
+        self.process_start = time.time()
+        time.sleep(0.5)
+        if self.process.poll() is not None:
+            stderr = self.process.stderr.read().decode('utf-8', errors='replace').strip()
+            logger.error(f"Passthrough recording failed to start: {stderr}")
+            self.errors.append(stderr)
+            self.process = None
+            return False
+
+        self.process_path = path
+        self.base_counters = dict(self.stats)
+        threading.Thread(target=self._read_errors, args=(self.process,), daemon=True).start()
+        return True
+
+    def _stop_process(self, timeout):
+        """Ask ffmpeg to finish the file, killing it if it does not"""
+        process = self.process
+        if process is None:
+            return
+        try:
+            # 'q' makes ffmpeg write the trailer and exit cleanly
+            process.stdin.write(b'q')
+            process.stdin.flush()
+        except OSError:
+            pass
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.terminate()
+            try:
+                process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def _read_errors(self, process):
+        """Keep the last lines ffmpeg logs, so its pipe never fills"""
+        for line in process.stderr:
+            line = line.decode('utf-8', errors='replace').strip()
+            if line:
+                self.errors.append(line)
+                logger.warning(f"ffmpeg: {line}")
+
+    def _monitor_process(self):
+        """Follow ffmpeg's progress reports and restart it if it exits"""
+        while True:
+            process = self.process
+            progress = {}
+            for line in process.stdout:
+                key, _, value = line.decode('utf-8', errors='replace').strip().partition('=')
+                progress[key] = value
+                if key == "progress":
+                    self._update_stats(progress)
+                    self._collect_segments()
+
+            process.wait()
+            self._collect_segments()
+            if not self.segment_time:
+                self._segment_finished(self.process_path, self.process_start, time.time())
+            if not self.running:
+                break
+
+            # ffmpeg ended without being asked to, usually because the
+            # camera dropped the stream; continue in a new file
+            logger.warning(f"ffmpeg exited with code {process.returncode}, restarting recording")
+            with self.lock:
+                self.stats["restarts"] += 1
+            while self.running:
+                time.sleep(self.restart_delay)
+                path = self.path
+                if not self.segment_time:
+                    path = path.with_name(f"{path.stem}_{self.stats['restarts']}{path.suffix}")
+                if self.running and self._start_process(path):
+                    break
+            if not self.running:
+                # stop() may have missed a process started meanwhile
+                self._stop_process(5.0)
+                break
+
+    def _collect_segments(self):
+        """Report the segments ffmpeg has finished since the last call"""
+        if not self.segment_time:
+            return
+        try:
+            with open(self.segment_list) as f:
+                f.seek(self.segment_list_offset)
+                lines = f.read()
+        except FileNotFoundError:
+            return
+
+        # Only complete lines; ffmpeg may be writing the next one
+        complete = lines[:lines.rfind('\n') + 1]
+        self.segment_list_offset += len(complete)
+        for line in complete.splitlines():
+            try:
+                name, start, end = line.rsplit(',', 2)
+                start, end = float(start), float(end)
+            except ValueError:
+                logger.warning(f"Unexpected segment list entry: {line}")
+                continue
+            # The list times count from the start of the stream; the file
+            # name holds the wall-clock time ffmpeg opened the segment
+            match = RECORDING_NAME.match(name)
+            if match:
+                opened = time.mktime(time.strptime(match.group(1), "%Y%m%d_%H%M%S"))
+            else:
+                opened = self.process_start + start
+            self._segment_finished(self.path.parent / name, opened, opened + end - start)
+
+    def _segment_finished(self, path, start, end):
+        with self.lock:
+            self.files.append(path)
+            if self.segment_time:
+                # The segment muxer does not report sizes as it goes
+                try:
+                    self.stats["bytes"] += path.stat().st_size
+                except OSError:
+                    pass
+        if self.on_segment:
+            try:
+                self.on_segment(path, start, end)
+            except Exception as e:
+                logger.error(f"Error handling finished segment {path}: {e}")
+
+    def _update_stats(self, progress):
+        """Add one progress report to the counters of the current file"""
+        def number(key):
+            try:
+                return int(progress.get(key, 0))
+            except ValueError:
+                return 0
+        with self.lock:
+            base = self.base_counters
+            self.stats["seconds"] = base["seconds"] + number("out_time_us") / 1e6
+            self.stats["dropped"] = base["dropped"] + number("drop_frames")
+            if not self.segment_time:
+                self.stats["bytes"] = base["bytes"] + number("total_size")
+
+def segment_opener(directory, stream_type, fps, resolution, fourcc="mp4v"):
+    """Build a RecordingWriter open_writer function for OpenCV segments
+
+    Args:
+        directory: Recordings directory
+        stream_type (str): Stream name used in the file names
+        fps (float): Frame rate written to the files
+        resolution (tuple): (width, height) of the frames
+        fourcc (str): OpenCV codec
+    """
+    import cv2
+
+    def open_writer(start):
+        timestamp = datetime.datetime.fromtimestamp(start).strftime("%Y%m%d_%H%M%S")
+        path = Path(directory) / f"recording_{timestamp}_{stream_type}.mp4"
+        return cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*fourcc), fps, resolution), path
+    return open_writer
+
+if __name__ == "__main__":
+    # Set up logging for standalone testing
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    import tempfile
+    import numpy as np
+    from frame_hub import FrameHub
+
+    # 50 FPS capture stand-in
+    class MockCapture:
+        def isOpened(self):
+            return True
+        def get(self, prop):
+            return 0
+        def grab(self):
+            time.sleep(0.02)
+            return True
+        def read(self, image=None):
+            self.grab()
+            return True, image if image is not None else np.zeros((720, 1280, 3), np.uint8)
+        def release(self):
+            pass
+
+    # Encoder that is fast on average but stalls now and then, writing
+    # 100 KB per frame
+    class MockVideoWriter:
+        def __init__(self, path):
+            self.file = open(path, "wb")
+            self.frames = 0
+        def write(self, image):
+            self.frames += 1
+            self.file.write(bytes(100000))
+            time.sleep(0.3 if self.frames % 25 == 0 else 0.005)
+        def release(self):
+            self.file.close()
+
+    directory = Path(tempfile.mkdtemp())
+    index = RecordingIndex(directory)
+    retention = RetentionManager(index, max_bytes=12000000)
+
+    def open_writer(start):
+        timestamp = datetime.datetime.fromtimestamp(start).strftime("%Y%m%d_%H%M%S")
+        path = directory / f"recording_{timestamp}_{int(start * 1000) % 1000:03d}_main.mp4"
+        return MockVideoWriter(path), path
+
+    def segment_finished(path, start, end):
+        index.add(path, "main", start, end)
+        retention.enforce()
+
+    hub = FrameHub(MockCapture, slots=12, name="mock camera")
+    hub.start()
+    recorder = RecordingWriter(open_writer, queue_size=8, name="mock recording",
+                               segment_time=1.0, on_segment=segment_finished)
+    recorder.start()
+    hub.subscribe(recorder.submit)
+
+    # A display reads every frame while recording
+    reader = hub.reader("display")
+    end = time.time() + 5.0
+    while time.time() < end:
+        frame = reader.next(timeout=1.0)
+        if frame:
+            frame.release()
+
+    hub.unsubscribe(recorder.submit)
+    recorder.stop()
+    hub.stop()
+    print(f"Hub: {hub.get_stats()}")
+    print(f"Recorder: {recorder.get_stats()}")
+    print(f"Retention: {retention.stats}, {index.total_bytes()} bytes indexed")
+    for segment in RecordingIndex(directory).entries():
+        print(f"  {segment}")
+    shutil.rmtree(directory)
@@ -0,0 +1,575 @@
+#!/usr/bin/env python3
+"""
+RTSP server for the PTZ camera streams.
+Runs gst-rtsp-server in process with one shared media factory per mount
+point, so the camera is captured and encoded once no matter how many
+tablets are watching. Each mount is a gst-launch description from
+stream_pipeline ending in an RTP payloader named pay0. A mount can have
+aliases that share its media, and a mount with an input-selector named
+"selector" can switch inputs while viewers stay connected. Properties of
+named elements, such as the encoder bitrate or a capsfilter's caps, can be
+changed on the running pipeline.
+
+The GLib main loop runs in its own thread and context. Once a second it
+collects viewer sessions and the bytes sent to each, the frame counters of
+pad probes in each mount's pipeline, the encoder backlog, and the RTP
+sender statistics and RTCP receiver reports of the RTP session into a
+snapshot that the other threads read with get_stats(). A mount whose
+pipeline fails to start is reported to the failure callback.
+"""
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger('rtsp_server')
+
+# Try to import the GStreamer bindings
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    gi.require_version('GstRtspServer', '1.0')
+    gi.require_version('GstVideo', '1.0')
+    from gi.repository import Gst, GstRtspServer, GstVideo, GLib
+    HAS_GST = True
+except (ImportError, ValueError):
+    logger.warning("GStreamer Python bindings not available. RTSP server mode disabled.")
+    HAS_GST = False
+
+# Seconds from capture to the payloader after which a frame counts as late
+LATE_LATENCY = 0.2
+
+# RTP clock rate of H.264, the unit of RTCP jitter
+H264_CLOCK_RATE = 90000
+
+if HAS_GST:
+    class SharedMediaFactory(GstRtspServer.RTSPMediaFactory):
+        """Media factory that gives every URL it serves the same media
+
+        Mounted at several paths, all of them share one pipeline.
+        """
+
+        def __init__(self, key):
+            super().__init__()
+            self.key = key
+
+        def do_gen_key(self, url):
+            return self.key
+
+class MountCounters:
+    """Frame counters a mount's pipeline updates from its streaming threads"""
+
+    def __init__(self):
+        self.frames = 0
+        self.dropped = 0
+        self.late = 0
+        self.qos_events = 0
+        self.bytes = 0
+        self.latency_total = 0.0
+        self.latency_frames = 0
+        self.lock = threading.Lock()
+
+    def snapshot(self):
+        """Get the counters and the mean latency since the last snapshot
+
+        Returns:
+            tuple: (dict of cumulative counters, latency in seconds or None)
+        """
+        with self.lock:
+            latency = self.latency_total / self.latency_frames if self.latency_frames else None
+            self.latency_total = 0.0
+            self.latency_frames = 0
+            return {
+                "frames": self.frames,
+                "dropped": self.dropped,
+                "late": self.late,
+                "qos_events": self.qos_events,
+                "bytes": self.bytes
+            }, latency
+
+class RtspServer:
+    """gst-rtsp-server with shared media per mount point"""
+
+    def __init__(self, port=8554, poll_interval=1):
+        """Initialize the RTSP server
+
+        Args:
+            port (int): RTSP port
+            poll_interval (int): Seconds between statistics snapshots
+        """
+        if not HAS_GST:
+            raise RuntimeError("RTSP server needs the GStreamer Python bindings (python3-gi, "
+                               "gir1.2-gst-rtsp-server-1.0)")
+
+        self.port = port
+        self.poll_interval = poll_interval
+        self.mounts = {}  # path -> (launch description, alias paths)
+        self.media = {}  # path -> prepared RTSPMedia
+        self.active_inputs = {}  # path -> selected input-selector pad
+        self.properties = {}  # path -> {(element name, property): value}
+        self.counters = {}  # path -> MountCounters of the prepared media
+        self.prepared = set()  # media that finished preparing
+        self.sender_bytes = {}  # path -> (octets sent, time) at the last poll
+        self.session_bytes = {}  # (session id, path) -> (bytes sent, time) at the last poll
+        self.failure_callback = None
+        self.server = None
+        self.context = None
+        self.loop = None
+        self.loop_thread = None
+        self.stats = {"viewers": 0, "sessions": [], "mounts": {}}
+        self.lock = threading.Lock()
+
+    def add_mount(self, path, launch, aliases=()):
+        """Serve a pipeline at a mount point; call before start()
+
+        Args:
+            path (str): Mount path, e.g. "/rgb"
+            launch (str): gst-launch description with a payloader named pay0
+            aliases (tuple): Further paths served by the same media
+        """
+        self.mounts[path] = (launch, tuple(aliases))
+
+    def select_input(self, path, index):
+        """Switch a mount's input-selector to another input
+
+        The choice is kept and applied whenever the mount's media is
+        prepared again.
+
+        Args:
+            path (str): Mount path
+            index (int): Selector input, sink_<index>
+
+        Returns:
+            bool: True if a running stream switched
+        """
+        with self.lock:
+            self.active_inputs[path] = index
+            media = self.media.get(path)
+        if media is None:
+            return False
+        return self._activate_input(media, index)
+
+    def set_property(self, path, element_name, name, value):
+        """Change a property of a named element in a mount's pipeline
+
+        The value is kept and applied whenever the mount's media is
+        prepared again.
+
+        Args:
+            path (str): Mount path
+            element_name (str): Element name in the launch description
+            name (str): Property name
+            value: Property value; caps and structure properties take
+                their string description
+
+        Returns:
+            bool: True if a running stream changed
+        """
+        with self.lock:
+            self.properties.setdefault(path, {})[(element_name, name)] = value
+            media = self.media.get(path)
+        if media is None:
+            return False
+        return self._apply_property(media, element_name, name, value)
+
+    def set_failure_callback(self, callback):
+        """Set callback function for mounts whose pipeline fails to start
+
+        Args:
+            callback: Function to call with the mount path, from the main
+                loop thread
+        """
+        self.failure_callback = callback
+
+    def start(self):
+        """Start serving in the main loop thread"""
+        Gst.init(None)
+
+        self.server = GstRtspServer.RTSPServer()
+        self.server.set_service(str(self.port))
+        mount_points = self.server.get_mount_points()
+        for path, (launch, aliases) in self.mounts.items():
+            factory = SharedMediaFactory(path)
+            factory.set_launch(f"( {launch} )")
+            # One pipeline per mount, shared by every viewer
+            factory.set_shared(True)
+            factory.connect("media-configure", self._on_media_configure, path)
+            for mount in (path,) + aliases:
+                mount_points.add_factory(mount, factory)
+
+        self.context = GLib.MainContext.new()
+        self.loop = GLib.MainLoop.new(self.context, False)
+        self.server.attach(self.context)
+
+        poll = GLib.timeout_source_new_seconds(self.poll_interval)
+        poll.set_callback(self._poll)
+        poll.attach(self.context)
+
+        self.loop_thread = threading.Thread(target=self.loop.run)
+        self.loop_thread.daemon = True
+        self.loop_thread.start()
+        logger.info(f"RTSP server listening on port {self.port}, mounts {', '.join(self.mounts)}")
+
+    def stop(self):
+        """Disconnect all viewers and stop the main loop"""
+        if not self.loop:
+            return
+
+        self.context.invoke_full(GLib.PRIORITY_DEFAULT, self._shutdown)
+        self.loop_thread.join(timeout=5.0)
+        self.loop = None
+        self.server = None
+        with self.lock:
+            self.media = {}
+            self.counters = {}
+            self.prepared = set()
+            self.sender_bytes = {}
+            self.session_bytes = {}
+            self.stats = {"viewers": 0, "sessions": [], "mounts": {}}
+        logger.info("RTSP server stopped")
+
+    def get_media(self, path):
+        """Get the prepared media of a mount, None while nobody is watching"""
+        with self.lock:
+            return self.media.get(path)
+
+    def get_stats(self):
+        """Get the last statistics snapshot
+
+        Returns:
+            dict: viewers (active sessions); sessions (session id, client
+                address, mount, bytes_sent and bitrate in kbit/s sent to
+                it, None when it receives over the RTSP TCP connection, and
+                the loss, jitter and round-trip time of its receiver
+                reports); and per mount the
+                cumulative frames, dropped, late, qos_events, bytes and
+                bytes_sent counters, sent_bitrate, mean latency_ms, encoder
+                backlog and the worst viewer's loss, jitter_ms and rtt_ms
+        """
+        with self.lock:
+            return {
+                "viewers": self.stats["viewers"],
+                "sessions": [dict(session) for session in self.stats["sessions"]],
+                "mounts": {path: dict(values) for path, values in self.stats["mounts"].items()}
+            }
+
+    def _on_media_configure(self, factory, media, path):
+        """Remember the shared media of a mount while it is prepared"""
+        logger.info(f"Preparing stream for {path}")
+        counters = MountCounters()
+        with self.lock:
+            self.media[path] = media
+            self.counters[path] = counters
+            index = self.active_inputs.get(path)
+            properties = dict(self.properties.get(path, {}))
+        media.connect("prepared", self._on_media_prepared)
+        media.connect("unprepared", self._on_media_unprepared, path)
+        self._instrument(media, counters)
+        for (element_name, name), value in properties.items():
+            self._apply_property(media, element_name, name, value)
+        if index is not None:
+            self._activate_input(media, index)
+
+    def _on_media_prepared(self, media):
+        """Note that a media's pipeline is streaming"""
+        with self.lock:
+            self.prepared.add(media)
+
+    def _on_media_unprepared(self, media, path):
+        """Forget a mount's media after its last viewer left or it failed"""
+        with self.lock:
+            started = media in self.prepared
+            self.prepared.discard(media)
+            if self.media.get(path) is media:
+                del self.media[path]
+                self.counters.pop(path, None)
+                self.sender_bytes.pop(path, None)
+
+        if started:
+            logger.info(f"Stream for {path} stopped, no viewers left")
+            return
+
+        # Unprepared without ever prerolling: an element of the pipeline
+        # could not start, e.g. an encoder that cannot take the camera's
+        # frames
+        logger.error(f"Stream for {path} failed to start")
+        if self.failure_callback:
+            try:
+                self.failure_callback(path)
+            except Exception as e:
+                logger.error(f"Error in failure callback: {e}")
+
+    def _instrument(self, media, counters):
+        """Count frames, drops, late frames and QoS events of a mount"""
+        element = media.get_element()
+        payloader = element.get_by_name("pay0")
+        payloader.get_static_pad("sink").add_probe(
+            Gst.PadProbeType.BUFFER, self._on_encoded_frame, payloader, counters
+        )
+
+        queue = element.get_by_name("encoder_queue")
+        if queue:
+            # The leaky queue signals overrun once for each frame it drops
+            queue.connect("overrun", self._on_encoder_overrun, counters)
+
+        encoder = element.get_by_name("encoder")
+        if encoder:
+            encoder.get_static_pad("src").add_probe(
+                Gst.PadProbeType.EVENT_UPSTREAM, self._on_upstream_event, counters
+            )
+
+    def _on_encoded_frame(self, pad, info, payloader, counters):
+        """Count an encoded frame and how long after capture it arrived"""
+        buffer = info.get_buffer()
+        latency = None
+        if buffer.pts != Gst.CLOCK_TIME_NONE:
+            running_time = payloader.get_current_running_time()
+            if running_time != Gst.CLOCK_TIME_NONE and running_time >= buffer.pts:
+                latency = (running_time - buffer.pts) / Gst.SECOND
+
+        with counters.lock:
+            counters.frames += 1
+            counters.bytes += buffer.get_size()
+            if latency is not None:
+                counters.latency_total += latency
+                counters.latency_frames += 1
+                if latency > LATE_LATENCY:
+                    counters.late += 1
+        return Gst.PadProbeReturn.OK
+
+    def _on_encoder_overrun(self, queue, counters):
+        """Count a frame dropped in front of the busy encoder"""
+        with counters.lock:
+            counters.dropped += 1
+
+    def _on_upstream_event(self, pad, info, counters):
+        """Count QoS events reporting late frames downstream of the encoder"""
+        event = info.get_event()
+        if event.type == Gst.EventType.QOS:
+            _, _, diff, _ = event.parse_qos()
+            if diff > 0:
+                with counters.lock:
+                    counters.qos_events += 1
+        return Gst.PadProbeReturn.OK
+
+    def _apply_property(self, media, element_name, name, value):
+        """Set a property on an element of a media's pipeline"""
+        element = media.get_element().get_by_name(element_name)
+        if element is None:
+            logger.warning(f"Stream has no element {element_name}")
+            return False
+
+        value_type = element.find_property(name).value_type
+        if value_type == Gst.Caps.__gtype__:
+            value = Gst.Caps.from_string(value)
+        elif value_type == Gst.Structure.__gtype__:
+            value = Gst.Structure.new_from_string(value)
+        element.set_property(name, value)
+        return True
+
+    def _activate_input(self, media, index):
+        """Make a selector input active and ask for a keyframe"""
+        element = media.get_element()
+        selector = element.get_by_name("selector")
+        pad = selector.get_static_pad(f"sink_{index}") if selector else None
+        if pad is None:
+            logger.warning(f"Stream has no selector input {index}")
+            return False
+
+        selector.set_property("active-pad", pad)
+        # Viewers can decode the new input from the next frame on instead of
+        # waiting for the encoder's next scheduled keyframe
+        payloader = element.get_by_name("pay0")
+        payloader.get_static_pad("sink").send_event(
+            GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0)
+        )
+        return True
+
+    def _shutdown(self, *args):
+        """Close every client and quit the loop (main loop thread)"""
+        self.server.client_filter(lambda server, client: GstRtspServer.RTSPFilterResult.REMOVE)
+        self.loop.quit()
+        return False
+
+    def _poll(self, *args):
+        """Expire dead sessions and snapshot statistics (main loop thread)"""
+        pool = self.server.get_session_pool()
+        pool.cleanup()
+
+        with self.lock:
+            media_paths = {media: path for path, media in self.media.items()}
+
+        now = time.monotonic()
+        mounts = {}
+        receivers = {}
+        sinks = {}
+        for media, path in media_paths.items():
+            sinks[path] = self._udp_sinks(media)
+            sources = self._source_stats(media)
+            mounts[path] = self._measure(path, media, sources, now)
+            receivers[path] = self._receiver_reports(sources)
+            if receivers[path]:
+                for name in ("loss", "jitter_ms", "rtt_ms"):
+                    mounts[path][name] = max(report[name] for report in receivers[path].values())
+
+        sessions = []
+        session_bytes = {}
+        for session in pool.filter(None):
+            for session_media in session.filter(None):
+                path = media_paths.get(session_media.get_media())
+                if path is None:
+                    continue
+                address, port = self._client_destination(session_media.get_transport(0))
+                report = receivers[path].get(address, {"loss": None, "jitter_ms": None, "rtt_ms": None})
+
+                key = (session.get_sessionid(), path)
+                sent = self._client_bytes(sinks[path], address, port)
+                bitrate = None
+                if sent is not None:
+                    session_bytes[key] = (sent, now)
+                    last = self.session_bytes.get(key)
+                    bitrate = 0
+                    if last is not None and now > last[1] and sent >= last[0]:
+                        bitrate = round((sent - last[0]) * 8 / (now - last[1]) / 1000)
+
+                sessions.append({
+                    "session": key[0],
+                    "address": address,
+                    "mount": path,
+                    "bytes_sent": sent,
+                    "bitrate": bitrate,
+                    **report
+                })
+        self.session_bytes = session_bytes
+
+        with self.lock:
+            self.stats = {"viewers": len(sessions), "sessions": sessions, "mounts": mounts}
+        return True
+
+    def _measure(self, path, media, sources, now):
+        """Collect a mount's counters and gauges (main loop thread)"""
+        with self.lock:
+            counters = self.counters.get(path)
+        if counters:
+            values, latency = counters.snapshot()
+        else:
+            values, latency = MountCounters().snapshot()
+
+        octets = 0
+        for source in sources:
+            if source.get_value("internal") and source.get_value("is-sender"):
+                octets += source.get_value("octets-sent")
+        last = self.sender_bytes.get(path)
+        self.sender_bytes[path] = (octets, now)
+        if last is None or now <= last[1] or octets < last[0]:
+            sent_bitrate = 0
+        else:
+            sent_bitrate = round((octets - last[0]) * 8 / (now - last[1]) / 1000)
+
+        queue = media.get_element().get_by_name("encoder_queue")
+        values.update({
+            "bytes_sent": octets,
+            "sent_bitrate": sent_bitrate,
+            "latency_ms": round(latency * 1000, 1) if latency is not None else None,
+            "backlog": queue.get_property("current-level-buffers") if queue else None,
+            "loss": None,
+            "jitter_ms": None,
+            "rtt_ms": None
+        })
+        return values
+
+    def _receiver_reports(self, sources):
+        """Loss, jitter and round-trip time each viewer last reported
+
+        Returns:
+            dict: Viewer address -> loss (fraction), jitter_ms and rtt_ms
+        """
+        reports = {}
+        for source in sources:
+            if source.get_value("internal") or not source.get_value("have-rb"):
+                continue
+            address = (source.get_value("rtcp-from") or "").rsplit(":", 1)[0]
+            reports[address] = {
+                "loss": round(source.get_value("rb-fractionlost") / 256, 3),
+                "jitter_ms": round(source.get_value("rb-jitter") * 1000 / H264_CLOCK_RATE, 1),
+                # Round-trip time is in 1/65536 seconds
+                "rtt_ms": round(source.get_value("rb-round-trip") * 1000 / 65536, 1)
+            }
+        return reports
+
+    def _source_stats(self, media):
+        """Per-SSRC statistics of the media's first stream"""
+        stream = media.get_stream(0)
+        rtpsession = stream.get_rtpsession() if stream else None
+        if rtpsession is None:
+            return []
+        return rtpsession.get_property("stats").get_value("source-stats") or []
+
+    def _udp_sinks(self, media):
+        """multiudpsink elements gst-rtsp-server added to the media's pipeline"""
+        pipeline = media.get_element().get_parent()
+        if pipeline is None:
+            return []
+        return [element for element in pipeline.iterate_recurse()
+                if element.get_factory() and element.get_factory().get_name() == "multiudpsink"]
+
+    def _client_destination(self, transport):
+        """Address and RTP port the client asked the stream to be sent to"""
+        if transport is None:
+            return None, None
+        rtsp_transport = transport.get_transport()
+        client_port = rtsp_transport.client_port
+        return rtsp_transport.destination, client_port.min if client_port else None
+
+    def _client_bytes(self, sinks, address, port):
+        """RTP bytes a UDP sink has sent to one client
+
+        Returns:
+            int: Bytes sent, None if no sink sends to the client, which is
+                the case when it receives over the RTSP TCP connection
+        """
+        if not address or not port:
+            return None
+        for sink in sinks:
+            stats = sink.emit("get-stats", address, port)
+            # An unknown client gets an empty structure
+            if stats is not None and stats.has_field("bytes-sent"):
+                return stats.get_value("bytes-sent")
+        return None
+
+if __name__ == "__main__":
+    # Set up logging for standalone testing
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # Serve test patterns; watch with e.g. ffplay rtsp://127.0.0.1:8554/rgb from several terminals
+    server = RtspServer()
+    for path, pattern in (("/rgb", "smpte"), ("/ir", "snow")):
+        server.add_mount(path, f"videotestsrc is-live=true pattern={pattern} ! "
+                               f"video/x-raw,width=640,height=480,framerate=30/1 ! videoconvert ! "
+                               f"x264enc tune=zerolatency bitrate=500 speed-preset=superfast ! "
+                               f"rtph264pay name=pay0 pt=96 config-interval=1")
+    # /live switches between two patterns every 5 seconds without reconnecting
+    server.add_mount("/live", "input-selector name=selector ! videoconvert ! "
+                              "x264enc tune=zerolatency bitrate=500 speed-preset=superfast ! "
+                              "rtph264pay name=pay0 pt=96 config-interval=1 "
+                              "videotestsrc is-live=true pattern=ball ! "
+                              "video/x-raw,width=640,height=480,framerate=30/1 ! selector.sink_0 "
+                              "videotestsrc is-live=true pattern=pinwheel ! "
+                              "video/x-raw,width=640,height=480,framerate=30/1 ! selector.sink_1")
+    server.start()
+
+    try:
+        print("Press Ctrl+C to stop...")
+        live_input = 0
+        while True:
+            time.sleep(5)
+            live_input = 1 - live_input
+            print(f"/live switched to input {live_input}: {server.select_input('/live', live_input)}")
+            print(f"RTSP stats: {server.get_stats()}")
+    except KeyboardInterrupt:
+        print("Test interrupted")
+    finally:
+        server.stop()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Serial writer for Pelco-D frames.
+This module moves serial writes off the caller's thread: frames are queued
+and written by a dedicated I/O thread as fast as the baud rate allows.
+Queued motion frames for the same address are replaced by newer ones so
+joystick updates never back up behind stale state.
+
+Frames are queued per channel (normally the camera address) and channels
+are served round-robin, so one busy camera cannot starve the others on a
+shared bus. Urgent frames such as stop commands bypass the round-robin,
+and background frames such as position queries are only sent when nothing
+else is waiting.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger('serial_writer')
+
+class SerialWriter:
+    """Writes frames to a serial port from a dedicated I/O thread"""
+
+    def __init__(self, port, max_queue=64, reply_timeout=0.05):
+        """Initialize the serial writer
+
+        Args:
+            port: Open serial port (any object with write() and flush())
+            max_queue (int): Maximum number of frames waiting per channel
+            reply_timeout (float): Seconds the bus is left quiet after a
+                frame that expects a reply, so the half-duplex line is free
+                for the camera to answer
+        """
+        self.port = port
+        self.max_queue = max_queue
+        self.channels = {}  # channel -> deque of queued entries
+        self.active = deque()  # channels with queued frames, in service order
+        self.urgent = deque()
+        self.background = deque()
+        self.background_keys = set()
+        self.pending = {}  # channel -> queued coalescable entry
+        self.queued = 0
+        self.writing = False
+        self.condition = threading.Condition()
+        self.running = False
+        self.writer_thread = None
+        self.reply_timeout = reply_timeout
+        self.reply_received = threading.Event()
+        self.frames_written = 0
+        self.frames_coalesced = 0
+        self.frames_dropped = 0
+        self.write_errors = 0
+
+    def start(self):
+        """Start the writer thread"""
+        if self.running:
+            logger.warning("Serial writer is already running")
+            return
+
+        self.running = True
+        self.writer_thread = threading.Thread(target=self._writer_loop)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+        logger.info("Serial writer started")
+
+    def stop(self, timeout=2.0):
+        """Stop the writer thread after sending any queued frames"""
+        if not self.running:
+            return
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        if self.writer_thread:
+            self.writer_thread.join(timeout=timeout)
+        logger.info("Serial writer stopped")
+
+    def send(self, frame, channel=None, coalesce=False, urgent=False,
+             background=False, expect_reply=False, timeout=1.0):
+        """Queue a frame for sending
+
+        Args:
+            frame (bytes): Complete frame to write
+            channel: Queue the frame belongs to, normally the camera address
+            coalesce (bool): Replace a queued-but-unsent coalescable frame on
+                the same channel instead of queueing behind it; a queued
+                urgent frame is never replaced
+            urgent (bool): Send ahead of all round-robin traffic
+            background (bool): Send only when no other frame is waiting; an
+                identical background frame already queued is not repeated
+            expect_reply (bool): Keep the bus quiet after sending until a
+                reply is signalled with notify_reply() or reply_timeout passes
+            timeout (float): Seconds to wait for queue space, None to block
+
+        Returns:
+            bool: True if the frame was queued, False if it was dropped
+        """
+        with self.condition:
+            if not self.running:
+                logger.warning("Serial writer is not running, frame dropped")
+                self.frames_dropped += 1
+                return False
+
+            if background:
+                key = (channel, frame)
+                if key in self.background_keys:
+                    self.frames_coalesced += 1
+                    return True
+
+                if len(self.background) >= self.max_queue:
+                    self.frames_dropped += 1
+                    return False
+
+                self.background_keys.add(key)
+                self.background.append([channel, frame, False, expect_reply, key])
+                self.queued += 1
+                self.condition.notify_all()
+                return True
+
+            if coalesce:
+                entry = self.pending.get(channel)
+                # A queued urgent frame (a stop) is never replaced; a newer
+                # frame is queued behind it instead
+                if entry is not None and not entry[2]:
+                    if not urgent:
+                        entry[1] = frame
+                        self.frames_coalesced += 1
+                        return True
+
+                    # The queued motion frame is superseded, but this one has
+                    # to jump the round-robin, so cancel it and queue urgently
+                    entry[1] = None
+                    self.frames_coalesced += 1
+
+            if urgent:
+                entry = [channel, frame, True, expect_reply, None]
+                self.urgent.append(entry)
+            else:
+                queue = self.channels.get(channel)
+                if queue is None:
+                    queue = self.channels[channel] = deque()
+
+                if len(queue) >= self.max_queue:
+                    deadline = None if timeout is None else time.monotonic() + timeout
+                    while len(queue) >= self.max_queue and self.running:
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            logger.warning(f"Serial write queue full for {channel}, frame dropped")
+                            self.frames_dropped += 1
+                            return False
+                        self.condition.wait(remaining)
+
+                entry = [channel, frame, False, expect_reply, None]
+                if not queue:
+                    self.active.append(channel)
+                queue.append(entry)
+
+            if coalesce:
+                self.pending[channel] = entry
+            self.queued += 1
+            self.condition.notify_all()
+            return True
+
+    def notify_reply(self):
+        """Signal that the reply to the last frame has been received"""
+        self.reply_received.set()
+
+    def wait_idle(self, timeout=None):
+        """Wait until all queued frames have been written
+
+        Returns:
+            bool: True if the queue drained before the timeout
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not self.queued and not self.writing, timeout)
+
+    def get_stats(self):
+        """Get writer statistics"""
+        with self.condition:
+            return {
+                "queued": self.queued,
+                "written": self.frames_written,
+                "coalesced": self.frames_coalesced,
+                "dropped": self.frames_dropped,
+                "errors": self.write_errors
+            }
+
+    def _next_entry(self):
+        """Take the next entry to send: urgent, then round-robin, then background"""
+        if self.urgent:
+            return self.urgent.popleft()
+
+        if not self.active:
+            entry = self.background.popleft()
+            self.background_keys.discard(entry[4])
+            return entry
+
+        channel = self.active.popleft()
+        queue = self.channels[channel]
+        entry = queue.popleft()
+        if queue:
+            self.active.append(channel)
+        return entry
+
+    def _writer_loop(self):
+        """Write queued frames until stopped and the queue is empty"""
+        while True:
+            with self.condition:
+                while not self.queued and self.running:
+                    self.condition.wait()
+
+                if not self.queued:
+                    break
+
+                entry = self._next_entry()
+                self.queued -= 1
+                channel, frame, _, expect_reply, _ = entry
+                if self.pending.get(channel) is entry:
+                    del self.pending[channel]
+
+                if frame is None:
+                    # Cancelled by a newer urgent frame
+                    self.condition.notify_all()
+                    continue
+                self.writing = True
+
+            try:
+                self.reply_received.clear()
+                self.port.write(frame)
+                # Wait for the bytes to leave the adapter so that newer motion
+                # frames can still replace queued ones instead of piling up in
+                # the OS buffer
+                self.port.flush()
+                written = True
+            except Exception as e:
+                logger.error(f"Error writing serial frame: {e}")
+                written = False
+
+            if written and expect_reply:
+                self.reply_received.wait(self.reply_timeout)
+
+            with self.condition:
+                if written:
+                    self.frames_written += 1
+                else:
+                    self.write_errors += 1
+                self.writing = False
+                self.condition.notify_all()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+GStreamer pipeline construction for the PTZ camera video stream.
+Picks the best H.264 encoder the board has and builds the capture and
+encode part of the pipeline around it. Hardware encoders get caps that keep
+frames in DMA or NVMM buffers from the camera to the encoder, so a Pi 4 or
+a Jetson can stream 1080p30 without saturating the CPU; x264enc is the
+software fallback everywhere else.
+
+Probing runs gst-inspect-1.0 once per element and caches the result for the
+life of the process.
+"""
+
+import logging
+import threading
+import subprocess
+
+logger = logging.getLogger('stream_pipeline')
+
+# H.264 encoders in order of preference
+ENCODERS = (
+    "v4l2h264enc",    # Raspberry Pi (bcm2835-codec) and other V4L2 M2M codecs
+    "nvv4l2h264enc",  # NVIDIA Jetson
+    "omxh264enc",     # Older Raspberry Pi OS and Jetson images
+    "x264enc"         # Software
+)
+
+SOFTWARE_ENCODER = "x264enc"
+
+_available = {}  # element name -> bool
+_failed = set()  # encoders whose pipeline failed to start
+_lock = threading.Lock()
+
+def element_available(name, gst_inspect="gst-inspect-1.0"):
+    """Check once whether a GStreamer element is installed
+
+    Args:
+        name (str): Element name
+        gst_inspect (str): gst-inspect executable
+
+    Returns:
+        bool: True if gst-inspect knows the element
+    """
+    with _lock:
+        if name in _available:
+            return _available[name]
+
+    try:
+        result = subprocess.run(
+            [gst_inspect, "--exists", name],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=10
+        )
+        available = result.returncode == 0
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Could not probe GStreamer element {name}: {e}")
+        available = False
+
+    with _lock:
+        _available[name] = available
+    logger.info(f"GStreamer element {name} {'found' if available else 'not available'}")
+    return available
+
+def probe_encoder(preferred="auto"):
+    """Pick the H.264 encoder to use
+
+    Args:
+        preferred (str): Encoder element, or "auto" for the first available
+            one in ENCODERS
+
+    Returns:
+        str: Encoder element name
+    """
+    if preferred != "auto":
+        return preferred
+
+    for encoder in ENCODERS:
+        with _lock:
+            if encoder in _failed:
+                continue
+        if encoder == SOFTWARE_ENCODER or element_available(encoder):
+            return encoder
+    return SOFTWARE_ENCODER
+
+def mark_failed(encoder):
+    """Skip an encoder in later probes after its pipeline failed to start
+
+    Returns:
+        bool: True if there is another encoder to fall back to
+    """
+    if encoder == SOFTWARE_ENCODER:
+        return False
+    with _lock:
+        _failed.add(encoder)
+    logger.warning(f"Encoder {encoder} failed, falling back")
+    return True
+
+def build_source(encoder, device, width, height, framerate):
+    """Build the camera capture elements as gst-launch arguments
+
+    Args:
+        encoder (str): Encoder the frames are for, from probe_encoder()
+        device (str): V4L2 camera device
+        width (int): Frame width
+        height (int): Frame height
+        framerate (int): Frames per second
+
+    Returns:
+        list: gst-launch-1.0 arguments ending in raw video caps and "!"
+    """
+    # The camera's DMA buffers are handed straight to a V4L2 codec
+    io_mode = ["io-mode=dmabuf"] if encoder == "v4l2h264enc" else []
+    return [
+        "v4l2src", f"device={device}", *io_mode, "!",
+        f"video/x-raw,width={width},height={height},framerate={framerate}/1", "!"
+    ]
+
+def quality_caps(encoder, width, height, framerate):
+    """Caps of the capsfilter named "quality_caps" in front of the encoder
+
+    Setting this filter's caps on a running pipeline changes the encoded
+    frame size and rate without a restart.
+
+    Args:
+        encoder (str): Encoder element from probe_encoder()
+        width (int): Encoded frame width
+        height (int): Encoded frame height
+        framerate (int): Encoded frames per second
+
+    Returns:
+        str: Caps description
+    """
+    if encoder == "nvv4l2h264enc":
+        return (f"video/x-raw(memory:NVMM),format=NV12,width={width},height={height},"
+                f"framerate={framerate}/1")
+    return f"video/x-raw,width={width},height={height},framerate={framerate}/1"
+
+def _v4l2_controls(bitrate, framerate):
+    """extra-controls of v4l2h264enc
+
+    Setting the property replaces every control, so all of them are
+    always given together.
+
+    Args:
+        bitrate (int): Target bitrate in kbit/s
+        framerate (int): Encoded frames per second, also the keyframe interval
+
+    Returns:
+        str: GstStructure description of the V4L2 controls
+    """
+    return (f"controls,video_bitrate={bitrate * 1000},h264_i_frame_period={framerate},"
+            f"repeat_sequence_header=1")
+
+def bitrate_setting(encoder, bitrate, framerate):
+    """Encoder property that changes the bitrate while encoding
+
+    The encoder is the element named "encoder".
+
+    Args:
+        encoder (str): Encoder element from probe_encoder()
+        bitrate (int): Target bitrate in kbit/s
+        framerate (int): Encoded frames per second, for encoders that take
+            the keyframe interval in the same property
+
+    Returns:
+        tuple: (property name, value); for v4l2h264enc the value is a
+            GstStructure description of the V4L2 controls
+    """
+    if encoder == "v4l2h264enc":
+        return "extra-controls", _v4l2_controls(bitrate, framerate)
+    if encoder == "nvv4l2h264enc":
+        return "bitrate", bitrate * 1000
+    if encoder == "omxh264enc":
+        return "target-bitrate", bitrate * 1000
+    return "bitrate", bitrate
+
+def build_encoder(encoder, width, height, framerate, bitrate):
+    """Build the encode elements as gst-launch arguments
+
+    Frames are scaled and their rate reduced to the quality_caps() in
+    front of the encoder, a passthrough while they match the capture
+    settings. The result ends in parsed H.264 with SPS/PPS repeated on
+    every keyframe, ready for a payloader or muxer.
+
+    Args:
+        encoder (str): Encoder element from probe_encoder()
+        width (int): Encoded frame width
+        height (int): Encoded frame height
+        framerate (int): Encoded frames per second, also the keyframe interval
+        bitrate (int): Target bitrate in kbit/s
+
+    Returns:
+        list: gst-launch-1.0 arguments
+    """
+    caps = ["capsfilter", "name=quality_caps", f'caps="{quality_caps(encoder, width, height, framerate)}"', "!"]
+
+    if encoder == "v4l2h264enc":
+        # The ISP scales in hardware and hands the encoder DMA buffers
+        pipeline = ["v4l2convert", "capture-io-mode=dmabuf", "!"] + caps + [
+            "v4l2h264enc", "name=encoder", "output-io-mode=dmabuf-import",
+            f'extra-controls="{_v4l2_controls(bitrate, framerate)}"', "!",
+            # Level 4 is needed for 1080p30
+            "video/x-h264,level=(string)4", "!"
+        ]
+    elif encoder == "nvv4l2h264enc":
+        # nvvidconv scales and moves frames into NVMM memory once; the
+        # encoder reads them there
+        pipeline = ["nvvidconv", "!"] + caps + [
+            "nvv4l2h264enc", "name=encoder", f"bitrate={bitrate * 1000}", f"iframeinterval={framerate}",
+            "insert-sps-pps=true", "!"
+        ]
+    elif encoder == "omxh264enc":
+        pipeline = ["videoscale", "!", "videoconvert", "!"] + caps + [
+            "omxh264enc", "name=encoder", f"target-bitrate={bitrate * 1000}", "control-rate=variable", "!",
+            "video/x-h264,profile=baseline", "!"
+        ]
+    else:
+        pipeline = ["videoscale", "!", "videoconvert", "!"] + caps + [
+            encoder, "name=encoder", "tune=zerolatency", f"bitrate={bitrate}", "speed-preset=superfast",
+            f"key-int-max={framerate}", "!"
+        ]
+
+    # Frames waiting for a busy encoder are dropped rather than piling up
+    # as latency; the queue's level is the encoder backlog
+    backlog = [
+        "queue", "name=encoder_queue", "max-size-buffers=3", "max-size-bytes=0", "max-size-time=0",
+        "leaky=downstream", "!",
+        "videorate", "drop-only=true", "!"
+    ]
+    return backlog + pipeline + ["h264parse", "config-interval=-1", "!"]
+
+def build_encode_pipeline(encoder, device, width, height, framerate, bitrate, output=None):
+    """Build the capture and encode elements for one camera
+
+    Args:
+        encoder (str): Encoder element from probe_encoder()
+        device (str): V4L2 camera device
+        width (int): Frame width
+        height (int): Frame height
+        framerate (int): Frames per second
+        bitrate (int): Target bitrate in kbit/s
+        output (tuple): (width, height, framerate) to encode at, None for
+            the capture settings
+
+    Returns:
+        list: gst-launch-1.0 pipeline arguments
+    """
+    return (build_source(encoder, device, width, height, framerate) +
+            build_encoder(encoder, *(output or (width, height, framerate)), bitrate))
+
+def build_selector_pipeline(encoder, devices, width, height, framerate, bitrate, output=None):
+    """Build a pipeline that captures several cameras into one encoder
+
+    Every camera keeps capturing; an input-selector named "selector" picks
+    the one that is encoded, so switching is a pad change rather than a
+    pipeline restart. Each camera is brought to the same frame rate, size
+    and format, so a switch does not change what the viewers receive.
+    Hardware encoders get their own converter on every input, which keeps
+    the frames in DMA or NVMM buffers; the software converters are a
+    passthrough for a camera that already delivers the encoder's format.
+
+    Args:
+        encoder (str): Encoder element from probe_encoder()
+        devices (list): V4L2 camera devices, input i is selector pad sink_i
+        width (int): Frame width
+        height (int): Frame height
+        framerate (int): Frames per second
+        bitrate (int): Target bitrate in kbit/s
+        output (tuple): (width, height, framerate) to encode at, None for
+            the capture settings
+
+    Returns:
+        list: gst-launch-1.0 pipeline arguments
+    """
+    pipeline = ["input-selector", "name=selector", "!"] + build_encoder(
+        encoder, *(output or (width, height, framerate)), bitrate
+    )
+    # Both inputs negotiate the same caps; a format every encoder takes
+    caps = quality_caps(encoder, width, height, framerate)
+    if encoder == "v4l2h264enc":
+        convert = ["v4l2convert", "capture-io-mode=dmabuf", "!", f"{caps},format=I420", "!"]
+    elif encoder == "nvv4l2h264enc":
+        convert = ["nvvidconv", "!", caps, "!"]
+    else:
+        convert = ["videoscale", "!", "videoconvert", "!", f"{caps},format=I420", "!"]
+
+    # The payloader or sink the caller appends links to the encoder chain,
+    # so the camera branches go in front of it
+    branches = []
+    for index, device in enumerate(devices):
+        source = build_source(encoder, device, width, height, framerate)
+        # The camera runs at whatever it supports; videorate only drops or
+        # repeats buffers to reach the common rate, it does not touch pixels
+        branches += source[:-2] + ["videorate", "!"] + convert + [
+            "queue", "max-size-buffers=2", "leaky=downstream", "!",
+            f"selector.sink_{index}"
+        ]
+    return branches + pipeline
+
+if __name__ == "__main__":
+    # Set up logging for standalone testing
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    encoder = probe_encoder()
+    print(f"Selected encoder: {encoder} (probed again: {probe_encoder()})")
+    for name in ENCODERS:
+        print(f"{name}: {' '.join(build_encode_pipeline(name, '/dev/video0', 1920, 1080, 30, 4000))}")
+    print(f"Selector: {' '.join(build_selector_pipeline(encoder, ['/dev/video0', '/dev/video1'], 1920, 1080, 30, 4000))}")
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Stream quality telemetry for the PTZ camera video stream.
+Turns the cumulative counters and instantaneous gauges measured in the
+streaming pipeline into a time series of per-interval samples: frames
+encoded and dropped, late frames, QoS events, encoded and sent bitrate,
+encoder backlog and latency, and the loss, jitter and round-trip time the
+viewers report in RTCP receiver reports. Quality decisions are taken on
+windows of this series rather than on single readings.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger('stream_telemetry')
+
+# Cumulative counters; samples hold their increase over the interval
+COUNTERS = ("frames", "dropped", "late", "qos_events", "bytes", "bytes_sent")
+
+# Gauges that are averaged over a window, the rest report the worst value
+AVERAGED = ("fps", "bitrate", "sent_bitrate", "latency_ms")
+
+class StreamTelemetry:
+    """Time series of stream measurements"""
+
+    def __init__(self, history=300):
+        """Initialize the series
+
+        Args:
+            history (int): Samples to keep
+        """
+        self.samples = deque(maxlen=history)
+        self.last_counters = None
+        self.last_time = None
+        self.lock = threading.Lock()
+
+    def record(self, counters, gauges=None):
+        """Add a sample
+
+        Args:
+            counters (dict): Cumulative values of COUNTERS; a counter that
+                went down is taken to have restarted from zero
+            gauges (dict): Instantaneous values, e.g. loss, rtt_ms, backlog
+
+        Returns:
+            dict: The sample, None for the first call, which only sets the
+                baseline
+        """
+        now = time.monotonic()
+        with self.lock:
+            last, last_time = self.last_counters, self.last_time
+            self.last_counters = {name: counters.get(name, 0) for name in COUNTERS}
+            self.last_time = now
+            if last is None or now <= last_time:
+                return None
+
+            interval = now - last_time
+            sample = {"timestamp": time.time(), "interval": round(interval, 3)}
+            for name in COUNTERS:
+                value = self.last_counters[name]
+                sample[name] = value - last[name] if value >= last[name] else value
+            sample["fps"] = round(sample["frames"] / interval, 1)
+            sample["bitrate"] = round(sample.pop("bytes") * 8 / interval / 1000)
+            sample["sent_bitrate"] = round(sample.pop("bytes_sent") * 8 / interval / 1000)
+            sample.update(gauges or {})
+            self.samples.append(sample)
+        return sample
+
+    def reset(self):
+        """Start a new baseline, e.g. after the pipeline was rebuilt"""
+        with self.lock:
+            self.last_counters = None
+            self.last_time = None
+
+    def latest(self):
+        """Get the newest sample, None if there is none yet"""
+        with self.lock:
+            return dict(self.samples[-1]) if self.samples else None
+
+    def get_series(self, since=None):
+        """Get the samples, oldest first
+
+        Args:
+            since (float): Only samples after this epoch time
+
+        Returns:
+            list: Sample dictionaries
+        """
+        with self.lock:
+            return [dict(sample) for sample in self.samples
+                    if since is None or sample["timestamp"] > since]
+
+    def summarize(self, window):
+        """Aggregate the samples of the last seconds
+
+        Counters are summed, fps, bitrates and latency averaged, and the
+        other gauges (loss, jitter, round-trip time, backlog, viewers) give
+        their worst value.
+
+        Args:
+            window (float): Seconds to look back
+
+        Returns:
+            dict: Aggregated values plus "samples", the number of samples
+                in the window
+        """
+        series = self.get_series(since=time.time() - window)
+        summary = {"samples": len(series)}
+        for sample in series:
+            for name, value in sample.items():
+                if name in ("timestamp", "interval") or value is None:
+                    continue
+                if name in COUNTERS or name in AVERAGED:
+                    summary[name] = summary.get(name, 0) + value
+                else:
+                    summary[name] = max(summary.get(name, value), value)
+
+        for name in AVERAGED:
+            if name in summary:
+                summary[name] = round(summary[name] / len(series), 1)
+        return summary
+
+if __name__ == "__main__":
+    # Set up logging for standalone testing
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # A pipeline encoding 30 fps at about 1 Mbit/s that starts dropping
+    # frames and losing packets halfway through
+    telemetry = StreamTelemetry()
+    counters = dict.fromkeys(COUNTERS, 0)
+    for second in range(6):
+        degraded = second >= 3
+        counters["frames"] += 3 if not degraded else 2
+        counters["dropped"] += 0 if not degraded else 1
+        counters["bytes"] += 12500
+        counters["bytes_sent"] += 12500
+        sample = telemetry.record(counters, {"loss": 0.08 if degraded else 0.0, "rtt_ms": 40, "backlog": 1})
+        print(f"Sample: {sample}")
+        time.sleep(0.1)
+
+    print(f"Summary: {telemetry.summarize(window=10)}")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Tests for stops from one motion session while another floods pan/tilt.
+Run with: python -m unittest test_motion_arbiter
+"""
+
+import time
+import threading
+import unittest
+
+from pelco_d import build_frame
+from camera_controller import CameraController, LoopbackTransport
+from motion_arbiter import MotionArbiter, PRIORITY_REMOTE
+
+STOP = build_frame(1, 0x00, 0x00, 0, 0)
+STOPS = 10
+
+class ForeignStopTest(unittest.TestCase):
+    """A pan/tilt flood from the owner cannot starve another session's stop"""
+
+    def check_stops_reach_wire(self, control_tick):
+        transport = LoopbackTransport(baudrate=9600, history=100000)
+        controller = CameraController(transport=transport, keepalive_interval=0, control_tick=control_tick)
+        arbiter = MotionArbiter(controller)
+        flooder = arbiter.open_session("flood", PRIORITY_REMOTE)
+        stopper = arbiter.open_session("stop", PRIORITY_REMOTE)
+        flooding = threading.Event()
+
+        def flood():
+            speed = 0
+            while flooding.is_set():
+                speed = speed % 50 + 1
+                flooder.set_pan_tilt(40 + speed, -20)
+
+        controller.start()
+        flooding.set()
+        flood_thread = threading.Thread(target=flood, daemon=True)
+        flood_thread.start()
+        try:
+            delivered = 0
+            for _ in range(STOPS):
+                time.sleep(0.05)
+                sent = time.perf_counter()
+                self.assertTrue(stopper.set_pan_tilt(0, 0))
+                deadline = sent + 1.0
+                while time.perf_counter() < deadline:
+                    if any(at > sent and data == STOP for at, data in list(transport.written)):
+                        delivered += 1
+                        break
+                    time.sleep(0.001)
+            self.assertEqual(delivered, STOPS)
+        finally:
+            flooding.clear()
+            flood_thread.join()
+            controller.stop()
+
+    def test_stop_under_flood_without_control_tick(self):
+        self.check_stops_reach_wire(0)
+
+    def test_stop_under_flood_with_control_tick(self):
+        self.check_stops_reach_wire(0.02)
+
+if __name__ == "__main__":
+    unittest.main()
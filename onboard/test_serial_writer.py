@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Tests for the serial writer's queueing of stop and motion frames.
+Run with: python -m unittest test_serial_writer
+"""
+
+import threading
+import unittest
+
+from pelco_d import build_frame
+from camera_controller import LoopbackTransport
+from serial_writer import SerialWriter
+
+ADDRESS = 1
+HOLD = build_frame(ADDRESS, 0x00, 0x07, 0x00, 0x01)  # Go to preset 1
+STOP = build_frame(ADDRESS, 0x00, 0x00)
+MOVE = build_frame(ADDRESS, 0x00, 0x04, 0x20, 0x00)  # Pan left
+
+class SerialWriterStopTest(unittest.TestCase):
+    """A queued stop is never overwritten by a newer motion frame"""
+
+    def setUp(self):
+        self.release = threading.Event()
+
+        def hold_first_write(data):
+            # Keep the writer thread busy on the first frame until released
+            if data == HOLD:
+                self.release.wait(2.0)
+            return None
+
+        self.transport = LoopbackTransport(responder=hold_first_write)
+        self.transport.open()
+        self.writer = SerialWriter(self.transport)
+        self.writer.start()
+
+    def tearDown(self):
+        self.release.set()
+        self.writer.stop()
+
+    def written_frames(self):
+        return [data for _, data in self.transport.written]
+
+    def test_move_after_stop_is_queued_behind_it(self):
+        self.writer.send(HOLD, channel=ADDRESS)
+        self.assertTrue(self.transport.wait_for_writes(1, timeout=1.0))
+
+        self.writer.send(STOP, channel=ADDRESS, coalesce=True, urgent=True)
+        self.writer.send(MOVE, channel=ADDRESS, coalesce=True)
+        self.release.set()
+
+        self.assertTrue(self.writer.wait_idle(timeout=2.0))
+        self.assertEqual(self.written_frames(), [HOLD, STOP, MOVE])
+
+    def test_moves_behind_a_stop_still_coalesce(self):
+        self.writer.send(HOLD, channel=ADDRESS)
+        self.assertTrue(self.transport.wait_for_writes(1, timeout=1.0))
+
+        newest = build_frame(ADDRESS, 0x00, 0x02, 0x30, 0x00)  # Pan right
+        self.writer.send(STOP, channel=ADDRESS, coalesce=True, urgent=True)
+        self.writer.send(MOVE, channel=ADDRESS, coalesce=True)
+        self.writer.send(newest, channel=ADDRESS, coalesce=True)
+        self.release.set()
+
+        self.assertTrue(self.writer.wait_idle(timeout=2.0))
+        self.assertEqual(self.written_frames(), [HOLD, STOP, newest])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+UDP control channel for PTZ camera joystick input.
+Over TCP a single lost segment holds back every later command until it is
+retransmitted, which makes the joystick lag on lossy WiFi. Here each
+datagram is one binary command frame (see command_protocol) carrying the
+absolute stick state and a sequence number, so any lost datagram is simply
+replaced by the next one. Out-of-order datagrams are dropped, only the
+newest state in a burst is applied, and motion stops if the datagrams stop.
+"""
+
+import time
+import socket
+import select
+import logging
+import threading
+
+from motion_arbiter import PRIORITY_REMOTE
+from command_protocol import (
+    BinaryFrameDecoder, BINARY_FRAME_LENGTH, MSG_PAN_TILT, MSG_STOP
+)
+
+logger = logging.getLogger('udp_control')
+
+# A sender silent for this long may restart its sequence numbers
+SESSION_TIMEOUT = 2.0
+
+def sequence_newer(sequence, last):
+    """Compare 16-bit sequence numbers that wrap around
+
+    Args:
+        sequence (int): Received sequence number
+        last (int): Newest sequence number applied so far
+
+    Returns:
+        bool: True if sequence comes after last
+    """
+    return 0 < (sequence - last) & 0xFFFF < 0x8000
+
+class UdpControlServer:
+    """Applies joystick state received as UDP datagrams"""
+
+    def __init__(self, camera_controller, port=8001, deadman_timeout=0.5, arbiter=None):
+        """Initialize the UDP control server
+
+        Args:
+            camera_controller: CameraController instance
+            port (int): UDP port to listen on
+            deadman_timeout (float): Seconds without a new datagram before
+                pan and tilt are stopped
+            arbiter: MotionArbiter to drive the camera through, as one
+                session shared by all UDP senders; None to drive the
+                camera controller directly
+        """
+        self.camera_controller = camera_controller
+        self.session = arbiter.open_session("udp", PRIORITY_REMOTE) if arbiter else None
+        self.port = port
+        self.deadman_timeout = deadman_timeout
+        self.running = False
+        self.server_thread = None
+        self.server_socket = None
+        self.senders = {}  # address -> (newest sequence, monotonic time received)
+        self.moving = False
+        self.last_update = 0.0
+        self.stats = {
+            "received": 0,
+            "applied": 0,
+            "stale": 0,
+            "superseded": 0,
+            "malformed": 0,
+            "unsupported": 0,
+            "deadman_stops": 0
+        }
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start the UDP control server"""
+        if self.running:
+            logger.warning("UDP control server is already running")
+            return
+
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind(('0.0.0.0', self.port))
+        self.server_socket.setblocking(False)
+        self.port = self.server_socket.getsockname()[1]
+
+        self.running = True
+        self.server_thread = threading.Thread(target=self._server_loop)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+        logger.info(f"UDP control server started on port {self.port}")
+        return True
+
+    def stop(self):
+        """Stop the UDP control server"""
+        if not self.running:
+            logger.warning("UDP control server is not running")
+            return
+
+        self.running = False
+        if self.server_thread:
+            self.server_thread.join(timeout=2.0)
+
+        if self.server_socket:
+            try:
+                self.server_socket.close()
+            except:
+                pass
+            self.server_socket = None
+
+        logger.info("UDP control server stopped")
+
+    def get_stats(self):
+        """Get datagram counters"""
+        with self.lock:
+            return dict(self.stats)
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def _server_loop(self):
+        """Receive datagrams and apply the newest state from each burst"""
+        logger.info(f"UDP control listening on 0.0.0.0:{self.port}")
+
+        while self.running:
+            timeout = 0.5
+            if self.moving:
+                timeout = max(0.0, min(timeout, self.last_update + self.deadman_timeout - time.monotonic()))
+
+            try:
+                readable, _, _ = select.select([self.server_socket], [], [], timeout)
+            except (OSError, ValueError) as e:
+                if self.running:
+                    logger.error(f"UDP control error: {e}")
+                break
+
+            if readable:
+                self._apply(self._receive_burst())
+
+            if self.moving and time.monotonic() - self.last_update > self.deadman_timeout:
+                logger.warning(f"No control datagrams for {self.deadman_timeout}s, stopping motion")
+                self._count("deadman_stops")
+                if self.session:
+                    # Only stop our own motion, never another owner's
+                    self.session.release()
+                    self.moving = False
+                else:
+                    self._set_pan_tilt(0, 0)
+
+        logger.info("UDP control loop ended")
+
+    def _receive_burst(self):
+        """Read every queued datagram and keep the newest one per sender
+
+        Returns:
+            dict: Sender address -> newest BinaryCommand accepted
+        """
+        newest = {}
+        now = time.monotonic()
+
+        while True:
+            try:
+                data, addr = self.server_socket.recvfrom(64)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                logger.warning(f"Error receiving control datagram: {e}")
+                break
+
+            self._count("received")
+            if len(data) != BINARY_FRAME_LENGTH:
+                self._count("malformed")
+                continue
+            frames = BinaryFrameDecoder().feed(data)
+            if not frames:
+                self._count("malformed")
+                continue
+            command = frames[0]
+
+            last, seen = self.senders.get(addr, (None, 0.0))
+            if last is not None and now - seen < SESSION_TIMEOUT and not sequence_newer(command.sequence, last):
+                self._count("stale")
+                continue
+
+            if addr in newest:
+                self._count("superseded")
+            newest[addr] = command
+            self.senders[addr] = (command.sequence, now)
+
+        return newest
+
+    def _apply(self, commands):
+        """Apply the newest command from each sender"""
+        for addr, command in commands.items():
+            if command.type == MSG_PAN_TILT:
+                self._set_pan_tilt(command.pan, command.tilt)
+            elif command.type == MSG_STOP:
+                self._set_pan_tilt(0, 0)
+            else:
+                # Zoom and mode changes are not repeated, so they belong on TCP
+                self._count("unsupported")
+                logger.debug(f"Ignoring command type {command.type} from {addr} on UDP")
+                continue
+
+            self._count("applied")
+            self.last_update = time.monotonic()
+
+    def _set_pan_tilt(self, pan_speed, tilt_speed):
+        try:
+            if self.session:
+                accepted = self.session.set_pan_tilt(pan_speed, tilt_speed)
+            else:
+                accepted = self.camera_controller.set_pan_tilt(pan_speed, tilt_speed) is not False
+        except Exception as e:
+            logger.error(f"Error applying UDP control state: {e}")
+            accepted = False
+        self.moving = accepted and bool(pan_speed or tilt_speed)
+
+if __name__ == "__main__":
+    # Set up logging for standalone testing
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    import random
+    from command_protocol import encode_binary_command
+
+    # Mock camera controller recording every state applied
+    class MockCameraController:
+        def __init__(self):
+            self.applied = []
+        def set_pan_tilt(self, pan_speed, tilt_speed):
+            self.applied.append((time.monotonic(), pan_speed, tilt_speed))
+
+    controller = MockCameraController()
+    server = UdpControlServer(controller, port=0, deadman_timeout=0.3)
+    server.start()
+
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = ('127.0.0.1', server.port)
+    random.seed(1)
+
+    try:
+        # Sweep the stick at 50 Hz through a link that loses 20% of the
+        # datagrams and delivers some of the rest late, out of order
+        delayed = []
+        sent = lost = late = 0
+        for step in range(200):
+            sequence = 65500 + step  # Crosses the wraparound
+            pan = int(100 * (step % 50 - 25) / 25)
+            frame = encode_binary_command(MSG_PAN_TILT, sequence, pan=pan, tilt=-pan // 2)
+            sent += 1
+            if step == 199:
+                sender.sendto(frame, address)
+            elif random.random() < 0.2:
+                lost += 1
+            elif random.random() < 0.15:
+                late += 1
+                delayed.append(frame)
+            else:
+                sender.sendto(frame, address)
+            if delayed and random.random() < 0.3:
+                sender.sendto(delayed.pop(0), address)
+            time.sleep(0.02)
+        for frame in delayed:
+            sender.sendto(frame, address)
+
+        last_pan = int(100 * (199 % 50 - 25) / 25)
+        time.sleep(0.1)
+        _, pan, tilt = controller.applied[-1]
+        print(f"Sent {sent}, lost {lost}, reordered {late}: {server.get_stats()}")
+        print(f"Final state pan={pan} tilt={tilt} (sent pan={last_pan} tilt={-last_pan // 2})")
+
+        # Deadman: leave the stick deflected and stop sending
+        sender.sendto(encode_binary_command(MSG_PAN_TILT, 200, pan=60), address)
+        time.sleep(0.1)
+        held = controller.applied[-1]
+        time.sleep(0.5)
+        stopped = controller.applied[-1]
+        print(f"Stopped {stopped[0] - held[0]:.2f}s after the last datagram: "
+              f"pan={stopped[1]} tilt={stopped[2]}")
+    finally:
+        sender.close()
+        server.stop()
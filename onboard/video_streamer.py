@@ -6,7 +6,6 @@ It supports both RGB and IR/Thermal cameras and switches between them based on
 the current mode.
 """
 
-import os
 import time
 import logging
 import threading
@@ -16,30 +15,99 @@ import socket
 import json
 from enum import Enum
 
+import rtsp_server
+import stream_pipeline
+from stream_telemetry import StreamTelemetry, COUNTERS
+
 logger = logging.getLogger('video_streamer')
 
+# RTP payloader every stream ends in; gst-rtsp-server looks for pay0
+PAYLOADER = ["rtph264pay", "name=pay0", "pt=96", "config-interval=1"]
+
+# Mount that follows the camera mode when switching instantly
+LIVE_MOUNT = "/live"
+
+# A report window is bad above these fractions of dropped or late frames
+# and of RTP packets the worst viewer lost
+MAX_DROP_RATIO = 0.05
+MAX_LOSS = 0.05
+
+# The adaptive ladder steps down when a report window has more loss,
+# round-trip time or frames waiting for the encoder (encoder_queue holds 3)
+# than this, and steps up after UPGRADE_WINDOWS windows well within them
+MAX_RTT_MS = 300
+MAX_BACKLOG = 2
+UPGRADE_WINDOWS = 3
+
 class StreamQuality(Enum):
     """Enum for stream quality"""
     LOW = 0
     MEDIUM = 1
     HIGH = 2
 
+# Frame size, frame rate and bitrate of each level as fractions of the
+# configured stream settings
+QUALITY_LADDER = {
+    StreamQuality.LOW: (1 / 2, 1 / 2, 1 / 4),
+    StreamQuality.MEDIUM: (2 / 3, 1, 1 / 2),
+    StreamQuality.HIGH: (1, 1, 1)
+}
+
 class VideoStreamer:
     """Handles video streaming from RGB and IR cameras"""
     
-    def __init__(self, camera_controller, port=8554):
+    def __init__(self, camera_controller, port=8554, width=640, height=480, framerate=30,
+                 bitrate=500, encoder="auto", mode="rtsp", instant_switch=False,
+                 quality=StreamQuality.HIGH, adaptive=True):
         """Initialize the video streamer
         
         Args:
             camera_controller: CameraController instance
             port: RTSP server port (default: 8554)
+            width (int): Stream width at HIGH quality
+            height (int): Stream height at HIGH quality
+            framerate (int): Stream frames per second at HIGH quality
+            bitrate (int): Target bitrate in kbit/s at HIGH quality
+            encoder (str): H.264 encoder element, or "auto" to use the best
+                one installed (see stream_pipeline.ENCODERS)
+            mode (str): "rtsp" to serve /rgb and /ir to any number of
+                viewers from an in-process RTSP server, "udp" to send the
+                current camera as RTP to the port with gst-launch
+            instant_switch (bool): In rtsp mode, keep both cameras capturing
+                into one encoder and serve /live, which switches between them
+                in the running stream, instead of /rgb and /ir; each camera
+                device can only be captured once, so the per-camera mounts
+                are not served then
+            quality (StreamQuality): Initial quality level
+            adaptive (bool): Move between quality levels on the measured
+                loss, round-trip time and encoder backlog
         """
+        if mode == "rtsp" and not rtsp_server.HAS_GST:
+            logger.warning("RTSP server mode needs the GStreamer Python bindings, streaming RTP over UDP")
+            mode = "udp"
+
         self.camera_controller = camera_controller
         self.port = port
+        self.width = width
+        self.height = height
+        self.framerate = framerate
+        self.bitrate = bitrate
+        self.encoder = encoder
+        self.mode = mode
+        self.instant_switch = instant_switch
+        self.quality = StreamQuality(quality)
+        self.adaptive = adaptive
+        self.good_windows = 0
+        self.active_encoder = None
+        self.failed_encoder = None
+        self.rtsp = None
         self.running = False
         self.stream_process = None
+        self.restart_lock = threading.Lock()
         self.monitoring_thread = None
         self.quality_stats = {"timestamp": time.time(), "quality": "good", "dropped_frames": 0}
+        self.telemetry = StreamTelemetry()
+        self.report_interval = 5
         self.status_report_callback = None
         
     def start(self):
@@ -66,8 +134,9 @@ class VideoStreamer:
             
         self.running = False
         
-        # Stop the stream process
-        self._stop_stream()
+        # Stop the stream process, waiting for a restart in progress
+        with self.restart_lock:
+            self._stop_stream()
         
         # Stop monitoring thread
         if self.monitoring_thread:
@@ -85,15 +154,45 @@ class VideoStreamer:
     def set_quality(self, quality):
         """Set stream quality
         
+        In rtsp mode the new frame size, rate and bitrate are applied to
+        the running encoder; gst-launch in udp mode has to be restarted.
+        
         Args:
             quality (StreamQuality or int): Stream quality level
         """
         if isinstance(quality, int):
             quality = StreamQuality(quality)
+        if quality == self.quality:
+            return
             
-        logger.info(f"Setting stream quality to {quality.name}")
-        # Restart stream with new quality settings
-        self.restart()
+        width, height, framerate, bitrate = self.get_quality_settings(quality)
+        logger.info(f"Setting stream quality to {quality.name}: "
+                    f"{width}x{height}@{framerate} at {bitrate} kbit/s")
+        self.quality = quality
+
+        if self.rtsp:
+            caps = stream_pipeline.quality_caps(self.active_encoder, width, height, framerate)
+            name, value = stream_pipeline.bitrate_setting(self.active_encoder, bitrate, framerate)
+            for path in self.rtsp.mounts:
+                self.rtsp.set_property(path, "quality_caps", "caps", caps)
+                self.rtsp.set_property(path, "encoder", name, value)
+        elif self.running:
+            self._restart_stream()
+
+    def get_quality_settings(self, quality=None):
+        """Get the encoded frame size, rate and bitrate of a quality level
+
+        Args:
+            quality (StreamQuality): Level, None for the current one
+
+        Returns:
+            tuple: (width, height, framerate, bitrate in kbit/s)
+        """
+        scale, rate, share = QUALITY_LADDER[quality or self.quality]
+        # Encoders want even frame sizes
+        width = max(2, int(self.width * scale) // 2 * 2)
+        height = max(2, int(self.height * scale) // 2 * 2)
+        return width, height, max(1, round(self.framerate * rate)), max(1, round(self.bitrate * share))
         
     def get_stream_url(self):
         """Get the RTSP stream URL for the current camera"""
@@ -101,8 +200,37 @@ class VideoStreamer:
         hostname = socket.gethostname()
         ip_address = socket.gethostbyname(hostname)
         
+        if self.mode == "rtsp" and self.instant_switch:
+            return f"rtsp://{ip_address}:{self.port}{LIVE_MOUNT}"
+
         camera_type = "rgb" if self.camera_controller.get_camera_mode() == 0 else "ir"
         return f"rtsp://{ip_address}:{self.port}/{camera_type}"
+
+    def switch_camera(self, mode):
+        """Show another camera in the stream
+
+        Registered as the camera controller's mode callback.
+
+        Args:
+            mode (int or CameraMode): 0/RGB or 1/IR
+        """
+        if not self.running:
+            return
+
+        index = getattr(mode, "value", mode)
+        camera_type = "RGB" if index == 0 else "IR"
+        if self.rtsp and self.instant_switch:
+            start = time.monotonic()
+            if self.rtsp.select_input(LIVE_MOUNT, index):
+                logger.info(f"Stream switched to {camera_type} in {(time.monotonic() - start) * 1000:.1f} ms")
+        elif self.mode == "udp":
+            # gst-launch cannot switch inputs, so the pipeline is rebuilt
+            # for the other camera; that takes seconds, so not on the
+            # caller's thread
+            logger.info(f"Restarting stream for the {camera_type} camera")
+            restart_thread = threading.Thread(target=self._restart_stream)
+            restart_thread.daemon = True
+            restart_thread.start()
         
     def set_status_report_callback(self, callback):
         """Set callback function for stream status reports
@@ -114,36 +242,134 @@ class VideoStreamer:
         
     def get_quality_report(self):
         """Get the current stream quality report"""
-        return self.quality_stats.copy()
+        report = self.quality_stats.copy()
+        report["encoder"] = self.active_encoder
+        report["mode"] = self.mode
+        report["level"] = self.quality.name
+        report["settings"] = dict(zip(("width", "height", "framerate", "bitrate"), self.get_quality_settings()))
+        if self.rtsp:
+            report.update(self.rtsp.get_stats())
+        return report
         
+    def get_telemetry(self, since=None):
+        """Get the measured stream telemetry
+
+        Args:
+            since (float): Only samples after this epoch time
+
+        Returns:
+            list: One sample per second, oldest first (see
+                stream_telemetry.StreamTelemetry.record)
+        """
+        return self.telemetry.get_series(since)
+
     def _start_stream(self):
         """Start the RTSP stream process"""
+        self.telemetry.reset()
         # Get current camera device
         device = self.camera_controller.get_current_camera_device()
         camera_type = "rgb" if self.camera_controller.get_camera_mode() == 0 else "ir"
         
+        if self.mode == "rtsp":
+            return self._start_rtsp_server()
+
         logger.info(f"Starting {camera_type.upper()} stream from {device} on port {self.port}")
         
-        # Build stream command based on platform and camera type
-        # This example uses GStreamer pipeline to create an RTSP server
+        encoder = stream_pipeline.probe_encoder(self.encoder)
+        while True:
+            if self._launch_pipeline(device, encoder):
+                self.active_encoder = encoder
+                return True
+            # A hardware encoder that cannot negotiate with this camera
+            # falls back to the next one; an explicitly chosen one does not
+            if self.encoder != "auto" or not stream_pipeline.mark_failed(encoder):
+                self.running = False
+                return False
+            encoder = stream_pipeline.probe_encoder()
+
+    def _start_rtsp_server(self):
+        """Serve both cameras, each encoded once for all of its viewers"""
+        encoder = stream_pipeline.probe_encoder(self.encoder)
+        width, height, framerate, bitrate = self.get_quality_settings()
+        logger.info(f"Starting RTSP server on port {self.port}, encoding "
+                    f"{width}x{height}@{framerate} at {bitrate} kbit/s with {encoder}")
+
         try:
-            # This is a simplified example - real implementation would have more robust error handling
-            # and would use the actual video device capabilities
-            
-            # Raspberry Pi example using v4l2src
-            cmd = [
-                "gst-launch-1.0", "-v",
-                "v4l2src", f"device={device}", "!", 
-                "video/x-raw,width=640,height=480,framerate=30/1", "!",
-                "videoconvert", "!",
-                "x264enc", "tune=zerolatency", "bitrate=500", "speed-preset=superfast", "!",
-                "rtph264pay", "name=pay0", "pt=96", "!",
-                "udpsink", f"host=0.0.0.0", f"port={self.port}"
-            ]
-            
-            # For NVIDIA Jetson, nvv4l2src might be used instead
-            if "jetson" in os.uname().machine:
-                cmd[1] = "nvv4l2src"  # Use NVIDIA's optimized source
+            self.rtsp = rtsp_server.RtspServer(self.port)
+            self.rtsp.set_failure_callback(self._on_rtsp_failure)
+            cameras = (("rgb", self.camera_controller.rgb_device), ("ir", self.camera_controller.ir_device))
+            if self.instant_switch:
+                # Both cameras stay warm; a mode change only flips the selector
+                pipeline = stream_pipeline.build_selector_pipeline(
+                    encoder, [device for _, device in cameras],
+                    self.width, self.height, self.framerate, bitrate, output=(width, height, framerate)
+                )
+                self.rtsp.add_mount(LIVE_MOUNT, " ".join(pipeline + PAYLOADER))
+                self.rtsp.select_input(LIVE_MOUNT, self.camera_controller.get_camera_mode())
+            else:
+                for camera_type, device in cameras:
+                    pipeline = stream_pipeline.build_encode_pipeline(
+                        encoder, device, self.width, self.height, self.framerate, bitrate,
+                        output=(width, height, framerate)
+                    )
+                    self.rtsp.add_mount(f"/{camera_type}", " ".join(pipeline + PAYLOADER))
+            self.rtsp.start()
+        except Exception as e:
+            logger.error(f"Error starting RTSP server: {e}")
+            self.rtsp = None
+            self.running = False
+            return False
+
+        self.active_encoder = encoder
+        return True
+
+    def _restart_stream(self):
+        """Rebuild the stream for the current camera and quality settings
+
+        Restarts requested from several threads run one after another.
+        """
+        with self.restart_lock:
+            if not self.running:
+                return
+            self._stop_stream()
+            self._start_stream()
+
+    def _on_rtsp_failure(self, path):
+        """Note that a mount's pipeline failed to start
+
+        Called from the RTSP server's main loop, which cannot stop itself,
+        so the monitor thread rebuilds the server.
+        """
+        self.failed_encoder = self.active_encoder
+
+    def _fall_back_encoder(self):
+        """Rebuild the RTSP mounts with the next encoder after one failed"""
+        encoder, self.failed_encoder = self.failed_encoder, None
+        if encoder != self.active_encoder:
+            # Reported by a server that has been rebuilt since
+            return
+        # A hardware encoder that cannot negotiate with a camera falls back
+        # to the next one; an explicitly chosen one does not
+        if self.encoder != "auto" or not stream_pipeline.mark_failed(encoder):
+            logger.error(f"Encoder {encoder} cannot stream and there is nothing to fall back to")
+            return
+        self._restart_stream()
+
+    def _launch_pipeline(self, device, encoder):
+        """Start gst-launch with the given encoder
+
+        Returns:
+            bool: True if the pipeline is running
+        """
+        width, height, framerate, bitrate = self.get_quality_settings()
+        logger.info(f"Encoding {width}x{height}@{framerate} at {bitrate} kbit/s with {encoder}")
+        try:
+            cmd = ["gst-launch-1.0", "-v"]
+            cmd += stream_pipeline.build_encode_pipeline(
+                encoder, device, self.width, self.height, self.framerate, bitrate,
+                output=(width, height, framerate)
+            )
+            cmd += PAYLOADER + ["!", "udpsink", f"host=0.0.0.0", f"port={self.port}"]
                 
             # Start process
             self.stream_process = subprocess.Popen(
@@ -158,17 +384,21 @@ class VideoStreamer:
             # Check if process is still running
             if self.stream_process.poll() is not None:
                 stderr = self.stream_process.stderr.read().decode('utf-8')
+                self.stream_process = None
                 raise Exception(f"Stream process failed to start: {stderr}")
                 
         except Exception as e:
             logger.error(f"Error starting stream: {e}")
-            self.running = False
             return False
             
         return True
         
     def _stop_stream(self):
         """Stop the RTSP stream process"""
+        if self.rtsp:
+            self.rtsp.stop()
+            self.rtsp = None
+
         if self.stream_process:
             try:
                 # Try to terminate gracefully
@@ -185,32 +415,50 @@ class VideoStreamer:
         logger.info("Stream quality monitoring started")
         
         last_check = time.time()
-        check_interval = 5  # Check every 5 seconds
         
         while self.running:
             current_time = time.time()
+            if self.failed_encoder:
+                self._fall_back_encoder()
+            self._sample_stream()
             
             # Check stream quality periodically
-            if current_time - last_check >= check_interval:
+            if current_time - last_check >= self.report_interval:
                 self._check_stream_quality()
                 last_check = current_time
                 
             time.sleep(1)
             
         logger.info("Stream quality monitoring stopped")
+
+    def _sample_stream(self):
+        """Add the pipeline's measurements to the telemetry
+
+        Counters are summed over the mounts, gauges give the worst mount.
+        gst-launch in udp mode reports nothing, so it has no telemetry.
+        """
+        if not self.rtsp:
+            return None
+
+        try:
+            stats = self.rtsp.get_stats()
+            mounts = list(stats["mounts"].values())
+            counters = {name: sum(mount.get(name, 0) for mount in mounts) for name in COUNTERS}
+            gauges = {"viewers": stats["viewers"]}
+            for name in ("latency_ms", "backlog", "loss", "jitter_ms", "rtt_ms"):
+                values = [mount[name] for mount in mounts if mount.get(name) is not None]
+                gauges[name] = max(values) if values else None
+            return self.telemetry.record(counters, gauges)
+        except Exception as e:
+            logger.error(f"Error sampling stream telemetry: {e}")
+            return None
         
     def _check_stream_quality(self):
-        """Check stream quality and update stats"""
-        # In a real implementation, this would check things like:
-        # - Dropped frames
-        # - Encoding/decoding latency
-        # - Network bandwidth utilization
-        # For this example, we'll simulate quality statistics
-        
+        """Check stream quality over the last report window and update stats"""
         # Get current timestamp
         current_time = time.time()
+        metrics = {}
         
-        # Simulate quality check
         try:
             # Check if stream process is still running
             if self.stream_process and self.stream_process.poll() is not None:
@@ -219,13 +467,13 @@ class VideoStreamer:
                 
                 # Restart the stream
                 logger.warning("Stream process died, restarting...")
-                self._start_stream()
+                self._restart_stream()
             else:
-                # Simulate some quality metrics
-                # In reality, these would come from analyzing stream performance
-                import random
-                dropped_frames = random.randint(0, 10)
-                quality = "good" if dropped_frames < 5 else "bad"
+                metrics = self.telemetry.summarize(self.report_interval)
+                dropped_frames = metrics.get("dropped", 0) + metrics.get("late", 0)
+                quality = self._assess_quality(metrics)
+                if self.adaptive and quality in ("good", "bad"):
+                    self._adapt_quality(metrics)
         except Exception as e:
             logger.error(f"Error checking stream quality: {e}")
             quality = "unknown"
@@ -235,7 +483,9 @@ class VideoStreamer:
         self.quality_stats = {
             "timestamp": current_time,
             "quality": quality,
-            "dropped_frames": dropped_frames
+            "dropped_frames": dropped_frames,
+            "level": self.quality.name,
+            "metrics": metrics
         }
         
         # Send report via callback if configured
@@ -247,6 +497,61 @@ class VideoStreamer:
                 
         logger.debug(f"Stream quality check: {quality} (dropped frames: {dropped_frames})")
 
+    def _assess_quality(self, metrics):
+        """Rate a report window of telemetry
+
+        Returns:
+            str: "good" or "bad"; "idle" without viewers and "unknown"
+                without measurements, neither of which calls for action
+        """
+        if not metrics.get("samples"):
+            return "unknown"
+        if not metrics.get("viewers"):
+            return "idle"
+
+        frames = metrics.get("frames", 0)
+        if frames == 0:
+            # Viewers are connected but nothing comes out of the encoder
+            return "bad"
+
+        dropped = metrics.get("dropped", 0)
+        drop_ratio = (dropped + metrics.get("late", 0)) / (frames + dropped)
+        loss = metrics.get("loss") or 0
+        return "bad" if drop_ratio > MAX_DROP_RATIO or loss > MAX_LOSS else "good"
+
+    def _adapt_quality(self, metrics):
+        """Step the quality ladder on a report window of telemetry
+
+        One bad window steps down at once; stepping up waits for
+        UPGRADE_WINDOWS clean windows in a row, so the stream does not
+        oscillate around the link's capacity.
+        """
+        levels = list(StreamQuality)
+        position = levels.index(self.quality)
+        loss = metrics.get("loss") or 0
+        rtt = metrics.get("rtt_ms") or 0
+        backlog = metrics.get("backlog") or 0
+        frames = metrics.get("frames", 0)
+        dropped = metrics.get("dropped", 0) + metrics.get("late", 0)
+
+        if (loss > MAX_LOSS or rtt > MAX_RTT_MS or backlog >= MAX_BACKLOG or
+                dropped > (frames + dropped) * MAX_DROP_RATIO):
+            self.good_windows = 0
+            if position > 0:
+                logger.warning(f"Stream degraded (loss {loss:.1%}, rtt {rtt} ms, backlog {backlog}, "
+                               f"dropped {dropped}), lowering quality")
+                self.set_quality(levels[position - 1])
+            return
+
+        if loss < MAX_LOSS / 5 and rtt < MAX_RTT_MS / 2 and backlog < MAX_BACKLOG and dropped == 0:
+            self.good_windows += 1
+            if self.good_windows >= UPGRADE_WINDOWS and position < len(levels) - 1:
+                self.good_windows = 0
+                logger.info("Stream has been clean, raising quality")
+                self.set_quality(levels[position + 1])
+        else:
+            self.good_windows = 0
+
 if __name__ == "__main__":
     # Set up logging for standalone testing
     logging.basicConfig(
@@ -256,6 +561,8 @@ if __name__ == "__main__":
     
     # Mock camera controller for testing
     class MockCameraController:
+        rgb_device = "/dev/video0"
+        ir_device = "/dev/video1"
         def get_current_camera_device(self):
             return "/dev/video0"
         def get_camera_mode(self):
@@ -10,21 +10,34 @@ import time
 import logging
 import threading
 import socket
-import json
 import select
 
+from command_protocol import CommandStream, ClientWriter, FanoutStats, encode_status
+from command_registry import CommandRegistry
+from motion_arbiter import PRIORITY_REMOTE
+
 logger = logging.getLogger('wifi_server')
 
 class WifiServer:
     """WiFi server for PTZ camera control"""
     
-    def __init__(self, camera_controller, video_streamer, port=8000):
+    def __init__(self, camera_controller, video_streamer, port=8000, queue_size=8, backlog_limit=5.0,
+                 arbiter=None, broadcaster=None):
         """Initialize the WiFi server
         
         Args:
             camera_controller: CameraController instance
             video_streamer: VideoStreamer instance
             port: TCP server port (default: 8000)
+            queue_size: Status messages queued per client before the oldest
+                is dropped
+            backlog_limit: Seconds a client may fall behind on status
+                messages before it is disconnected
+            arbiter: MotionArbiter giving each client its own motion
+                session, None to drive the camera controller directly
+            broadcaster: StatusBroadcaster that encodes status updates once
+                for the clients of every transport, None to send them to
+                this server's clients only
         """
         self.camera_controller = camera_controller
         self.video_streamer = video_streamer
@@ -32,7 +45,14 @@ class WifiServer:
         self.running = False
         self.server_thread = None
         self.server_socket = None
-        self.clients = []
+        self.clients = {}  # client socket -> ClientWriter
+        self.queue_size = queue_size
+        self.backlog_limit = backlog_limit
+        self.fanout_stats = FanoutStats()
+        self.arbiter = arbiter
+        self.broadcaster = broadcaster
+        self.commands = CommandRegistry(camera_controller)
+        self.commands.register("status", self._send_status_report)
         self.lock = threading.Lock()
         self.connection_quality = "good"  # Initial quality status
         self.bad_quality_count = 0
@@ -68,12 +88,13 @@ class WifiServer:
         
         # Close all client connections
         with self.lock:
-            for client_socket, _ in self.clients:
+            for client_socket, writer in self.clients.items():
+                writer.stop()
                 try:
                     client_socket.close()
                 except:
                     pass
-            self.clients = []
+            self.clients = {}
             
         # Close server socket
         if self.server_socket:
@@ -92,38 +113,50 @@ class WifiServer:
     def send_status(self, status):
         """Send a status update to all connected clients
         
+        The message is queued for each client's writer thread, so a slow
+        client never delays the caller or the other clients.
+        
         Args:
             status: Status data dictionary to send
         """
         if not self.running:
             return
             
-        # Convert to JSON
+        if self.broadcaster:
+            self.broadcaster.publish(status)
+            return
+            
         try:
-            status_json = json.dumps(status)
+            message = encode_status(status)
         except Exception as e:
             logger.error(f"Error serializing status data: {e}")
             return
             
-        # Send to all clients
+        self.send_encoded(message)
+        
+    def send_encoded(self, message):
+        """Send an already encoded status message to all connected clients
+        
+        Every client is handed the same buffer; nothing is copied per client.
+        
+        Args:
+            message (bytes): Framed message from encode_status()
+        """
+        if not self.running:
+            return
+            
+        timestamp = time.perf_counter()
         with self.lock:
-            disconnected = []
-            for client_socket, client_addr in self.clients:
-                try:
-                    message = status_json.encode('utf-8') + b'\n'
-                    client_socket.sendall(message)
-                except Exception as e:
-                    logger.warning(f"Error sending status to {client_addr}: {e}")
-                    disconnected.append((client_socket, client_addr))
-                    
-            # Remove disconnected clients
-            for client in disconnected:
-                self.clients.remove(client)
-                try:
-                    client[0].close()
-                except:
-                    pass
-                logger.info(f"Client disconnected: {client[1]}")
+            writers = list(self.clients.values())
+            
+        for writer in writers:
+            writer.send(message, timestamp)
+            
+    def get_fanout_stats(self):
+        """Get status delivery statistics for the connected clients"""
+        stats = self.fanout_stats.get_stats()
+        stats["clients"] = len(self.clients)
+        return stats
         
     def _server_loop(self):
         """Main server loop that handles TCP connections"""
@@ -149,8 +182,14 @@ class WifiServer:
                     client_socket, client_addr = self.server_socket.accept()
                     client_socket.settimeout(0.5)  # Set timeout for recv
                     
+                    writer = ClientWriter(
+                        client_socket, client_addr, self.fanout_stats,
+                        queue_size=self.queue_size,
+                        backlog_limit=self.backlog_limit
+                    )
+                    writer.start()
                     with self.lock:
-                        self.clients.append((client_socket, client_addr))
+                        self.clients[client_socket] = writer
                     
                     logger.info(f"New client connected: {client_addr}")
                     
@@ -187,6 +226,8 @@ class WifiServer:
     def _handle_client(self, client_socket, client_addr):
         """Handle communication with a connected client"""
         logger.info(f"Client handler started for {client_addr}")
+        stream = CommandStream()
+        commands, session = self._open_commands(client_addr)
         
         try:
             while self.running:
@@ -197,23 +238,20 @@ class WifiServer:
                     
                     if ready_to_read:
                         # Receive data
-                        data = client_socket.recv(1024)
+                        data = client_socket.recv(4096)
                         
                         if not data:
-                            # Client disconnected
+                            # Client disconnected, a last command may lack its newline
+                            commands.apply_commands(stream.flush())
                             logger.info(f"Client disconnected: {client_addr}")
                             break
                             
-                        # Process received data
-                        try:
-                            # Try to parse as JSON
-                            command = json.loads(data.decode('utf-8').strip())
-                            self._process_command(command)
-                        except json.JSONDecodeError:
-                            # Not valid JSON, try processing as text
-                            text_command = data.decode('utf-8').strip()
-                            if text_command:
-                                self._process_text_command(text_command)
+                        # A read can hold several commands or part of one
+                        messages = stream.feed(data)
+                        reply = stream.pop_reply()
+                        if reply:
+                            self._send_to_client(client_socket, reply)
+                        commands.apply_commands(messages)
                         
                 except socket.timeout:
                     # No data received, continue
@@ -225,10 +263,13 @@ class WifiServer:
         except Exception as e:
             logger.error(f"Client handler error: {e}")
         finally:
-            # Remove client from list and close socket
+            # Remove client and stop its writer before closing the socket
             with self.lock:
-                if (client_socket, client_addr) in self.clients:
-                    self.clients.remove((client_socket, client_addr))
+                writer = self.clients.pop(client_socket, None)
+            if writer:
+                writer.stop()
+            if session:
+                session.close()
                     
             try:
                 client_socket.close()
@@ -237,81 +278,48 @@ class WifiServer:
                 
             logger.info(f"Client handler ended for {client_addr}")
             
-    def _process_command(self, command):
-        """Process a JSON command received from a client"""
-        logger.debug(f"Received command: {command}")
+    def _open_commands(self, client_addr):
+        """Get the command registry for a new client
         
-        if not isinstance(command, dict):
-            logger.warning(f"Invalid command format: {command}")
-            return
-            
-        # Forward to camera controller
-        try:
-            self.camera_controller.process_command(command)
-        except Exception as e:
-            logger.error(f"Error processing command: {e}")
-            
-    def _process_text_command(self, command):
-        """Process a text command received from a client"""
-        logger.debug(f"Received text command: {command}")
-        
-        # Parse simple text commands
-        cmd_parts = command.split()
-        if not cmd_parts:
-            return
+        Returns:
+            tuple: (CommandRegistry, MotionSession or None); with an arbiter
+                the client's motion commands go through its own session
+        """
+        if not self.arbiter:
+            return self.commands, None
+        session = self.arbiter.open_session(f"wifi {client_addr[0]}:{client_addr[1]}", PRIORITY_REMOTE)
+        return self.commands.bind(session), session
             
-        cmd_type = cmd_parts[0].lower()
-        
-        try:
-            if cmd_type == "pan":
-                # pan <speed>
-                if len(cmd_parts) > 1:
-                    speed = int(cmd_parts[1])
-                    self.camera_controller.set_pan(speed)
-                    
-            elif cmd_type == "tilt":
-                # tilt <speed>
-                if len(cmd_parts) > 1:
-                    speed = int(cmd_parts[1])
-                    self.camera_controller.set_tilt(speed)
-                    
-            elif cmd_type == "zoom":
-                # zoom <level>
-                if len(cmd_parts) > 1:
-                    level = int(cmd_parts[1])
-                    self.camera_controller.set_zoom(level)
-                    
-            elif cmd_type == "mode":
-                # mode <0|1>
-                if len(cmd_parts) > 1:
-                    mode = int(cmd_parts[1])
-                    self.camera_controller.set_camera_mode(mode)
-                    
-            elif cmd_type == "stop":
-                # stop - stop all movement
-                self.camera_controller.set_pan(0)
-                self.camera_controller.set_tilt(0)
-                
-            elif cmd_type == "status":
-                # status - request status report
-                self._send_status_report()
-                
-        except Exception as e:
-            logger.error(f"Error processing text command: {e}")
+    def _send_to_client(self, client_socket, message):
+        """Queue an encoded message for a single client"""
+        with self.lock:
+            writer = self.clients.get(client_socket)
+        if writer:
+            writer.send(message, time.perf_counter())
             
     def _send_status_report(self):
         """Send a status report to all clients"""
-        # Get current status information
+        if self.broadcaster:
+            # One report for the clients of every transport
+            self.broadcaster.publish()
+        else:
+            self.send_status(self.get_status())
+            
+    def get_status(self):
+        """Get the status report for this server's clients"""
         status = {
             "camera_mode": self.camera_controller.get_camera_mode(),
+            "position": self.camera_controller.get_position(),
             "stream_url": self.video_streamer.get_stream_url(),
             "stream_quality": self.video_streamer.get_quality_report(),
             "connection_quality": self.connection_quality,
+            "status_fanout": self.get_fanout_stats(),
+            "commands": self.commands.get_stats(),
             "timestamp": time.time()
         }
-        
-        # Send to all clients
-        self.send_status(status)
+        if self.arbiter:
+            status["motion"] = self.arbiter.get_stats()
+        return status
         
     def _handle_quality_report(self, quality_data):
         """Handle quality report from video streamer"""
@@ -402,12 +410,16 @@ if __name__ == "__main__":
             print(f"Pan speed: {speed}")
         def set_tilt(self, speed):
             print(f"Tilt speed: {speed}")
+        def set_pan_tilt(self, pan_speed, tilt_speed):
+            print(f"Pan/tilt speed: {pan_speed}/{tilt_speed}")
         def set_zoom(self, level):
             print(f"Zoom level: {level}")
         def set_camera_mode(self, mode):
             print(f"Camera mode: {mode}")
         def get_camera_mode(self):
             return 0
+        def get_position(self):
+            return {"pan": 0.0, "tilt": 0.0, "zoom": 0, "timestamp": time.time()}
     
     class MockVideoStreamer:
         def set_status_report_callback(self, callback):
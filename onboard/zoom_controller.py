@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Zoom position control for Pelco-D cameras.
+Pelco-D motion commands only zoom in or out, so reaching a zoom level takes
+a model of where the lens is. This module keeps that model: it is driven in
+timed bursts sized from the calibrated wide-to-tele travel time, and each
+burst is corrected with the position the camera reports, so a request
+converges in one move instead of repeated +/- taps. Cameras that implement
+the absolute zoom command are sent the target position directly.
+"""
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger('zoom_controller')
+
+# Extra travel, in percent of the range, when the target is an end stop.
+# Driving into the stop resyncs the model with the real lens.
+END_STOP_MARGIN = 10.0
+
+class ZoomController:
+    """Moves the zoom to absolute levels on the 0-100 scale"""
+
+    def __init__(self, drive, camera=None, travel_time=5.0, zoom_min=0, zoom_max=0xFFFF,
+                 absolute=False, tolerance=2.0, max_corrections=3, feedback_timeout=0.5):
+        """Initialize the zoom controller
+
+        Args:
+            drive: Function called with 1 (zoom in), -1 (zoom out) or 0 (hold)
+            camera: PelcoCamera used for position feedback and absolute zoom,
+                None to run open loop
+            travel_time (float): Seconds the lens takes from wide to full zoom
+            zoom_min (int): Raw zoom position reported at wide angle
+            zoom_max (int): Raw zoom position reported at full zoom
+            absolute (bool): Camera supports the absolute zoom command
+            tolerance (float): Acceptable error in percent of the zoom range
+            max_corrections (int): Feedback-corrected bursts per request
+            feedback_timeout (float): Seconds to wait for a position reply
+        """
+        self.drive = drive
+        self.camera = camera
+        self.travel_time = travel_time
+        self.zoom_min = zoom_min
+        self.zoom_max = zoom_max
+        self.absolute = absolute
+        self.tolerance = tolerance
+        self.max_corrections = max_corrections
+        self.feedback_timeout = feedback_timeout
+        self.level = 0.0  # Estimated lens level
+        self.target = None
+        self.direction = 0
+        self.burst_start = None
+        self.corrections = 0
+        self.reported_position = None
+        self.feedback_count = 0
+        self.calibrating = False
+        self.condition = threading.Condition()
+        self.running = False
+        self.zoom_thread = None
+
+    def start(self):
+        """Start the zoom control thread"""
+        if self.running:
+            logger.warning("Zoom controller is already running")
+            return
+
+        self.running = True
+        self.zoom_thread = threading.Thread(target=self._zoom_loop)
+        self.zoom_thread.daemon = True
+        self.zoom_thread.start()
+
+    def stop(self):
+        """Stop the zoom control thread and hold the zoom"""
+        if not self.running:
+            return
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.zoom_thread:
+            self.zoom_thread.join(timeout=2.0)
+
+    def set_target(self, level):
+        """Start moving the zoom to a level
+
+        Args:
+            level (float): Zoom level from 0 (wide) to 100 (full zoom)
+        """
+        with self.condition:
+            self.target = max(0.0, min(100.0, float(level)))
+            self.corrections = 0
+            self.condition.notify_all()
+
+    def get_level(self):
+        """Get the estimated current zoom level, including any move in progress"""
+        with self.condition:
+            level = self.level
+            if self.direction and self.burst_start is not None:
+                level += self.direction * (time.monotonic() - self.burst_start) / self.travel_time * 100.0
+            return max(0.0, min(100.0, level))
+
+    def update_position(self, position):
+        """Update the model from a zoom position reported by the camera
+
+        Args:
+            position (int): Raw 16-bit zoom position
+        """
+        with self.condition:
+            self.reported_position = position
+            self.feedback_count += 1
+            if not self.calibrating:
+                self.level = self._to_level(position)
+                if self.direction:
+                    self.burst_start = time.monotonic()
+            self.condition.notify_all()
+
+    def calibrate(self, settle=0.2, timeout=30.0):
+        """Measure the zoom range and full-range travel time
+
+        Drives the lens to wide angle and then to full zoom, reading the
+        position until it stops changing at each end. Needs a camera that
+        reports its zoom position. The lens is left at full zoom.
+
+        Args:
+            settle (float): Seconds between position readings
+            timeout (float): Maximum seconds for each end of the travel
+
+        Returns:
+            float: Measured travel time in seconds, or None on failure
+        """
+        if not self.camera:
+            logger.warning("Zoom calibration needs position feedback from a camera")
+            return None
+
+        with self.condition:
+            self.calibrating = True
+            self._integrate()
+            self._set_direction(0)
+            self.condition.notify_all()
+
+        try:
+            self.drive(-1)
+            wide, _ = self._wait_for_end(settle, timeout)
+            start = time.monotonic()
+            self.drive(1)
+            tele, reached = self._wait_for_end(settle, timeout)
+        finally:
+            self.drive(0)
+
+        with self.condition:
+            self.calibrating = False
+            if wide is None or tele is None or tele <= wide:
+                logger.warning(f"Zoom calibration failed (wide={wide}, tele={tele})")
+                self.condition.notify_all()
+                return None
+
+            self.zoom_min = wide
+            self.zoom_max = tele
+            self.travel_time = reached - start
+            self.level = 100.0
+            self.condition.notify_all()
+
+        logger.info(f"Zoom calibrated: positions {wide}-{tele}, travel time {self.travel_time:.2f}s")
+        return self.travel_time
+
+    def _to_level(self, position):
+        """Convert a raw zoom position to the 0-100 scale"""
+        span = self.zoom_max - self.zoom_min
+        if span <= 0:
+            return self.level
+        return max(0.0, min(100.0, (position - self.zoom_min) * 100.0 / span))
+
+    def _to_position(self, level):
+        """Convert a 0-100 level to a raw zoom position"""
+        return int(round(self.zoom_min + level / 100.0 * (self.zoom_max - self.zoom_min)))
+
+    def _query_position(self):
+        """Ask the camera for its position and wait for the zoom reply
+
+        Returns:
+            int: Raw zoom position, or None if the camera did not answer
+        """
+        with self.condition:
+            count = self.feedback_count
+            self.camera.query_position()
+            if self.condition.wait_for(lambda: self.feedback_count != count,
+                                       self.feedback_timeout):
+                return self.reported_position
+            return None
+
+    def _wait_for_end(self, settle, timeout):
+        """Wait until the reported zoom position stops changing
+
+        Returns:
+            tuple: (raw position, monotonic time it was first reported), or
+                (None, None) on timeout
+        """
+        previous, reached = None, None
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            position = self._query_position()
+            if position is not None and position == previous:
+                return position, reached
+            if position != previous:
+                previous, reached = position, time.monotonic()
+            time.sleep(settle)
+        return None, None
+
+    def _set_direction(self, direction):
+        """Drive the lens if the direction changed (call with the lock held)"""
+        if direction != self.direction:
+            self.drive(direction)
+            self.direction = direction
+        self.burst_start = time.monotonic() if direction else None
+
+    def _integrate(self):
+        """Advance the estimated level by the time driven since the last update"""
+        if self.direction and self.burst_start is not None:
+            now = time.monotonic()
+            self.level += self.direction * (now - self.burst_start) / self.travel_time * 100.0
+            self.level = max(0.0, min(100.0, self.level))
+            self.burst_start = now
+
+    def _zoom_loop(self):
+        """Drive the lens towards the target until it is reached
+
+        Each burst lasts as long as the model says the remaining distance
+        takes. The camera is then asked where the lens really stopped and a
+        shorter correcting burst follows if it is still off target.
+        """
+        logger.info("Zoom control loop started")
+
+        with self.condition:
+            while self.running:
+                if self.target is None or self.calibrating:
+                    self.condition.wait()
+                    continue
+
+                target = self.target
+                if self.absolute and self.camera:
+                    self._set_direction(0)
+                    self.camera.set_zoom_position(self._to_position(target))
+                    self.level = target
+                    self.target = None
+                    continue
+
+                error = target - self.level
+                if abs(error) <= self.tolerance:
+                    self._set_direction(0)
+                    self.target = None
+                    continue
+
+                direction = 1 if error > 0 else -1
+                distance = abs(error)
+                if target in (0.0, 100.0):
+                    distance += END_STOP_MARGIN
+                self._set_direction(direction)
+
+                # Wake early for a new target or position feedback, both of
+                # which change how much further the lens has to go
+                count = self.feedback_count
+                interrupted = self.condition.wait_for(
+                    lambda: (self.target != target or self.feedback_count != count
+                             or self.calibrating or not self.running),
+                    distance / 100.0 * self.travel_time)
+                self._integrate()
+                if interrupted:
+                    continue
+
+                self._set_direction(0)
+
+                if self.camera and self.corrections < self.max_corrections:
+                    self.corrections += 1
+                    count = self.feedback_count
+                    self.camera.query_position()
+                    if self.condition.wait_for(
+                            lambda: self.feedback_count != count or self.target != target,
+                            self.feedback_timeout):
+                        continue
+
+                # Open loop, or out of corrections: the estimate has to do
+                if self.target == target:
+                    self.level = target
+                    self.target = None
+
+            self._set_direction(0)
+
+        logger.info("Zoom control loop ended")
+
+if __name__ == "__main__":
+    # Set up logging for standalone testing
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    from pelco_d import (ResponseDecoder, build_frame, CMD2_ZOOM_IN, CMD2_ZOOM_OUT, CMD2_QUERY_PAN,
+                         CMD2_QUERY_TILT, CMD2_QUERY_ZOOM)
+    from camera_controller import CameraController, LoopbackTransport
+
+    class SimulatedLens:
+        """Zoom lens that answers Pelco-D position queries, 0-0x4000 in 3.2s
+
+        The head does not move, so pan and tilt are always reported as 0.
+        """
+
+        def __init__(self, travel_time=3.2, maximum=0x4000):
+            self.travel_time = travel_time
+            self.maximum = maximum
+            self.position = 0.0
+            self.direction = 0
+            self.updated = time.monotonic()
+            self.decoder = ResponseDecoder()
+
+        def _advance(self):
+            now = time.monotonic()
+            self.position += self.direction * (now - self.updated) / self.travel_time * self.maximum
+            self.position = max(0.0, min(float(self.maximum), self.position))
+            self.updated = now
+
+        def __call__(self, data):
+            reply = b''
+            for frame in self.decoder.feed(data):
+                self._advance()
+                if frame.command_2 == CMD2_QUERY_ZOOM:
+                    position = int(self.position)
+                    reply += build_frame(frame.address, 0x00, 0x5D, position >> 8, position & 0xFF)
+                elif frame.command_2 == CMD2_QUERY_PAN:
+                    reply += build_frame(frame.address, 0x00, 0x59)
+                elif frame.command_2 == CMD2_QUERY_TILT:
+                    reply += build_frame(frame.address, 0x00, 0x5B)
+                elif not frame.command_2 & 0x01:
+                    self.direction = (1 if frame.command_2 & CMD2_ZOOM_IN else
+                                      -1 if frame.command_2 & CMD2_ZOOM_OUT else 0)
+            return reply
+
+    lens = SimulatedLens()
+    controller = CameraController(transport=LoopbackTransport(responder=lens),
+                                  zoom_travel_time=5.0)
+    controller.start()
+
+    try:
+        print(f"Calibrated travel time: {controller.calibrate_zoom():.2f}s (lens: {lens.travel_time}s)")
+
+        for level in (25, 80, 40, 0):
+            controller.set_zoom(level)
+            time.sleep(lens.travel_time + 1.0)
+            lens._advance()
+            print(f"Requested {level:3d}%, lens at {lens.position / lens.maximum * 100:5.1f}%")
+    finally:
+        controller.stop()